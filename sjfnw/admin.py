@@ -6,6 +6,8 @@ from django.contrib.auth.admin import UserAdmin
 from django.contrib.auth.models import User, Group, Permission
 from django.contrib.contenttypes.models import ContentType
 
+from sjfnw.cache import year_cache
+
 logger = logging.getLogger('sjfnw')
 
 # Configure admin site
@@ -35,6 +37,9 @@ class YearFilter(admin.SimpleListFilter):
                     (required if the model being filtered != the filter_model)
       title: displayed in filters sidebar (default: 'year')
       parameter_name: query parameter name (default: 'year')
+
+    Years are cached in sjfnw.cache.year_cache, so the filter_model must
+    invalidate it when saved.
   """
   title = 'year'
   parameter_name = 'year'
@@ -43,16 +48,7 @@ class YearFilter(admin.SimpleListFilter):
   intermediate = ''
 
   def lookups(self, request, model_admin):
-    dates = (self.filter_model.objects
-        .values_list(self.field, flat=True)
-        .order_by('-%s' % self.field))
-    prev = None
-    years = []
-    for date in dates:
-      if date.year != prev:
-        years.append((date.year, date.year))
-        prev = date.year
-    return years
+    return [(year, year) for year in year_cache.years(self.filter_model, self.field)]
 
   def queryset(self, request, queryset):
     val = self.value()
@@ -0,0 +1,194 @@
+import logging
+
+from django import forms
+from django.conf import settings
+from django.core.urlresolvers import reverse
+from django.db.models import Q
+from django.forms.models import BaseInlineFormSet
+from django.forms.utils import flatatt
+from django.utils.functional import cached_property
+from django.utils.dateparse import parse_date
+from django.utils.html import format_html
+from django.utils.http import urlencode
+
+from sjfnw.fund.models import Member, Membership
+from sjfnw.grants import search
+from sjfnw.grants.models import GrantApplication, Organization
+
+logger = logging.getLogger('sjfnw')
+
+# Autocomplete
+# ------------
+# Admin foreign key fields with too many options to list use AutocompleteWidget
+# instead of a select. As staff type, static/js/autocomplete.js fetches
+# matching objects from sjfnw.views.autocomplete a page at a time:
+#
+#   /admin/autocomplete/<source>/?q=<text>&page=<n>
+#   {"results": [{"id": pk, "text": label}, ...], "more": true/false}
+#
+# Each source searches by indexed columns: org names through
+# sjfnw.grants.search and member names and emails by prefix. A widget's params
+# are added to its url, and the source can use them to narrow results (see
+# AutocompleteSource.filter).
+#
+# The widget shows the label of its current object. Inline formsets should use
+# AutocompleteFormSetMixin, which looks up labels for all of their forms at
+# once; otherwise each widget looks up its own.
+
+PAGE_SIZE = 20
+
+
+def _member_filter(query, prefix=''):
+  """ Q matching members with a first name, last name or email starting with
+    each word of query """
+  condition = Q()
+  for word in query.split():
+    condition &= (Q(**{prefix + 'first_name__istartswith': word}) |
+                  Q(**{prefix + 'last_name__istartswith': word}) |
+                  Q(**{prefix + 'email__istartswith': word}))
+  return condition
+
+
+class AutocompleteSource(object):
+  """ Searchable objects for autocomplete. Subclasses set model and define
+    search(query), which returns an ordered queryset of matches """
+  model = None
+
+  def queryset(self):
+    return self.model.objects.all()
+
+  def filter(self, queryset, params):
+    """ Narrow search results using the request's query params. Raises
+      ValueError if they are invalid """
+    return queryset
+
+  def label(self, obj):
+    return unicode(obj)
+
+
+class MemberSource(AutocompleteSource):
+  model = Member
+
+  def search(self, query):
+    return self.queryset().filter(_member_filter(query)).order_by('first_name', 'last_name')
+
+
+class MembershipSource(AutocompleteSource):
+  model = Membership
+
+  def queryset(self):
+    return Membership.objects.select_related('member', 'giving_project')
+
+  def search(self, query):
+    return (self.queryset().filter(_member_filter(query, prefix='member__'))
+                           .order_by('-giving_project__fundraising_deadline', 'member'))
+
+
+class GrantApplicationSource(AutocompleteSource):
+  model = GrantApplication
+
+  def queryset(self):
+    return GrantApplication.objects.select_related('organization', 'grant_cycle')
+
+  def search(self, query):
+    return (self.queryset().filter(organization__in=search.matching_organizations(query))
+                           .order_by('-submission_time'))
+
+  def filter(self, queryset, params):
+    """ submitted_after: YYYY-MM-DD """
+    if params.get('submitted_after'):
+      submitted_after = parse_date(params['submitted_after'])
+      if submitted_after is None:
+        raise ValueError('Invalid date')
+      queryset = queryset.filter(submission_time__gte=submitted_after)
+    return queryset
+
+
+class OrganizationSource(AutocompleteSource):
+  model = Organization
+
+  def search(self, query):
+    return (self.queryset().filter(Q(pk__in=search.matching_organizations(query)) |
+                                   Q(email__istartswith=query.strip()))
+                           .order_by('name'))
+
+
+SOURCES = {
+  'member': MemberSource(),
+  'membership': MembershipSource(),
+  'grantapplication': GrantApplicationSource(),
+  'organization': OrganizationSource()
+}
+
+
+class AutocompleteWidget(forms.Widget):
+  """ Text input that searches a source and stores the chosen object's pk
+
+    Used with ModelChoiceField; its choices are never listed. """
+
+  def __init__(self, source, attrs=None, params=None):
+    super(AutocompleteWidget, self).__init__(attrs)
+    self.source = source
+    self.params = params or {} # added to search requests, see AutocompleteSource.filter
+    self.choices = ()
+    self.labels = None # pk string to label, if looked up already (see load_labels)
+
+  @property
+  def media(self):
+    extra = '' if settings.DEBUG else '.min'
+    return forms.Media(
+      js=['admin/js/jquery%s.js' % extra, 'admin/js/jquery.init.js', 'js/autocomplete.js'])
+
+  def render(self, name, value, attrs=None):
+    attrs = self.build_attrs(attrs, type='hidden', name=name)
+    label = ''
+    if value:
+      if self.labels is not None and unicode(value) in self.labels:
+        label = self.labels[unicode(value)]
+      else:
+        source = SOURCES[self.source]
+        obj = source.queryset().filter(pk=value).first()
+        label = source.label(obj) if obj else ''
+      attrs['value'] = value
+    url = reverse('sjfnw.views.autocomplete', kwargs={'source': self.source})
+    if self.params:
+      url += '?' + urlencode(self.params)
+    return format_html(
+        u'<span class="autocomplete" data-url="{}">'
+        u'<input{}><input type="text" class="autocomplete-text" value="{}" size="40" '
+        u'placeholder="Type to search" autocomplete="off">'
+        u'<ul class="autocomplete-results"></ul></span>',
+        url, flatatt(attrs), label)
+
+
+def load_labels(forms):
+  """ Look up labels for the autocomplete fields of forms, one query per field """
+  if not forms:
+    return
+  for name, field in forms[0].fields.items():
+    # admin wraps the widget to add related object links
+    widget = getattr(field.widget, 'widget', field.widget)
+    if not isinstance(widget, AutocompleteWidget):
+      continue
+    values = set(unicode(form[name].value()) for form in forms)
+    values = [value for value in values if value.isdigit()]
+    source = SOURCES[widget.source]
+    labels = dict.fromkeys(values, '')
+    for pk, obj in source.queryset().in_bulk(values).items():
+      labels[unicode(pk)] = source.label(obj)
+    for form in forms:
+      getattr(form.fields[name].widget, 'widget', form.fields[name].widget).labels = labels
+
+
+class AutocompleteFormSetMixin(object):
+  """ Formset mixin that loads autocomplete labels for all of its forms together """
+
+  @cached_property
+  def forms(self):
+    forms = super(AutocompleteFormSetMixin, self).forms
+    load_labels(forms)
+    return forms
+
+
+class AutocompleteInlineFormSet(AutocompleteFormSetMixin, BaseInlineFormSet):
+  pass
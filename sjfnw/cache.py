@@ -0,0 +1,70 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.memcached import BaseMemcachedCache
+from django.db.models import DateTimeField
+
+from google.appengine.api import memcache
+
+
+class AppEngineMemcache(BaseMemcachedCache):
+  """ Cache backend using App Engine's memcache service, which is shared by all
+    instances. Its client has the same interface as python-memcache's """
+
+  def __init__(self, server, params):
+    super(AppEngineMemcache, self).__init__(server, params, library=memcache,
+                                            value_not_found_exception=ValueError)
+
+
+class YearCache(object):
+  """ Caches the distinct years of a model's date fields, for admin year filters
+
+    Uses a local memory cache unless settings.YEAR_FILTER_CACHE names one of
+    settings.CACHES. Local entries expire after local_timeout, since saves on
+    other instances can't invalidate them.
+
+    A model's entry is invalidated whenever one of its objects is saved or
+    deleted (see sjfnw.fund.signals and sjfnw.grants.signals).
+  """
+  key_prefix = 'admin-years'
+  local_timeout = 600
+
+  def __init__(self):
+    self._local = LocMemCache(self.key_prefix, {'TIMEOUT': self.local_timeout})
+
+  @property
+  def backend(self):
+    alias = getattr(settings, 'YEAR_FILTER_CACHE', None)
+    return caches[alias] if alias else self._local
+
+  def _key(self, model):
+    return '{}:{}.{}'.format(self.key_prefix, model._meta.app_label, model._meta.model_name)
+
+  def years(self, model, field_name):
+    """ Returns the years that have a value of the given date or datetime
+      field, most recent first """
+    key = self._key(model)
+    cached = self.backend.get(key) or {}
+    if field_name not in cached:
+      cached[field_name] = self._query(model, field_name)
+      timeout = self.local_timeout if self.backend is self._local else None
+      self.backend.set(key, cached, timeout)
+    return cached[field_name]
+
+  def _query(self, model, field_name):
+    """ Let the database truncate dates to years and remove duplicates,
+      instead of loading every value """
+    field = model._meta.get_field(field_name)
+    if isinstance(field, DateTimeField):
+      dates = model.objects.datetimes(field_name, 'year', order='DESC')
+    else:
+      dates = model.objects.dates(field_name, 'year', order='DESC')
+    return [date.year for date in dates]
+
+  def invalidate(self, model):
+    self.backend.delete(self._key(model))
+
+  def clear(self):
+    self.backend.clear()
+
+year_cache = YearCache()
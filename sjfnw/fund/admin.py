@@ -1,6 +1,6 @@
-import datetime, logging, json, re
+import datetime, logging, json
 
-from django.contrib import admin, messages
+from django.contrib import admin
 from django.contrib.admin import SimpleListFilter
 from django.http import HttpResponse
 from django.utils import timezone
@@ -9,11 +9,13 @@ from django.utils.safestring import mark_safe
 import unicodecsv
 
 from sjfnw import utils
-from sjfnw.admin import BaseModelAdmin, advanced_admin
-from sjfnw.fund.models import (GivingProject, Member, Membership, Survey,
-    GPSurvey, Resource, ProjectResource, Donor, Step, NewsItem, SurveyResponse)
-from sjfnw.fund import forms, modelforms, utils as fund_utils
-from sjfnw.grants.models import ProjectApp, GrantApplication
+from sjfnw.admin import BaseModelAdmin, advanced_admin, YearFilter
+from sjfnw.autocomplete import AutocompleteInlineFormSet, AutocompleteWidget
+from sjfnw.fund.models import (GivingProject, Member, Membership, MembershipProgress,
+    Survey, GPSurvey, Resource, ProjectResource, Donor, Step, NewsItem, SurveyResponse)
+from sjfnw.fund import forms, modelforms
+from sjfnw.fund.middleware import membership_cache
+from sjfnw.grants.models import ProjectApp
 
 logger = logging.getLogger('sjfnw')
 
@@ -58,34 +60,10 @@ class ReceivedBooleanFilter(SimpleListFilter):
           received_this=0, received_next=0, received_afternext=0)
 
 
-class GPYearFilter(SimpleListFilter):
+class GPYearFilter(YearFilter):
   """ Filter giving projects by year """
-  title = 'year'
-  parameter_name = 'year'
-
-  def lookups(self, request, model_admin):
-    deadlines = (GivingProject.objects.values_list('fundraising_deadline', flat=True)
-                                      .order_by('-fundraising_deadline'))
-    prev = None
-    years = []
-    for deadline in deadlines:
-      if deadline.year != prev:
-        years.append((deadline.year, deadline.year))
-        prev = deadline.year
-    return years
-
-  def queryset(self, request, queryset):
-    val = self.value()
-    if not val:
-      return queryset
-    try:
-      year = int(val)
-    except ValueError:
-      logger.error('GPYearFilter received invalid value %s', val)
-      messages.error(request,
-          'Error loading filter. Contact techsupport@socialjusticefund.org')
-      return queryset
-    return queryset.filter(fundraising_deadline__year=year)
+  filter_model = GivingProject
+  field = 'fundraising_deadline'
 
 
 class DonorLikelyToJoinFilter(SimpleListFilter):
@@ -121,29 +99,9 @@ class MembershipInline(admin.TabularInline):
   show_change_link = True
 
   def formfield_for_foreignkey(self, db_field, request, **kwargs):
-
-    # cache member choices to reduce queries
     if db_field.name == 'member':
-
-      cached_choices = getattr(request, 'cached_members', None)
-      if cached_choices:
-        logger.debug('Using cached choices for membership inline')
-        formfield = super(MembershipInline, self).formfield_for_foreignkey(
-            db_field, request, **kwargs)
-        formfield.choices = cached_choices
-
-      else:
-        members = Member.objects.all()
-        formfield = super(MembershipInline, self).formfield_for_foreignkey(
-            db_field, request, **kwargs)
-        formfield.choices = [(member.pk, unicode(member)) for member in members]
-        request.cached_members = formfield.choices
-
-      return formfield
-
-    else: # different field
-      return super(MembershipInline, self).formfield_for_foreignkey(
-          db_field, request, **kwargs)
+      kwargs['widget'] = AutocompleteWidget('member')
+    return super(MembershipInline, self).formfield_for_foreignkey(db_field, request, **kwargs)
 
 
 class ProjectResourcesInline(admin.TabularInline):
@@ -166,6 +124,7 @@ class DonorInline(admin.TabularInline):
 
 class ProjectAppInline(admin.TabularInline):
   model = ProjectApp
+  formset = AutocompleteInlineFormSet
   extra = 1
   verbose_name = 'Grant application'
   verbose_name_plural = 'Grant applications'
@@ -178,29 +137,23 @@ class ProjectAppInline(admin.TabularInline):
         'application', 'givingprojectgrant')
 
   def formfield_for_foreignkey(self, db_field, request, **kwargs):
-    """ Limit application dropdown choices based on GP fundraising deadline
-
-      Otherwise we may get 'response too large' error
-    """
-    formfield = super(ProjectAppInline, self).formfield_for_foreignkey(
-        db_field, request, **kwargs)
-
-    if db_field.name == 'application' and not re.search(r'/add/', request.path):
-      apps = GrantApplication.objects.select_related('grant_cycle', 'organization')
-      try:
-        gp_id = int(request.path.split('/')[-2])
-      except ValueError:
-        # this shoudn't be possible, but just to be safe
-        # (it shouuld 404 if url doesn't match expected pattern)
-        logger.error('Could not parse GP id. URL: %s', request.path)
-      else:
-        gp = GivingProject.objects.get(pk=gp_id)
-        year = gp.fundraising_deadline - datetime.timedelta(weeks=52)
-        apps = apps.filter(submission_time__gte=year)
-        # create choices from queryset
-        formfield.choices = [('', '---------')] + [(app.pk, unicode(app)) for app in apps]
-
-    return formfield
+    """ Search for applications rather than listing them all """
+    if db_field.name == 'application':
+      kwargs['widget'] = AutocompleteWidget('grantapplication')
+    return super(ProjectAppInline, self).formfield_for_foreignkey(db_field, request, **kwargs)
+
+  def get_formset(self, request, obj=None, **kwargs):
+    """ Limit application search to those submitted within a year of the GP's
+      fundraising deadline """
+    formset = super(ProjectAppInline, self).get_formset(request, obj, **kwargs)
+    if obj is not None:
+      field = formset.form.base_fields['application']
+      # admin wraps the widget to add related object links
+      widget = getattr(field.widget, 'widget', field.widget)
+      widget.params = {
+        'submitted_after': obj.fundraising_deadline - datetime.timedelta(weeks=52)
+      }
+    return formset
 
   def app_link(self, obj):
     if obj and hasattr(obj, 'application'):
@@ -254,6 +207,9 @@ class GivingProjectA(BaseModelAdmin):
   form = modelforms.GivingProjectAdminForm
   inlines = [GPSurveyI, ProjectResourcesInline, MembershipInline, ProjectAppInline]
 
+  def get_queryset(self, request):
+    return super(GivingProjectA, self).get_queryset(request).with_progress()
+
   def gp_year(self, obj):
     year = obj.fundraising_deadline.year
     if year == timezone.now().year:
@@ -293,13 +249,12 @@ class MembershipA(BaseModelAdmin):
   ordering = ['-last_activity']
 
   def get_queryset(self, request):
-    return super(MembershipA, self).get_queryset(request).prefetch_related('donor_set')
+    return super(MembershipA, self).get_queryset(request).select_related('progress_rollup')
 
   def approve(self, _, queryset):
-    for memship in queryset:
-      if memship.approved is False:
-        fund_utils.notify_approval(memship)
-    queryset.update(approved=True)
+    approved = queryset.approve()
+    # update skips the signals that would clear cached memberships
+    membership_cache.invalidate_members([ship.member_id for ship in approved])
 
   def list_progress(self, obj): # for membership list - mimics columns
     membership_progress = obj.get_progress()
@@ -312,6 +267,9 @@ class MembershipA(BaseModelAdmin):
       '<td>Received</td><td>Rec. by year</td></tr></table>')
   list_progress.allow_tags = True
 
+  def overdue_steps(self, obj):
+    return MembershipProgress.for_membership(obj).overdue_steps
+
   def progress(self, obj): # for single membership view
     membership_progress = obj.get_progress()
     year = obj.giving_project.fundraising_deadline.year
@@ -349,11 +307,9 @@ class DonorA(BaseModelAdmin):
   readonly_fields = ['promise_reason_display', 'likely_to_join']
 
   def formfield_for_foreignkey(self, db_field, request, **kwargs):
-    field = super(DonorA, self).formfield_for_foreignkey(db_field, request, **kwargs)
     if db_field.name == 'membership':
-      ships = Membership.objects.select_related('giving_project', 'member')
-      field.choices = [(ship.pk, unicode(ship)) for ship in ships]
-    return field
+      kwargs['widget'] = AutocompleteWidget('membership')
+    return super(DonorA, self).formfield_for_foreignkey(db_field, request, **kwargs)
 
   def export_donors(self, request, queryset):
     logger.info('Export donors called by %s', request.user.email)
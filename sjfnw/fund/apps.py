@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class FundraisingConfig(AppConfig):
   name = 'sjfnw.fund'
   verbose_name = 'Fundraising'
+
+  def ready(self):
+    from sjfnw.fund import signals # pylint: disable=unused-import
@@ -1,7 +1,10 @@
 import datetime
+from itertools import groupby
 import logging
 
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, Prefetch, Q, TextField, Value, When
 from django.http import HttpResponse
 from django.template.loader import render_to_string
 from django.utils import timezone
@@ -9,107 +12,238 @@ from django.utils.html import strip_tags
 
 from sjfnw import constants as c
 from sjfnw.fund import models
+from sjfnw.fund.middleware import membership_cache
+from sjfnw.utils import StageTimer
 
 logger = logging.getLogger('sjfnw')
 
+# memberships or donors per update query in gift_notify
+GIFT_NOTIFY_BATCH_SIZE = 200
+
+# rollups per update query in refresh_progress
+PROGRESS_BATCH_SIZE = 500
+
 def email_overdue(request):
+  """ Email members with overdue steps, at most once a week per membership
+
+    Finds memberships and their earliest overdue step in two queries, sends all
+    emails together and marks memberships as emailed with one update.
+
+    With ?dry_run=1, nothing is sent or saved and the response reports how
+    many emails would be sent and how long each stage took.
+  """
+  dry_run = bool(request.GET.get('dry_run'))
   today = datetime.date.today()
-  ships = models.Membership.objects.filter(giving_project__fundraising_deadline__gte=today)
   limit = today - datetime.timedelta(days=7)
-  subject = 'Fundraising Steps'
-  from_email = c.FUND_EMAIL
-  bcc = [c.SUPPORT_EMAIL]
-
-  for ship in ships:
-    user = ship.member
-    if not ship.emailed or (ship.emailed <= limit):
-      count, step = ship.overdue_steps(get_next=True)
-      if count > 0 and step:
-        logger.info(user.email + ' has overdue step(s), emailing.')
-        to_emails = [user.email]
-        html_content = render_to_string('fund/emails/overdue_steps.html', {
-          'login_url': c.APP_BASE_URL + '/fund/login', 'ship': ship, 'num': count,
-          'step': step, 'base_url': c.APP_BASE_URL
-        })
-        text_content = strip_tags(html_content)
-        msg = EmailMultiAlternatives(subject, text_content, from_email, to_emails, bcc)
-        msg.attach_alternative(html_content, 'text/html')
-        msg.send()
-        ship.emailed = today
-        ship.save(skip=True)
-  return HttpResponse('')
+  timer = StageTimer()
+
+  with timer.stage('query'):
+    overdue = models.Step.objects.overdue()
+    ships = list(models.Membership.objects
+        .filter(Q(emailed__isnull=True) | Q(emailed__lte=limit),
+                giving_project__fundraising_deadline__gte=today,
+                donor__step__in=overdue)
+        .annotate(overdue_count=Count('donor__step'))
+        .select_related('member', 'giving_project'))
+
+    # earliest overdue step for each membership
+    steps = {}
+    for step in (overdue.filter(donor__membership__in=ships)
+                        .select_related('donor').order_by('date', 'pk')):
+      steps.setdefault(step.donor.membership_id, step)
+
+  with timer.stage('render'):
+    messages = [_overdue_message(ship, steps[ship.pk]) for ship in ships]
+
+  if not dry_run:
+    with timer.stage('send'):
+      get_connection().send_messages(messages)
+
+    with timer.stage('update'):
+      ship_ids = [ship.pk for ship in ships]
+      models.Membership.objects.filter(pk__in=ship_ids).update(emailed=today)
+      membership_cache.invalidate_members([ship.member_id for ship in ships])
+
+  summary = '{} overdue step emails {}. {}'.format(
+      len(messages), 'would be sent' if dry_run else 'sent', timer.summary())
+  logger.info(summary)
+  return HttpResponse(summary if dry_run else '')
+
+
+def _overdue_message(ship, step):
+  logger.info('%s has overdue step(s), emailing.', ship.member.email)
+  html_content = render_to_string('fund/emails/overdue_steps.html', {
+    'login_url': c.APP_BASE_URL + '/fund/login', 'ship': ship, 'num': ship.overdue_count,
+    'step': step, 'base_url': c.APP_BASE_URL
+  })
+  text_content = strip_tags(html_content)
+  msg = EmailMultiAlternatives('Fundraising Steps', text_content, c.FUND_EMAIL,
+                               [ship.member.email], [c.SUPPORT_EMAIL])
+  msg.attach_alternative(html_content, 'text/html')
+  return msg
 
 
 def new_accounts(request):
   """ Send GP leaders an email saying how many unapproved memberships exist
 
     Will continue emailing about the same membership until it's approved/deleted.
-  """
 
-  subject = 'Accounts pending approval'
-  from_email = c.FUND_EMAIL
-  bcc = [c.SUPPORT_EMAIL]
-
-  active_gps = models.GivingProject.objects.filter(fundraising_deadline__gte=timezone.now().date())
-
-  for gp in active_gps:
-    memberships = models.Membership.objects.filter(giving_project=gp)
-    need_approval = memberships.filter(approved=False).count()
-    if need_approval > 0:
-      leaders = memberships.filter(leader=True)
-      to_emails = [leader.member.email for leader in leaders]
-      if to_emails:
-        html_content = render_to_string('fund/emails/accounts_need_approval.html', {
-          'admin_url': c.APP_BASE_URL + '/admin/fund/membership/',
-          'count': need_approval,
-          'giving_project': unicode(gp),
-          'support_email': c.SUPPORT_EMAIL
-        })
-        text_content = strip_tags(html_content)
-        msg = EmailMultiAlternatives(subject, text_content, from_email, to_emails, bcc)
-        msg.attach_alternative(html_content, 'text/html')
-        msg.send()
-        logger.info('%d unapproved memberships in %s. Email sent to %s',
-            need_approval, unicode(gp), ', '.join(to_emails))
-
-  return HttpResponse('')
+    Active projects with unapproved memberships are counted in one grouped
+    query and their leaders are prefetched, so the number of queries doesn't
+    grow with projects or members. With ?dry_run=1, nothing is sent and the
+    response reports how many emails would be sent and how long and how many
+    queries each stage took.
+  """
+  dry_run = bool(request.GET.get('dry_run'))
+  timer = StageTimer(count_queries=True)
+
+  with timer.stage('query'):
+    leaders = models.Membership.objects.filter(leader=True).select_related('member')
+    projects = list(models.GivingProject.objects
+        .filter(fundraising_deadline__gte=timezone.now().date())
+        .annotate(need_approval=Count(Case(When(membership__approved=False, then=1),
+                                           output_field=IntegerField())))
+        .filter(need_approval__gt=0)
+        .prefetch_related(Prefetch('membership_set', queryset=leaders, to_attr='leaders')))
+
+  with timer.stage('render'):
+    messages = [_new_accounts_message(gp) for gp in projects if gp.leaders]
+
+  if not dry_run:
+    with timer.stage('send'):
+      get_connection().send_messages(messages)
+
+  summary = '{} pending approval emails {}. {}'.format(
+      len(messages), 'would be sent' if dry_run else 'sent', timer.summary())
+  logger.info(summary)
+  return HttpResponse(summary if dry_run else '')
+
+
+def _new_accounts_message(gp):
+  to_emails = [leader.member.email for leader in gp.leaders]
+  html_content = render_to_string('fund/emails/accounts_need_approval.html', {
+    'admin_url': c.APP_BASE_URL + '/admin/fund/membership/',
+    'count': gp.need_approval,
+    'giving_project': unicode(gp),
+    'support_email': c.SUPPORT_EMAIL
+  })
+  text_content = strip_tags(html_content)
+  msg = EmailMultiAlternatives('Accounts pending approval', text_content, c.FUND_EMAIL,
+                               to_emails, [c.SUPPORT_EMAIL])
+  msg.attach_alternative(html_content, 'text/html')
+  logger.info('%d unapproved memberships in %s. Emailing %s',
+              gp.need_approval, unicode(gp), ', '.join(to_emails))
+  return msg
 
 def gift_notify(request):
-  """ Set gift received notifications on membership object and send an email
-      Marks donors as notified """
-
-  donors = (models.Donor.objects
-      .select_related('membership__member')
-      .filter(gift_notified=False)
-      .exclude(received_this=0, received_next=0, received_afternext=0))
-
-  memberships = {}
-  for donor in donors:
-    if donor.membership not in memberships:
-      memberships[donor.membership] = []
-    memberships[donor.membership].append(donor)
-
-  login_url = c.APP_BASE_URL + '/fund/'
-  subject = 'Gift or pledge received'
-  from_email = c.FUND_EMAIL
-  bcc = [c.SUPPORT_EMAIL]
-
-  for ship, donor_list in memberships.iteritems():
-    gift_str = ''
-    for donor in donor_list:
-      gift_str += u'${}  gift or pledge received from {}! '.format(donor.received(), donor)
-    ship.notifications = gift_str
-    ship.save(skip=True)
-
-    to_email = [ship.member.email]
-    html_content = render_to_string('fund/emails/gift_received.html', {
-      'login_url': login_url, 'gift_str': ship.notifications
-    })
-    text_content = strip_tags(html_content)
-    msg = EmailMultiAlternatives(subject, text_content, from_email, to_email, bcc)
-    msg.attach_alternative(html_content, 'text/html')
-    msg.send()
-    logger.info('Set gift notification and sent email to %s', ship.member.email)
-
-  donors.update(gift_notified=True)
-  return HttpResponse('')
+  """ Set gift received notifications on memberships and email their members
+
+    Donors with unnotified gifts are loaded once, grouped by membership, and
+    only those donors are marked as notified, so gifts entered while this runs
+    are left for the next run. Notifications are set with one update per batch
+    of memberships and emails are sent together.
+
+    With ?dry_run=1, nothing is sent or saved and the response reports how
+    many emails would be sent and how long each stage took.
+  """
+  dry_run = bool(request.GET.get('dry_run'))
+  timer = StageTimer()
+
+  with timer.stage('query'):
+    donors = list(models.Donor.objects
+        .select_related('membership__member')
+        .filter(gift_notified=False)
+        .exclude(received_this=0, received_next=0, received_afternext=0)
+        .order_by('membership_id', 'pk'))
+
+  with timer.stage('render'):
+    notifications = [] # (membership, gift string)
+    for _, ship_donors in groupby(donors, key=lambda donor: donor.membership_id):
+      ship_donors = list(ship_donors)
+      gift_str = u''.join(u'${}  gift or pledge received from {}! '.format(donor.received(), donor)
+                          for donor in ship_donors)
+      notifications.append((ship_donors[0].membership, gift_str))
+    messages = [_gift_message(ship, gift_str) for ship, gift_str in notifications]
+
+  if not dry_run:
+    with timer.stage('update'):
+      with transaction.atomic():
+        for batch in _batches(notifications, GIFT_NOTIFY_BATCH_SIZE):
+          models.Membership.objects.filter(pk__in=[ship.pk for ship, _ in batch]).update(
+              notifications=Case(*[When(pk=ship.pk, then=Value(gift_str))
+                                   for ship, gift_str in batch],
+                                 output_field=TextField()))
+        for batch in _batches(donors, GIFT_NOTIFY_BATCH_SIZE):
+          models.Donor.objects.filter(pk__in=[donor.pk for donor in batch]).update(
+              gift_notified=True)
+      # update() skips the signals that would invalidate these
+      membership_cache.invalidate_members([ship.member_id for ship, _ in notifications])
+
+    with timer.stage('send'):
+      get_connection().send_messages(messages)
+
+  summary = '{} gift notification emails {} for {} donors. {}'.format(
+      len(messages), 'would be sent' if dry_run else 'sent', len(donors), timer.summary())
+  logger.info(summary)
+  return HttpResponse(summary if dry_run else '')
+
+
+def _gift_message(ship, gift_str):
+  logger.info('Setting gift notification and emailing %s', ship.member.email)
+  html_content = render_to_string('fund/emails/gift_received.html', {
+    'login_url': c.APP_BASE_URL + '/fund/', 'gift_str': gift_str
+  })
+  text_content = strip_tags(html_content)
+  msg = EmailMultiAlternatives('Gift or pledge received', text_content, c.FUND_EMAIL,
+                               [ship.member.email], [c.SUPPORT_EMAIL])
+  msg.attach_alternative(html_content, 'text/html')
+  return msg
+
+
+def refresh_progress(request):
+  """ Create missing membership progress rollups and retake today's overdue step counts
+
+    Keeps MembershipProgress.for_membership read-only. Overdue steps are counted
+    for all memberships in one grouped query, and stale rollups are updated with
+    one query per distinct count. Run shortly after midnight UTC, the date
+    overdue_as_of is compared to.
+  """
+  dry_run = bool(request.GET.get('dry_run'))
+  today = timezone.now().date()
+  timer = StageTimer()
+
+  with timer.stage('create'):
+    missing = list(models.Membership.objects
+        .filter(progress_rollup__isnull=True).values_list('pk', flat=True))
+    if not dry_run:
+      models.MembershipProgress.objects.bulk_create([
+        models.MembershipProgress(membership_id=ship_id,
+                                  **models.MembershipProgress.compute(ship_id))
+        for ship_id in missing
+      ])
+
+  with timer.stage('overdue'):
+    stale = models.MembershipProgress.objects.exclude(overdue_as_of=today)
+    stale_count = stale.count()
+    if not dry_run:
+      by_count = {}
+      for ship_id, count in (models.Step.objects.overdue()
+                                   .values_list('donor__membership_id')
+                                   .annotate(Count('pk')).order_by()):
+        by_count.setdefault(count, []).append(ship_id)
+      for count, ship_ids in by_count.items():
+        for batch in _batches(ship_ids, PROGRESS_BATCH_SIZE):
+          stale.filter(pk__in=batch).update(overdue_steps=count, overdue_as_of=today)
+      # the rest have no overdue steps
+      stale.update(overdue_steps=0, overdue_as_of=today)
+
+  summary = '{} rollups {}, {} overdue counts {}. {}'.format(
+      len(missing), 'would be created' if dry_run else 'created', stale_count,
+      'would be refreshed' if dry_run else 'refreshed', timer.summary())
+  logger.info(summary)
+  return HttpResponse(summary if dry_run else '')
+
+
+def _batches(items, size):
+  for start in range(0, len(items), size):
+    yield items[start:start + size]
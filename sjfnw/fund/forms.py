@@ -3,6 +3,7 @@ import logging
 from django import forms
 from django.utils import timezone
 
+from sjfnw.autocomplete import AutocompleteFormSetMixin
 from sjfnw.forms import IntegerCommaField
 from sjfnw.fund import models
 
@@ -202,7 +203,7 @@ class StepDoneForm(forms.Form):
     return cleaned_data
 
 
-class MembershipInlineFormset(forms.models.BaseInlineFormSet):
+class MembershipInlineFormset(AutocompleteFormSetMixin, forms.models.BaseInlineFormSet):
   def clean(self):
     # get forms that actually have valid data
     leader = 0
@@ -0,0 +1,68 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from sjfnw.fund.models import Donor, GivingProject, Member, Membership, Step
+from sjfnw.fund.views import _compile_membership_progress
+
+
+class Command(BaseCommand):
+
+  help = ('Times home page progress compilation for memberships with increasing '
+          'numbers of donors. Test data is created in a transaction that is rolled back.')
+
+  def add_arguments(self, parser):
+    parser.add_argument('--sizes', default='10,100,1000',
+                        help='Comma separated donor counts to benchmark')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Runs per size; the fastest is reported')
+
+  def handle(self, *args, **options):
+    sizes = [int(size) for size in options['sizes'].split(',')]
+    self.stdout.write('{:>8} {:>8} {:>10}'.format('donors', 'queries', 'ms'))
+
+    with transaction.atomic():
+      for size in sizes:
+        membership = self._create_membership(size)
+        queries, elapsed = self._run(membership, options['repeat'])
+        self.stdout.write('{:>8} {:>8} {:>10.1f}'.format(size, queries, elapsed * 1000))
+      transaction.set_rollback(True)
+
+  def _create_membership(self, size):
+    now = timezone.now()
+    gp = GivingProject.objects.create(
+        title='Benchmark {}'.format(size), fund_goal=size * 100,
+        fundraising_training=now, fundraising_deadline=now.date())
+    member = Member.objects.create(email='benchmark{}@example.com'.format(size),
+                                   first_name='Bench', last_name='Mark')
+    membership = Membership.objects.create(giving_project=gp, member=member, approved=True)
+
+    Donor.objects.bulk_create([
+      Donor(membership=membership, firstname='Donor {}'.format(i), amount=100 + i,
+            likelihood=i % 101, talked=i % 2 == 0, asked=i % 3 == 0,
+            promised=(i * 7 if i % 3 == 0 else None), received_this=i % 5 * 10)
+      for i in range(size)
+    ])
+    start_date = datetime.date.today() - datetime.timedelta(days=size)
+    steps = []
+    for i, donor in enumerate(membership.donor_set.all()):
+      date = start_date + datetime.timedelta(days=i)
+      steps.append(Step(donor=donor, date=date, description='Talk', completed=now))
+      steps.append(Step(donor=donor, date=date, description='Ask'))
+    Step.objects.bulk_create(steps)
+    return membership
+
+  def _run(self, membership, repeat):
+    best = None
+    for _ in range(repeat):
+      donors = membership.donor_set.prefetch_related('step_set')
+      with CaptureQueriesContext(connection) as context:
+        start = time.time()
+        _compile_membership_progress(donors)
+        elapsed = time.time() - start
+      best = elapsed if best is None else min(best, elapsed)
+    return len(context.captured_queries), best
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from sjfnw.fund.models import Membership, MembershipProgress
+
+
+class Command(BaseCommand):
+
+  help = ('Rebuilds membership progress rollups from donors and steps. With --check, '
+          'only reports rollups that have drifted from the donor data.')
+
+  def add_arguments(self, parser):
+    parser.add_argument('--check', action='store_true', default=False,
+                        help='Report drift without changing anything')
+
+  def handle(self, *args, **options):
+    rollups = {rollup.pk: rollup for rollup in MembershipProgress.objects.all()}
+    membership_ids = Membership.objects.values_list('pk', flat=True)
+    drifted, missing = 0, 0
+
+    for membership_id in membership_ids:
+      values = MembershipProgress.compute(membership_id)
+      rollup = rollups.get(membership_id)
+      if rollup is None:
+        missing += 1
+        if not options['check']:
+          MembershipProgress.objects.create(membership_id=membership_id, **values)
+        continue
+
+      diffs = ['{}: {} != {}'.format(metric, getattr(rollup, metric), values[metric])
+               for metric in MembershipProgress.METRICS
+               if getattr(rollup, metric) != values[metric]]
+      if diffs:
+        drifted += 1
+        self.stdout.write('Membership {} drifted. {}'.format(membership_id, ', '.join(diffs)))
+
+      if not options['check']:
+        values['updated'] = timezone.now()
+        MembershipProgress.objects.filter(pk=membership_id).update(**values)
+
+    self.stdout.write('{} memberships, {} drifted, {} missing rollups.'.format(
+      len(membership_ids), drifted, missing))
+    if not options['check']:
+      self.stdout.write('Rollups rebuilt.')
@@ -1,10 +1,83 @@
 import logging
 
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+
 from sjfnw import constants as c
 from sjfnw.fund import models
 
 logger = logging.getLogger('sjfnw')
 
+
+class MembershipCache(object):
+  """ Caches the status, member and membership resolved by MembershipMiddleware,
+    keyed by user id
+
+    Uses a local memory cache unless settings.MEMBERSHIP_CACHE names one of
+    settings.CACHES. Local memory is per process, so entries expire quickly
+    in case another instance changed the data.
+
+    Entries are invalidated when a user, member, membership or giving project
+    is saved or deleted (see sjfnw.fund.signals). Bulk updates that bypass
+    signals need to call invalidate_members.
+  """
+  key_prefix = 'fund-membership'
+  local_timeout = 60
+
+  def __init__(self):
+    self.hits = 0
+    self.misses = 0
+    self._backend = None
+
+  @property
+  def backend(self):
+    if self._backend is None:
+      alias = getattr(settings, 'MEMBERSHIP_CACHE', None)
+      if alias:
+        self._backend = caches[alias]
+      else:
+        self._backend = LocMemCache(self.key_prefix, {'TIMEOUT': self.local_timeout})
+    return self._backend
+
+  def _key(self, user_id):
+    return '{}:{}'.format(self.key_prefix, user_id)
+
+  def get(self, user_id):
+    """ Returns (status, member, membership) or None """
+    value = self.backend.get(self._key(user_id))
+    if value is None:
+      self.misses += 1
+    else:
+      self.hits += 1
+    return value
+
+  def set(self, user_id, status, member, membership):
+    self.backend.set(self._key(user_id), (status, member, membership))
+
+  def invalidate(self, user_ids):
+    self.backend.delete_many([self._key(user_id) for user_id in user_ids])
+
+  def invalidate_emails(self, emails):
+    """ Invalidate users by username, which is the member's email """
+    self.invalidate(User.objects.filter(username__in=emails).values_list('pk', flat=True))
+
+  def invalidate_members(self, member_ids):
+    """ member_ids can be a list or a queryset of ids """
+    self.invalidate_emails(models.Member.objects.filter(pk__in=member_ids)
+                                               .values_list('email', flat=True))
+
+  def clear(self):
+    """ Clears the whole cache backend """
+    self.backend.clear()
+
+  def stats(self):
+    return {'hits': self.hits, 'misses': self.misses}
+
+membership_cache = MembershipCache()
+
+
 class MembershipMiddleware(object):
   """ Gathers info on the member/ship of current user, stores it on the request
 
@@ -17,6 +90,8 @@ class MembershipMiddleware(object):
       .member       pointer to model (or None)
       .membership   pointer to model (or None)
 
+    Results are cached per user in membership_cache.
+
     May change member.current if:
       member had no membership with that id, but has other memberships
         -> the first one will be used (first approved one, if possible)
@@ -38,12 +113,21 @@ class MembershipMiddleware(object):
     if not request.user.is_authenticated():
       return None
 
-    member = models.Member.objects.filter(email=request.user.username).first()
+    cached = membership_cache.get(request.user.pk)
+    if cached is None:
+      cached = self._find_membership(request.user)
+      membership_cache.set(request.user.pk, *cached)
+
+    request.membership_status, request.member, request.membership = cached
+    return None
+
+  def _find_membership(self, user):
+    """ Returns (membership_status, member, membership) for the user """
+    member = models.Member.objects.filter(email=user.username).first()
 
     if not member:
-      logger.warning('No member object with email of %s', request.user.username)
-      request.membership_status = c.NO_MEMBER
-      return None
+      logger.warning('No member object with email of %s', user.username)
+      return c.NO_MEMBER, None, None
 
     membership = (models.Membership.objects
         .select_related()
@@ -58,9 +142,7 @@ class MembershipMiddleware(object):
         membership = all_memberships[0]
       else:
         logger.info('%s has no memberships', member)
-        request.member = member
-        request.membership_status = c.NO_MEMBERSHIP
-        return None
+        return c.NO_MEMBERSHIP, member, None
 
     # if membership is not approved, look for one that is
     if not membership.approved:
@@ -73,11 +155,6 @@ class MembershipMiddleware(object):
       member.save()
 
     if membership.approved:
-      request.membership_status = c.APPROVED
+      return c.APPROVED, member, membership
     else:
-      request.membership_status = c.NO_APPROVED
-
-    request.member = member
-    request.membership = membership
-
-    return None
+      return c.NO_APPROVED, member, membership
@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fund', '0003_auto_20151025_2257'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MembershipProgress',
+            fields=[
+                ('membership', models.OneToOneField(related_name='progress_rollup', primary_key=True, serialize=False, to='fund.Membership')),
+                ('contacts', models.PositiveIntegerField(default=0)),
+                ('talked', models.PositiveIntegerField(default=0, help_text=b'Talked to but not asked')),
+                ('asked', models.PositiveIntegerField(default=0)),
+                ('estimated', models.PositiveIntegerField(default=0)),
+                ('promised', models.PositiveIntegerField(default=0, help_text=b'Promised, not yet received')),
+                ('total_promised', models.PositiveIntegerField(default=0)),
+                ('received', models.PositiveIntegerField(default=0, help_text=b'Includes matches received')),
+                ('received_this', models.PositiveIntegerField(default=0)),
+                ('received_next', models.PositiveIntegerField(default=0)),
+                ('received_afternext', models.PositiveIntegerField(default=0)),
+                ('overdue_steps', models.PositiveIntegerField(default=0)),
+                ('overdue_as_of', models.DateField(null=True, blank=True)),
+                ('updated', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
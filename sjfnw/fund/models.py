@@ -2,13 +2,24 @@ import datetime, json, logging
 
 from django.contrib.humanize.templatetags.humanize import intcomma
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Func, IntegerField, Sum, Value, When
+from django.db.models.functions import Coalesce
 from django.utils import timezone
 
-from sjfnw.fund.utils import notify_approval
+from sjfnw.fund.utils import notify_approval, notify_approvals
 
 logger = logging.getLogger('sjfnw')
 
+class GivingProjectQuerySet(models.QuerySet):
+
+  def with_progress(self):
+    """ Annotate each project with progress_<metric> for its donors' metrics.
+      See donor_progress_aggregates """
+    return self.annotate(**{'progress_' + metric: aggregate for metric, aggregate
+                            in donor_progress_aggregates('membership__donor__').iteritems()})
+
+
 class GivingProject(models.Model):
   title = models.CharField(max_length=255)
 
@@ -53,6 +64,8 @@ class GivingProject(models.Model):
 
   surveys = models.ManyToManyField('Survey', through='GPSurvey', blank=True)
 
+  objects = GivingProjectQuerySet.as_manager()
+
   class Meta:
     ordering = ['-fundraising_deadline']
 
@@ -83,18 +96,23 @@ class GivingProject(models.Model):
   def require_estimates(self):
     return self.fundraising_training <= timezone.now()
 
+  def get_progress(self):
+    """ Progress metrics for all of the project's donors. Uses annotations from
+      GivingProjectQuerySet.with_progress if present, otherwise aggregates in one query """
+    if hasattr(self, 'progress_contacts'):
+      return {metric: int(getattr(self, 'progress_' + metric) or 0)
+              for metric in MembershipProgress.METRICS}
+    return Donor.objects.filter(membership__giving_project=self).progress()
+
   def estimated(self):
-    donors = Donor.objects.filter(membership__giving_project=self)
-    estimated = 0
-    for donor in donors:
-      estimated += donor.estimated()
-    return estimated
+    return self.get_progress()['estimated']
+  estimated.admin_order_field = 'progress_estimated'
 
 
 class Member(models.Model):
   email = models.EmailField(max_length=100, unique=True) # used to find corresponding User
-  first_name = models.CharField(max_length=100)
-  last_name = models.CharField(max_length=100)
+  first_name = models.CharField(max_length=100, db_index=True)
+  last_name = models.CharField(max_length=100, db_index=True)
 
   giving_project = models.ManyToManyField(GivingProject, through='Membership')
   current = models.IntegerField(default=0) # pk of current membership
@@ -106,6 +124,25 @@ class Member(models.Model):
     ordering = ['first_name', 'last_name']
 
 
+class MembershipQuerySet(models.QuerySet):
+
+  def approve(self):
+    """ Approve the unapproved memberships in this queryset with one update and
+      email their members together. Like other updates, this skips signals, so
+      callers need to invalidate cached memberships.
+
+      Returns the memberships that were approved """
+    with transaction.atomic():
+      # locked, so a concurrent approval waits and then finds them approved
+      memberships = list(self.filter(approved=False).select_for_update()
+                             .select_related('member', 'giving_project'))
+      if memberships:
+        Membership.objects.filter(pk__in=[ship.pk for ship in memberships]).update(approved=True)
+    if memberships:
+      notify_approvals(memberships)
+    return memberships
+
+
 class Membership(models.Model):
   """ Represents a relationship between a member and a giving project """
 
@@ -126,6 +163,8 @@ class Membership(models.Model):
 
   notifications = models.TextField(default='', blank=True)
 
+  objects = MembershipQuerySet.as_manager()
+
   class Meta:
     ordering = ['member']
     unique_together = ('giving_project', 'member')
@@ -133,48 +172,41 @@ class Membership(models.Model):
   def __unicode__(self):
     return u'{}, {}'.format(self.member, self.giving_project)
 
+  @classmethod
+  def from_db(cls, db, field_names, values):
+    instance = super(Membership, cls).from_db(db, field_names, values)
+    # lets save detect approval without loading the membership again
+    instance.loaded_approved = instance.__dict__.get('approved')
+    return instance
+
   def save(self, skip=False, *args, **kwargs):
-    """ Checks whether to send an approval email unless skip is True """
-    if not skip:
-      try:
-        previous = Membership.objects.get(pk=self.pk)
-        logger.debug('Previously: %s, now %s ', previous.approved, self.approved)
-        if self.approved and not previous.approved:
-          logger.debug('Detected approval on save for ' + unicode(self))
-          notify_approval(self)
-      except Membership.DoesNotExist: # this is the first save for this membership
-        pass
+    """ Sends an approval email if the membership was just approved, unless skip is True """
+    if not skip and self.approved and self.pk:
+      was_approved = getattr(self, 'loaded_approved', None)
+      if was_approved is None: # not loaded from the database
+        was_approved = (Membership.objects.filter(pk=self.pk)
+                                          .values_list('approved', flat=True).first())
+      if was_approved is False:
+        logger.debug('Detected approval on save for ' + unicode(self))
+        notify_approval(self)
     super(Membership, self).save(*args, **kwargs)
+    self.loaded_approved = self.approved
 
   def get_progress(self):
-    """ Compiles progress metrics (estimated, promised, received by year) """
-    progress = {
-      'estimated': 0,
-      'promised': 0,
-      'received_this': 0,
-      'received_next': 0,
-      'received_afternext': 0
+    """ Progress metrics (estimated, promised, received by year) from the rollup """
+    rollup = MembershipProgress.for_membership(self, overdue=False)
+    return {
+      'estimated': rollup.estimated,
+      'promised': rollup.total_promised,
+      'received_this': rollup.received_this,
+      'received_next': rollup.received_next,
+      'received_afternext': rollup.received_afternext,
+      'received_total': (rollup.received_this + rollup.received_next +
+                         rollup.received_afternext)
     }
-    donors = self.donor_set.all()
-
-    for donor in donors:
-      progress['estimated'] += donor.estimated()
-      if donor.promised:
-        progress['promised'] += donor.total_promised()
-      progress['received_this'] += donor.received_this
-      progress['received_next'] += donor.received_next
-      progress['received_afternext'] += donor.received_afternext
-
-    progress['received_total'] = (progress['received_this'] +
-                                 progress['received_next'] +
-                                 progress['received_afternext'])
-    return progress
 
   def overdue_steps(self, get_next=False):
-    cutoff = timezone.now().date() - datetime.timedelta(days=1)
-    steps = Step.objects.filter(
-        donor__membership_id=self.pk, completed__isnull=True, date__lt=cutoff
-      ).order_by('-date')
+    steps = Step.objects.filter(donor__membership_id=self.pk).overdue().order_by('-date')
     count = steps.count()
     if not get_next:
       return count
@@ -242,6 +274,147 @@ class Membership(models.Model):
     logger.info('Story saved')
 
 
+class MembershipProgress(models.Model):
+  """ Denormalized progress metrics for a membership, so they can be read
+    without loading all of its donors
+
+    Refreshed when a Donor or Step is saved or deleted (see sjfnw.fund.signals).
+    Missing rollups are created and overdue counts are retaken each day by
+    sjfnw.fund.cron.refresh_progress. The rebuild_membership_progress command
+    rebuilds all rollups or checks them for drift.
+  """
+  membership = models.OneToOneField(Membership, primary_key=True,
+                                    related_name='progress_rollup')
+
+  contacts = models.PositiveIntegerField(default=0)
+  talked = models.PositiveIntegerField(default=0, help_text='Talked to but not asked')
+  asked = models.PositiveIntegerField(default=0)
+  estimated = models.PositiveIntegerField(default=0)
+  promised = models.PositiveIntegerField(default=0, help_text='Promised, not yet received')
+  total_promised = models.PositiveIntegerField(default=0)
+  received = models.PositiveIntegerField(default=0, help_text='Includes matches received')
+  received_this = models.PositiveIntegerField(default=0)
+  received_next = models.PositiveIntegerField(default=0)
+  received_afternext = models.PositiveIntegerField(default=0)
+
+  # overdue depends on the date, so the count is only used on the day it was taken
+  overdue_steps = models.PositiveIntegerField(default=0)
+  overdue_as_of = models.DateField(null=True, blank=True)
+
+  updated = models.DateTimeField(default=timezone.now)
+
+  METRICS = ['contacts', 'talked', 'asked', 'estimated', 'promised', 'total_promised',
+             'received', 'received_this', 'received_next', 'received_afternext']
+
+  def __unicode__(self):
+    return u'Progress for {}'.format(self.membership_id)
+
+  @staticmethod
+  def compute(membership_id):
+    """ Compute rollup values from the membership's donors and steps """
+    values = Donor.objects.filter(membership_id=membership_id).progress()
+    values['overdue_steps'] = (Step.objects
+        .filter(donor__membership_id=membership_id).overdue().count())
+    values['overdue_as_of'] = timezone.now().date()
+    return values
+
+  @classmethod
+  def refresh(cls, membership_id):
+    """ Recompute an existing rollup. Missing rollups are left to the daily cron,
+      which avoids recreating one while its membership is being deleted """
+    values = cls.compute(membership_id)
+    values['updated'] = timezone.now()
+    cls.objects.filter(membership_id=membership_id).update(**values)
+
+  @classmethod
+  def for_membership(cls, membership, overdue=True):
+    """ Get the membership's rollup without writing to the database. A missing rollup
+      is computed in memory, and with overdue=True a stale overdue count is recounted
+      but not saved; the daily cron stores both.
+      Uses membership.progress_rollup if it was loaded with select_related """
+    try:
+      rollup = membership.progress_rollup
+    except cls.DoesNotExist:
+      rollup = cls(membership_id=membership.pk, **cls.compute(membership.pk))
+    if overdue and rollup.overdue_as_of != timezone.now().date():
+      rollup.overdue_steps = (Step.objects
+          .filter(donor__membership_id=membership.pk).overdue().count())
+      rollup.overdue_as_of = timezone.now().date()
+    return rollup
+
+  def as_dict(self):
+    return {metric: getattr(self, metric) for metric in self.METRICS}
+
+
+class Signed(Func):
+  """ Casts to a signed integer. Differences of PositiveIntegerFields are
+    unsigned in MySQL and would error instead of going negative """
+  template = 'CAST(%(expressions)s AS SIGNED)'
+
+  def __init__(self, expression, **extra):
+    super(Signed, self).__init__(expression, output_field=IntegerField(), **extra)
+
+
+def donor_progress_aggregates(prefix=''):
+  """ Aggregate expressions for donor progress metrics
+
+  Mirrors Donor.estimated, Donor.received and Donor.total_promised, with
+  promised only counting the portion that has not been received yet.
+
+  Arguments:
+    prefix - lookup path from the queried model to Donor, e.g. 'membership__donor__'
+
+  Returns:
+    dict of contacts, talked (but not asked), asked, estimated, promised,
+    received, total_promised (of donors who promised) and received by year
+  """
+  def field(name):
+    return F(prefix + name)
+
+  def q(**lookups):
+    return models.Q(**{prefix + key: value for key, value in lookups.iteritems()})
+
+  def conditional(condition, then):
+    return Sum(Case(When(condition, then=then), default=Value(0), output_field=IntegerField()))
+
+  amount_likelihood = field('amount') * field('likelihood')
+  # integer truncation of amount * likelihood / 100 that works in sqlite & mysql
+  estimated = (amount_likelihood - amount_likelihood % 100) / 100
+  received = Signed(field('received_this') + field('received_next') +
+                    field('received_afternext') + field('match_received'))
+  total_promised = field('match_expected') + Coalesce(prefix + 'promised', 0)
+  # received > 0 or promised, and total promised exceeds received
+  has_outstanding = (
+    (q(received_this__gt=0) | q(received_next__gt=0) | q(received_afternext__gt=0) |
+     q(match_received__gt=0) | q(promised__gt=0)) &
+    q(match_expected__gt=received - Coalesce(prefix + 'promised', 0))
+  )
+
+  return {
+    'contacts': Count(prefix + 'pk'),
+    'talked': conditional(q(talked=True, asked=False), Value(1)),
+    'asked': conditional(q(asked=True), Value(1)),
+    'estimated': conditional(q(amount__gt=0, likelihood__gt=0), estimated),
+    'promised': conditional(has_outstanding, total_promised - received),
+    'received': Sum(received),
+    'total_promised': conditional(q(promised__gt=0), total_promised),
+    'received_this': Sum(prefix + 'received_this'),
+    'received_next': Sum(prefix + 'received_next'),
+    'received_afternext': Sum(prefix + 'received_afternext')
+  }
+
+
+class DonorQuerySet(models.QuerySet):
+
+  def progress(self):
+    """ Compile progress metrics for the donors in a single aggregate query.
+      See donor_progress_aggregates for the metrics returned """
+    # aliased so they don't shadow the fields used in the expressions
+    totals = self.aggregate(**{'progress_' + metric: aggregate for metric, aggregate
+                               in donor_progress_aggregates().iteritems()})
+    return {key[len('progress_'):]: int(value or 0) for key, value in totals.iteritems()}
+
+
 class Donor(models.Model):
   LIKELY_TO_JOIN_CHOICES = choices = (
       ('', '---------'),
@@ -286,6 +459,8 @@ class Donor(models.Model):
   email = models.EmailField(max_length=100, blank=True)
   notes = models.TextField(blank=True)
 
+  objects = DonorQuerySet.as_manager()
+
   class Meta:
     ordering = ['firstname', 'lastname']
 
@@ -295,6 +470,13 @@ class Donor(models.Model):
     else:
       return self.firstname
 
+  @classmethod
+  def from_db(cls, db, field_names, values):
+    instance = super(Donor, cls).from_db(db, field_names, values)
+    # lets signals refresh the previous membership's rollup if the donor is moved
+    instance.loaded_membership_id = instance.__dict__.get('membership_id')
+    return instance
+
   def estimated(self):
     if self.amount and self.likelihood:
       return int(self.amount * self.likelihood * .01)
@@ -329,6 +511,14 @@ class Donor(models.Model):
     return self.match_expected + (self.promised or 0)
 
 
+class StepQuerySet(models.QuerySet):
+
+  def overdue(self):
+    """ Incomplete steps more than a day past their date """
+    cutoff = timezone.now().date() - datetime.timedelta(days=1)
+    return self.filter(completed__isnull=True, date__lt=cutoff)
+
+
 class Step(models.Model):
   created = models.DateTimeField(default=timezone.now)
   date = models.DateField(verbose_name='Date')
@@ -338,6 +528,8 @@ class Step(models.Model):
   asked = models.BooleanField(default=False)
   promised = models.PositiveIntegerField(blank=True, null=True)
 
+  objects = StepQuerySet.as_manager()
+
   def __unicode__(self):
     return u'{:%m/%d/%y} - {}'.format(self.date, self.description)
 
@@ -0,0 +1,64 @@
+""" Keeps MembershipProgress rollups, the membership cache and the admin year
+  cache current as models change. Connected in FundraisingConfig.ready """
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from sjfnw.cache import year_cache
+from sjfnw.fund.middleware import membership_cache
+from sjfnw.fund.models import (Donor, GivingProject, Member, Membership,
+    MembershipProgress, Step)
+
+
+@receiver(post_save, sender=Donor)
+@receiver(post_delete, sender=Donor)
+def refresh_donor_progress(sender, instance, raw=False, **kwargs):
+  if raw: # loading fixtures
+    return
+  MembershipProgress.refresh(instance.membership_id)
+
+  previous = getattr(instance, 'loaded_membership_id', None)
+  if previous and previous != instance.membership_id:
+    MembershipProgress.refresh(previous)
+  instance.loaded_membership_id = instance.membership_id
+
+
+@receiver(post_save, sender=Step)
+@receiver(post_delete, sender=Step)
+def refresh_step_progress(sender, instance, raw=False, **kwargs):
+  if raw:
+    return
+  membership_id = (Donor.objects.filter(pk=instance.donor_id)
+                                .values_list('membership_id', flat=True).first())
+  if membership_id: # donor still exists
+    MembershipProgress.refresh(membership_id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_membership(sender, instance, **kwargs):
+  membership_cache.invalidate([instance.pk])
+
+
+@receiver(post_save, sender=Member)
+@receiver(post_delete, sender=Member)
+def invalidate_member_membership(sender, instance, **kwargs):
+  membership_cache.invalidate_emails([instance.email])
+
+
+@receiver(post_save, sender=Membership)
+@receiver(post_delete, sender=Membership)
+def invalidate_membership(sender, instance, **kwargs):
+  membership_cache.invalidate_members([instance.member_id])
+
+
+@receiver(post_save, sender=GivingProject)
+def invalidate_project_memberships(sender, instance, **kwargs):
+  membership_cache.invalidate_members(
+      Membership.objects.filter(giving_project=instance).values('member_id'))
+
+
+@receiver(post_save, sender=GivingProject)
+@receiver(post_delete, sender=GivingProject)
+def invalidate_project_years(sender, **kwargs):
+  year_cache.invalidate(GivingProject)
@@ -1,5 +1,9 @@
-import logging
+import datetime, logging
 
+from django.utils import timezone
+
+from sjfnw.cache import year_cache
+from sjfnw.fund.models import GivingProject, Resource
 from sjfnw.fund.tests.base import BaseFundTestCase
 
 logger = logging.getLogger('sjfnw')
@@ -113,3 +117,46 @@ class AdminMisc(BaseFundTestCase):
     self.assertEqual(response.status_code, 200)
     self.assertEqual(response.context['module_name'], u'survey responses')
     self.assertIn('choices', response.context)
+
+
+class AdminYearFilter(BaseFundTestCase):
+
+  def setUp(self):
+    super(AdminYearFilter, self).setUp()
+    self.login_as_admin()
+
+  def get_years(self):
+    response = self.client.get('/admin/fund/givingproject/')
+    self.assertEqual(response.status_code, 200)
+    year_filter = response.context['cl'].filter_specs[0]
+    return [year for year, _ in year_filter.lookup_choices]
+
+  def test_years(self):
+    deadlines = GivingProject.objects.values_list('fundraising_deadline', flat=True)
+    expected = sorted(set(deadline.year for deadline in deadlines), reverse=True)
+    self.assertEqual(self.get_years(), expected)
+
+  def test_cached(self):
+    year_cache.years(GivingProject, 'fundraising_deadline')
+    with self.assertNumQueries(0):
+      year_cache.years(GivingProject, 'fundraising_deadline')
+
+  def test_invalidated_on_save(self):
+    self.assertNotIn(2009, self.get_years())
+
+    GivingProject.objects.create(title='Old project', fund_goal=1000,
+                                 fundraising_training=datetime.date(2009, 5, 1),
+                                 fundraising_deadline=datetime.date(2009, 6, 1))
+    years = self.get_years()
+    self.assertIn(2009, years)
+    self.assertEqual(years[-1], 2009)
+
+    GivingProject.objects.get(title='Old project').delete()
+    self.assertNotIn(2009, self.get_years())
+
+  def test_datetime_field(self):
+    Resource.objects.create(title='Old', link='http://example.com',
+                            created=timezone.make_aware(datetime.datetime(2010, 6, 1)))
+    Resource.objects.create(title='New', link='http://example.com')
+    this_year = timezone.localtime(timezone.now()).year
+    self.assertEqual(year_cache.years(Resource, 'created'), [this_year, 2010])
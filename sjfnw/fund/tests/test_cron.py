@@ -3,9 +3,10 @@ import logging
 
 from django.core import mail
 from django.core.urlresolvers import reverse
+from django.test import RequestFactory
 from django.utils import timezone
 
-from sjfnw.fund import models
+from sjfnw.fund import cron, models
 from sjfnw.fund.tests.base import BaseFundTestCase
 
 logger = logging.getLogger('sjfnw')
@@ -97,6 +98,60 @@ class GiftNotifications(BaseFundTestCase):
     self.assertContains(response, 'gift or pledge received')
 
 
+  def test_query_count(self):
+    """ Queries don't grow with the number of donors or memberships """
+    models.Donor.objects.filter(pk=self.donor_id).update(received_this=100)
+    member = models.Member.objects.create(email='abcd@gmail.com')
+    membership = models.Membership.objects.create(member=member, giving_project_id=1)
+    for name in ['Greta', 'Hans', 'Ilse']:
+      models.Donor(membership=membership, firstname=name, received_next=55).save()
+    request = RequestFactory().get(self.cron_url)
+
+    # donors, notifications, gift_notified, cache invalidation,
+    # plus the transaction's savepoint and release
+    with self.assertNumQueries(6):
+      cron.gift_notify(request)
+
+    self.assertEqual(len(mail.outbox), 2)
+    self.assertEqual(models.Donor.objects.filter(gift_notified=False,
+                                                 membership=membership).count(), 0)
+    notifications = models.Membership.objects.get(pk=membership.pk).notifications
+    for name in ['Greta', 'Hans', 'Ilse']:
+      self.assertIn(name, notifications)
+
+  def test_marks_processed_donors_only(self):
+    """ A gift entered after donors were loaded is left for the next run """
+    models.Donor.objects.filter(pk=self.donor_id).update(received_this=100)
+    donor = models.Donor.objects.get(pk=self.donor_id)
+
+    class GiftDuringSend(object):
+      def send_messages(self, messages):
+        models.Donor(membership_id=donor.membership_id, firstname='Late',
+                     received_this=10).save()
+        return len(messages)
+
+    get_connection = cron.get_connection
+    cron.get_connection = GiftDuringSend
+    try:
+      cron.gift_notify(RequestFactory().get(self.cron_url))
+    finally:
+      cron.get_connection = get_connection
+
+    self.assertTrue(models.Donor.objects.get(pk=self.donor_id).gift_notified)
+    self.assertFalse(models.Donor.objects.get(firstname='Late').gift_notified)
+
+  def test_dry_run(self):
+    models.Donor.objects.filter(pk=self.donor_id).update(received_this=100)
+
+    response = self.client.get(self.cron_url + '?dry_run=1')
+
+    self.assertContains(response, '1 gift notification emails would be sent for 1 donors.')
+    for stage in ['query', 'render']:
+      self.assertContains(response, stage + ': ')
+    self.assertEqual(len(mail.outbox), 0)
+    self.assertFalse(models.Donor.objects.get(pk=self.donor_id).gift_notified)
+
+
 class PendingApproval(BaseFundTestCase):
 
   url = reverse('sjfnw.fund.cron.new_accounts')
@@ -207,6 +262,38 @@ class PendingApproval(BaseFundTestCase):
     response = self.client.get(self.url, follow=True)
     self.assertEqual(response.status_code, 200)
     self.assertEqual(len(mail.outbox), 1)
+    self.assertEqual(sorted(mail.outbox[0].to),
+                     ['leader@email.com', 'newacct@gmail.com', 'tres@numero.com'])
+
+  def add_unapproved(self, gp, count):
+    for i in range(count):
+      member = models.Member.objects.create(email='{}{}@example.com'.format(gp.pk, i),
+                                            first_name='Unapproved', last_name=str(i))
+      models.Membership(giving_project=gp, member=member).save(skip=True)
+
+  def test_query_count(self):
+    """ Queries don't grow with the number of projects or memberships """
+    for gp in models.GivingProject.objects.filter(title__in=['Pre training', 'Post training']):
+      self.add_unapproved(gp, 3)
+    request = RequestFactory().get(self.url)
+
+    # projects with counts, leaders
+    with self.assertNumQueries(2):
+      cron.new_accounts(request)
+
+    self.assertEqual(len(mail.outbox), 2)
+    for email in mail.outbox:
+      self.assertIn('3', email.body)
+
+  def test_dry_run(self):
+    self.add_unapproved(models.GivingProject.objects.get(title='Pre training'), 2)
+
+    response = self.client.get(self.url + '?dry_run=1')
+
+    self.assertContains(response, '1 pending approval emails would be sent.')
+    self.assertContains(response, 'query: ')
+    self.assertContains(response, '(2 queries)')
+    self.assertEqual(len(mail.outbox), 0)
 
 
 class OverdueEmails(BaseFundTestCase):
@@ -289,6 +376,54 @@ class OverdueEmails(BaseFundTestCase):
     self.assertEqual(response.status_code, 200)
     self.assertEqual(len(mail.outbox), 2)
 
+  def test_earliest_step(self):
+    """ Email counts all overdue steps and links the earliest """
+    models.Step(donor_id=self.donor1, date=timezone.now() - timedelta(days=3),
+                description='Later').save()
+    step = models.Step(donor_id=self.donor2, date=timezone.now() - timedelta(days=9),
+                       description='Earliest')
+    step.save()
+
+    self.client.get(self.url)
+
+    self.assertEqual(len(mail.outbox), 1)
+    self.assertIn('several overdue fundraising steps', mail.outbox[0].body)
+    self.assertIn('Earliest', mail.outbox[0].body)
+    self.assertIn('step={}'.format(step.pk), mail.outbox[0].alternatives[0][0])
+
+  def test_recently_emailed(self):
+    models.Step(donor_id=self.donor1, date=timezone.now() - timedelta(days=3)).save()
+    models.Membership.objects.filter(pk=self.pre_id).update(
+        emailed=datetime.today() - timedelta(days=6))
+
+    self.client.get(self.url)
+
+    self.assertEqual(len(mail.outbox), 0)
+
+  def test_query_count(self):
+    """ Queries don't grow with the number of memberships """
+    for donor_id in [self.donor1, self.donor2, self.donor3]:
+      models.Step(donor_id=donor_id, date=timezone.now() - timedelta(days=3)).save()
+    request = RequestFactory().get(self.url)
+
+    # memberships, steps, update, cache invalidation
+    with self.assertNumQueries(4):
+      cron.email_overdue(request)
+
+    self.assertEqual(len(mail.outbox), 2)
+
+  def test_dry_run(self):
+    models.Step(donor_id=self.donor1, date=timezone.now() - timedelta(days=3)).save()
+    models.Step(donor_id=self.donor3, date=timezone.now() - timedelta(days=9)).save()
+
+    response = self.client.get(self.url + '?dry_run=1')
+
+    self.assertContains(response, '2 overdue step emails would be sent.')
+    for stage in ['query', 'render']:
+      self.assertContains(response, stage + ': ')
+    self.assertEqual(len(mail.outbox), 0)
+    self.assertIsNone(models.Membership.objects.get(pk=self.pre_id).emailed)
+
   def test_completed(self):
     """ overdue step in two memberships (different members) """
     now = timezone.now()
@@ -301,3 +436,53 @@ class OverdueEmails(BaseFundTestCase):
     response = self.client.get(self.url, follow=True)
     self.assertEqual(response.status_code, 200)
     self.assertEqual(len(mail.outbox), 0)
+
+
+class RefreshProgress(BaseFundTestCase):
+
+  url = reverse('sjfnw.fund.cron.refresh_progress')
+
+  def setUp(self):
+    super(RefreshProgress, self).setUp()
+    self.create_new()
+    donor = models.Donor(membership_id=self.pre_id, firstname='Sally', amount=40,
+                         likelihood=75)
+    donor.save()
+    self.donor_id = donor.pk
+    models.Step(donor=donor, date='2013-01-01', description='Talk').save()
+    models.Step(donor=donor, date='2013-01-02', description='Ask').save()
+
+  def test_creates_missing(self):
+    models.MembershipProgress.objects.all().delete()
+
+    response = self.client.get(self.url, follow=True)
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(models.MembershipProgress.objects.count(),
+                     models.Membership.objects.count())
+    rollup = models.MembershipProgress.objects.get(pk=self.pre_id)
+    self.assertEqual(rollup.estimated, 30)
+    self.assertEqual(rollup.overdue_steps, 2)
+
+  def test_stale_overdue(self):
+    models.MembershipProgress.objects.create(membership_id=self.pre_id,
+                                             overdue_steps=0, overdue_as_of='2013-01-01')
+    models.MembershipProgress.objects.create(membership_id=self.post_id,
+                                             overdue_steps=3, overdue_as_of='2013-01-01')
+
+    self.client.get(self.url)
+
+    today = timezone.now().date()
+    pre = models.MembershipProgress.objects.get(pk=self.pre_id)
+    self.assertEqual((pre.overdue_steps, pre.overdue_as_of), (2, today))
+    post = models.MembershipProgress.objects.get(pk=self.post_id)
+    self.assertEqual((post.overdue_steps, post.overdue_as_of), (0, today))
+
+  def test_dry_run(self):
+    models.MembershipProgress.objects.all().delete()
+
+    response = self.client.get(self.url + '?dry_run=1')
+
+    count = models.Membership.objects.count()
+    self.assertContains(response, '{} rollups would be created'.format(count))
+    self.assertFalse(models.MembershipProgress.objects.exists())
@@ -141,6 +141,35 @@ class HomeSurveys(BaseFundTestCase):
     self.assertTemplateNotUsed(response, 'fund/forms/gp_survey.html')
 
 
+class HomeCachedMembership(BaseFundTestCase):
+  """ Saves from home must not revert changes made after the membership was cached """
+
+  url = reverse('sjfnw.fund.views.home')
+
+  def setUp(self):
+    super(HomeCachedMembership, self).setUp()
+    self.login_as_member('current')
+    models.Membership.objects.filter(pk=self.ship_id).update(notifications='Welcome!')
+
+  def test_notification_save_keeps_other_fields(self):
+    # warm the membership cache without saving the membership
+    self.client.get(reverse('sjfnw.fund.views.manage_account'))
+
+    # bypasses signals, as if changed on another instance with its own cache
+    emailed = timezone.now().date()
+    models.Membership.objects.filter(pk=self.ship_id).update(leader=True, emailed=emailed)
+
+    # cached copy still has the notification, so home saves it
+    response = self.client.get(self.url, follow=True)
+    self.assertEqual(response.status_code, 200)
+
+    membership = models.Membership.objects.get(pk=self.ship_id)
+    self.assertEqual(membership.notifications, '')
+    self.assertTrue(membership.leader)
+    self.assertEqual(membership.emailed, emailed)
+
+
+
 class CompileMembershipProgress(BaseFundTestCase):
   """ Test _compile_membership_progress method used by home view """
 
@@ -202,6 +231,65 @@ class CompileMembershipProgress(BaseFundTestCase):
       self.assertIs(type(donor.completed_steps), list)
       self.assertTrue(len(donor.completed_steps) > 0)
 
+  def test_matches_donor_methods(self):
+    """ Aggregated metrics match the per-donor calculations """
+    self.create_new()
+    ship_id = self.post_id
+
+    donors = [
+      # estimate truncates like Donor.estimated
+      {'firstname': 'Est', 'amount': 333, 'likelihood': 33},
+      {'firstname': 'NoLikelihood', 'amount': 100},
+      # received more than promised
+      {'firstname': 'Over', 'asked': True, 'promised': 50, 'received_this': 80},
+      # match expected, partially received
+      {'firstname': 'Match', 'asked': True, 'promised': 100, 'match_expected': 100,
+       'received_next': 60, 'match_received': 40},
+      # match expected but no promise or gift yet
+      {'firstname': 'Pending', 'talked': True, 'match_expected': 25},
+      {'firstname': 'Declined', 'talked': True, 'asked': True, 'promised': 0}
+    ]
+    for kwargs in donors:
+      models.Donor(membership_id=ship_id, **kwargs).save()
+
+    donors = models.Donor.objects.filter(membership_id=ship_id).prefetch_related('step_set')
+    progress, _ = _compile_membership_progress(donors)
+
+    expected_promised = 0
+    for donor in donors:
+      if donor.received() > 0:
+        expected_promised += max(donor.total_promised() - donor.received(), 0)
+      elif donor.promised:
+        expected_promised += donor.total_promised()
+
+    self.assertEqual(progress['estimated'], sum(d.estimated() for d in donors))
+    self.assertEqual(progress['received'], sum(d.received() for d in donors))
+    self.assertEqual(progress['promised'], expected_promised)
+    self.assertEqual(progress['contacts'], 6)
+    self.assertEqual(progress['asked'], 3)
+    self.assertEqual(progress['talked'], 1)
+    self.assertEqual(progress['contacts_remaining'], 2)
+
+  def test_query_count(self):
+    """ Number of queries does not grow with number of donors """
+    self.create_new()
+
+    for ship_id, count in ((self.pre_id, 3), (self.post_id, 30)):
+      for i in range(count):
+        donor = models.Donor(membership_id=ship_id, firstname=str(i),
+                             amount=100, likelihood=50, asked=True, promised=20)
+        donor.save()
+        models.Step(donor=donor, date='2015-5-25', description='Thank').save()
+
+      donors = models.Donor.objects.filter(membership_id=ship_id).prefetch_related('step_set')
+      # donors, steps, aggregate
+      with self.assertNumQueries(3):
+        progress, incomplete_steps = _compile_membership_progress(donors)
+
+      self.assertEqual(progress['contacts'], count)
+      self.assertEqual(progress['promised'], count * 20)
+      self.assertEqual(len(incomplete_steps), count)
+
 
 class FormQueryParams(BaseFundTestCase):
   """
@@ -1,10 +1,15 @@
+from django.contrib import admin
 from django.contrib.auth.models import AnonymousUser, User
+from django.core.cache import caches
 from django.http import HttpRequest
+from django.test import override_settings
 
 from sjfnw import constants as c
 from sjfnw.fund import models
+from sjfnw.fund.admin import MembershipA
 from sjfnw.fund.tests.base import BaseFundTestCase
-from sjfnw.fund.middleware import MembershipMiddleware
+from sjfnw.fund.middleware import MembershipCache, MembershipMiddleware, membership_cache
+from sjfnw.fund.views import _create_membership
 
 middleware = MembershipMiddleware()
 
@@ -84,3 +89,87 @@ class Middleware(BaseFundTestCase):
     self.assertIsInstance(self.request.membership, models.Membership)
     self.assertEqual(self.request.membership.pk, membership.pk)
     self.assertEqual(self.request.membership_status, c.APPROVED)
+
+
+class MiddlewareCache(BaseFundTestCase):
+
+  def setUp(self):
+    super(MiddlewareCache, self).setUp()
+    self.create_new()
+    self.user = User.objects.create_user('newacct@gmail.com', 'newacct@gmail.com', 'noob')
+    membership_cache.hits, membership_cache.misses = 0, 0
+
+  def run_middleware(self):
+    request = HttpRequest()
+    request.user = User.objects.get(pk=self.user.pk)
+    middleware.process_view(request, MockView(), [], {})
+    return request
+
+  # pylint: disable=no-member
+
+  def test_warm_hit(self):
+    self.run_middleware()
+    request = HttpRequest()
+    request.user = self.user
+
+    with self.assertNumQueries(0):
+      middleware.process_view(request, MockView(), [], {})
+
+    self.assertEqual(request.membership.pk, self.pre_id)
+    self.assertEqual(request.membership_status, c.APPROVED)
+    self.assertEqual(membership_cache.stats(), {'hits': 1, 'misses': 1})
+
+  def test_approve_action(self):
+    models.Membership.objects.filter(pk__in=[self.pre_id, self.post_id]).update(approved=False)
+    membership_cache.clear()
+    self.assertEqual(self.run_middleware().membership_status, c.NO_APPROVED)
+
+    MembershipA(models.Membership, admin.site).approve(
+        None, models.Membership.objects.filter(pk=self.pre_id))
+
+    request = self.run_middleware()
+    self.assertEqual(request.membership_status, c.APPROVED)
+    self.assertEqual(request.membership.pk, self.pre_id)
+    self.assertEqual(membership_cache.stats(), {'hits': 0, 'misses': 2})
+
+  def test_set_current(self):
+    self.assertEqual(self.run_middleware().membership.pk, self.pre_id)
+
+    member = models.Member.objects.get(pk=self.member_id)
+    member.current = self.post_id
+    member.save()
+
+    self.assertEqual(self.run_middleware().membership.pk, self.post_id)
+
+  def test_membership_created(self):
+    member = models.Member.objects.get(pk=self.member_id)
+    models.Membership.objects.filter(member=member).delete()
+    self.assertEqual(self.run_middleware().membership_status, c.NO_MEMBERSHIP)
+
+    gp = models.GivingProject.objects.get(title='Pre training')
+    _create_membership(member, gp)
+
+    request = self.run_middleware()
+    self.assertEqual(request.membership_status, c.NO_APPROVED)
+    self.assertEqual(request.membership.giving_project, gp)
+
+  def test_project_changed(self):
+    self.run_middleware()
+    gp = models.GivingProject.objects.get(title='Pre training')
+    gp.title = 'Renamed'
+    gp.save()
+
+    request = self.run_middleware()
+    self.assertEqual(request.membership.giving_project.title, 'Renamed')
+    self.assertEqual(membership_cache.stats(), {'hits': 0, 'misses': 2})
+
+  @override_settings(MEMBERSHIP_CACHE='default')
+  def test_django_cache_backend(self):
+    cache = MembershipCache()
+    self.assertIs(cache.backend, caches['default'])
+
+    cache.set(self.user.pk, c.NO_MEMBER, None, None)
+    self.assertEqual(cache.get(self.user.pk), (c.NO_MEMBER, None, None))
+    cache.invalidate_emails([self.user.username])
+    self.assertIsNone(cache.get(self.user.pk))
+    self.assertEqual(cache.stats(), {'hits': 1, 'misses': 1})
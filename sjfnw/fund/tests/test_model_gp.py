@@ -1,4 +1,6 @@
-from sjfnw.fund.models import GivingProject
+from django.utils import timezone
+
+from sjfnw.fund.models import Donor, GivingProject
 from sjfnw.fund.tests.base import BaseFundTestCase
 
 class GetSuggestedSteps(BaseFundTestCase):
@@ -39,3 +41,53 @@ class GetSuggestedSteps(BaseFundTestCase):
     self.assertEqual(suggested[0], 'Talk')
     self.assertEqual(suggested[1], 'Invite them')
     self.assertEqual(suggested[2], 'Thanks!!')
+
+
+class GetProgress(BaseFundTestCase):
+
+  def setUp(self):
+    super(GetProgress, self).setUp()
+    self.create_new()
+    Donor(membership_id=self.pre_id, firstname='Sally', amount=40, likelihood=75,
+          talked=True).save()
+    Donor(membership_id=self.post_id, firstname='Diego', amount=200, likelihood=50,
+          asked=True, promised=300, received_this=100).save()
+    Donor(membership_id=self.post_id, firstname='Ana', amount=99, likelihood=99,
+          asked=True, promised=50).save()
+
+  def test_project(self):
+    gp = GivingProject.objects.get(title='Post training')
+
+    with self.assertNumQueries(1):
+      progress = gp.get_progress()
+
+    self.assertEqual(progress['contacts'], 2)
+    self.assertEqual(progress['talked'], 0)
+    self.assertEqual(progress['asked'], 2)
+    self.assertEqual(progress['estimated'], 100 + 98)
+    self.assertEqual(progress['promised'], 200 + 50)
+    self.assertEqual(progress['received'], 100)
+    self.assertEqual(gp.estimated(), 198)
+
+  def test_with_progress(self):
+    """ Annotated metrics match per-project aggregates, without further queries """
+    with self.assertNumQueries(1):
+      projects = list(GivingProject.objects.with_progress())
+      progress = {gp.title: gp.get_progress() for gp in projects}
+
+    for title in ['Post training', 'Pre training']:
+      self.assertEqual(progress[title],
+                       GivingProject.objects.get(title=title).get_progress())
+    self.assertEqual(progress['Pre training']['estimated'], 30)
+    self.assertEqual(progress['Pre training']['talked'], 1)
+
+  def test_no_donors(self):
+    gp = GivingProject(title='Empty', fundraising_training=timezone.now(),
+                       fundraising_deadline=timezone.now().date())
+    gp.save()
+
+    annotated = GivingProject.objects.with_progress().get(pk=gp.pk)
+
+    self.assertEqual(annotated.get_progress()['contacts'], 0)
+    self.assertEqual(annotated.estimated(), 0)
+    self.assertEqual(gp.estimated(), 0)
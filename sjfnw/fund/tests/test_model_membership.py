@@ -1,8 +1,11 @@
 import logging
+from StringIO import StringIO
 
+from django.core import mail
+from django.core.management import call_command
 from django.utils import timezone
 
-from sjfnw.fund.models import Membership, Donor, Step
+from sjfnw.fund.models import Membership, MembershipProgress, Donor, Step
 from sjfnw.fund.tests.base import BaseFundTestCase
 
 logger = logging.getLogger('sjfnw')
@@ -42,6 +45,132 @@ class GetProgress(BaseFundTestCase):
     self.assertEqual(progress['received_total'], 240)
 
 
+class ProgressRollup(BaseFundTestCase):
+
+  def setUp(self):
+    super(ProgressRollup, self).setUp()
+    self.create_new()
+    self.membership = Membership.objects.get(pk=self.pre_id)
+    # create the rollup before donors are added
+    MembershipProgress.objects.create(membership_id=self.pre_id,
+                                      **MembershipProgress.compute(self.pre_id))
+
+  def get_rollup(self):
+    return MembershipProgress.objects.get(pk=self.pre_id)
+
+  def test_computed_on_read(self):
+    MembershipProgress.objects.all().delete()
+    donor = Donor(membership_id=self.pre_id, firstname='Sally', amount=40, likelihood=75)
+    donor.save()
+    # signal does not create it
+    self.assertFalse(MembershipProgress.objects.filter(pk=self.pre_id).exists())
+
+    progress = Membership.objects.get(pk=self.pre_id).get_progress()
+    self.assertEqual(progress['estimated'], 30)
+    # reads do not create it either
+    self.assertFalse(MembershipProgress.objects.filter(pk=self.pre_id).exists())
+
+  def test_donor_changes(self):
+    donor = Donor(membership_id=self.pre_id, firstname='Sally', amount=40,
+                  likelihood=75, asked=True, promised=40)
+    donor.save()
+    rollup = self.get_rollup()
+    self.assertEqual(rollup.contacts, 1)
+    self.assertEqual(rollup.asked, 1)
+    self.assertEqual(rollup.estimated, 30)
+    self.assertEqual(rollup.promised, 40)
+
+    donor.received_next = 40
+    donor.save()
+    rollup = self.get_rollup()
+    self.assertEqual(rollup.promised, 0)
+    self.assertEqual(rollup.total_promised, 40)
+    self.assertEqual(rollup.received, 40)
+    self.assertEqual(rollup.received_next, 40)
+
+    donor.delete()
+    self.assertEqual(self.get_rollup().as_dict(), dict.fromkeys(MembershipProgress.METRICS, 0))
+
+  def test_donor_moved(self):
+    MembershipProgress.objects.create(membership_id=self.post_id)
+    Donor(membership_id=self.pre_id, firstname='Sally', amount=40, likelihood=75).save()
+    self.assertEqual(self.get_rollup().contacts, 1)
+
+    donor = Donor.objects.get(firstname='Sally')
+    donor.membership_id = self.post_id
+    donor.save()
+
+    self.assertEqual(self.get_rollup().contacts, 0)
+    self.assertEqual(MembershipProgress.objects.get(pk=self.post_id).contacts, 1)
+
+  def test_steps(self):
+    donor = Donor(membership_id=self.pre_id, firstname='Sally')
+    donor.save()
+    step = Step(donor=donor, date='2013-01-01', description='Talk')
+    step.save()
+    self.assertEqual(self.get_rollup().overdue_steps, 1)
+
+    step.completed = timezone.now()
+    step.save()
+    self.assertEqual(self.get_rollup().overdue_steps, 0)
+
+    Step(donor=donor, date='2013-01-01', description='Ask').save()
+    self.assertEqual(self.get_rollup().overdue_steps, 1)
+    donor.delete()
+    self.assertEqual(self.get_rollup().overdue_steps, 0)
+
+  def test_stale_overdue_recounted(self):
+    donor = Donor(membership_id=self.pre_id, firstname='Sally')
+    donor.save()
+    Step(donor=donor, date='2013-01-01', description='Talk').save()
+    MembershipProgress.objects.filter(pk=self.pre_id).update(
+        overdue_steps=0, overdue_as_of='2013-01-01')
+
+    self.assertEqual(self.membership.overdue_steps(), 1)
+    rollup = MembershipProgress.for_membership(Membership.objects.get(pk=self.pre_id))
+    self.assertEqual(rollup.overdue_steps, 1)
+    self.assertEqual(rollup.overdue_as_of, timezone.now().date())
+    # recounted for this read only
+    self.assertEqual(self.get_rollup().overdue_steps, 0)
+
+  def test_get_progress_read_only(self):
+    membership = Membership.objects.select_related('progress_rollup').get(pk=self.pre_id)
+    with self.assertNumQueries(0):
+      membership.get_progress()
+
+  def test_membership_deleted(self):
+    Donor(membership_id=self.pre_id, firstname='Sally').save()
+    self.membership.delete()
+    self.assertFalse(MembershipProgress.objects.filter(pk=self.pre_id).exists())
+
+
+class RebuildMembershipProgress(BaseFundTestCase):
+
+  def setUp(self):
+    super(RebuildMembershipProgress, self).setUp()
+    self.create_new()
+    Donor(membership_id=self.pre_id, firstname='Sally', amount=40, likelihood=75).save()
+    MembershipProgress.objects.create(membership_id=self.pre_id, contacts=1, estimated=99)
+
+  def test_check(self):
+    out = StringIO()
+    call_command('rebuild_membership_progress', check=True, stdout=out)
+
+    self.assertIn('Membership {} drifted. estimated: 99 != 30'.format(self.pre_id),
+                  out.getvalue())
+    count = Membership.objects.count()
+    self.assertIn('{} memberships, 1 drifted, {} missing rollups.'.format(count, count - 1),
+                  out.getvalue())
+    self.assertEqual(MembershipProgress.objects.get(pk=self.pre_id).estimated, 99)
+    self.assertEqual(MembershipProgress.objects.count(), 1)
+
+  def test_rebuild(self):
+    call_command('rebuild_membership_progress', stdout=StringIO())
+
+    self.assertEqual(MembershipProgress.objects.get(pk=self.pre_id).estimated, 30)
+    self.assertEqual(MembershipProgress.objects.count(), Membership.objects.count())
+
+
 class UpdateStory(BaseFundTestCase):
 
   def setUp(self):
@@ -164,3 +293,66 @@ class UpdateStory(BaseFundTestCase):
     story = stories[0]
     self.assertEqual(story.summary,
         u'Test talked to 2 people, asked 1 and got $650 in promises.')
+
+
+class Approval(BaseFundTestCase):
+
+  def setUp(self):
+    super(Approval, self).setUp()
+    self.create_new()
+    Membership.objects.filter(pk__in=[self.pre_id, self.post_id]).update(approved=False)
+
+  def test_save_approved(self):
+    membership = Membership.objects.get(pk=self.pre_id)
+    membership.approved = True
+    membership.save()
+
+    self.assertEqual(len(mail.outbox), 1)
+    self.assertEqual(mail.outbox[0].subject, 'Membership Approved')
+    self.assertEqual(mail.outbox[0].to, ['newacct@gmail.com'])
+
+    # already approved
+    membership.save()
+    Membership.objects.get(pk=self.pre_id).save()
+    self.assertEqual(len(mail.outbox), 1)
+
+  def test_save_without_approval(self):
+    """ Saving doesn't reload the membership to check for approval """
+    membership = Membership.objects.get(pk=self.pre_id)
+    membership.leader = True
+    # update, cache invalidation
+    with self.assertNumQueries(2):
+      membership.save()
+    self.assertEqual(len(mail.outbox), 0)
+
+  def test_save_skip(self):
+    membership = Membership.objects.get(pk=self.pre_id)
+    membership.approved = True
+    membership.save(skip=True)
+    self.assertEqual(len(mail.outbox), 0)
+
+  def test_save_not_loaded(self):
+    """ Membership created with an existing pk rather than loaded """
+    membership = Membership.objects.get(pk=self.pre_id)
+    copy = Membership(pk=membership.pk, member_id=membership.member_id,
+                      giving_project_id=membership.giving_project_id, approved=True)
+    copy.save()
+    self.assertEqual(len(mail.outbox), 1)
+
+  def test_bulk_approve(self):
+    Membership.objects.filter(pk=self.post_id).update(approved=True)
+
+    # select memberships, update, in a savepoint
+    with self.assertNumQueries(4):
+      approved = Membership.objects.filter(pk__in=[self.pre_id, self.post_id]).approve()
+
+    self.assertEqual([ship.pk for ship in approved], [self.pre_id])
+    self.assertTrue(Membership.objects.get(pk=self.pre_id).approved)
+    self.assertEqual(len(mail.outbox), 1)
+    self.assertIn('Pre training', mail.outbox[0].body)
+
+  def test_bulk_approve_none(self):
+    with self.assertNumQueries(3):
+      approved = Membership.objects.filter(approved=True).approve()
+    self.assertEqual(approved, [])
+    self.assertEqual(len(mail.outbox), 0)
@@ -1,5 +1,6 @@
 from django.core.urlresolvers import reverse
 
+from sjfnw.fund.models import Donor
 from sjfnw.fund.tests.base import BaseFundTestCase
 
 class GivingProjectPage(BaseFundTestCase):
@@ -16,3 +17,18 @@ class GivingProjectPage(BaseFundTestCase):
 
     self.assertEqual(res.status_code, 200)
     self.assertTemplateUsed(res, 'fund/project.html')
+
+  def test_progress(self):
+    Donor(membership_id=self.pre_id, firstname='Sally', amount=40, likelihood=75,
+          talked=True).save()
+    Donor(membership_id=self.pre_id, firstname='Diego', asked=True, promised=300,
+          received_this=100).save()
+
+    res = self.client.get(self.url)
+
+    progress = res.context['project_progress']
+    self.assertEqual(progress['contacts'], 2)
+    self.assertEqual(progress['contacts_remaining'], 0)
+    self.assertEqual(progress['promised'], 200)
+    self.assertEqual(progress['received'], 100)
+    self.assertEqual(progress['togo'], 10000 - 300)
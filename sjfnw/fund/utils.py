@@ -1,6 +1,6 @@
 import logging
 
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
 from django.template.loader import render_to_string
 from django.utils.html import strip_tags
 
@@ -9,15 +9,25 @@ from sjfnw import constants as c
 logger = logging.getLogger('sjfnw')
 
 def notify_approval(membership):
-  subject, from_email = 'Membership Approved', c.FUND_EMAIL
-  to_email = membership.member.email
-  html_content = render_to_string('fund/emails/account_approved.html', {
-    'login_url': c.APP_BASE_URL + '/fund/login',
-    'project': membership.giving_project
-  })
-  text_content = strip_tags(html_content)
-  msg = EmailMultiAlternatives(subject, text_content, from_email, [to_email],
-                               ['sjfnwads@gmail.com']) # bcc for testing
-  msg.attach_alternative(html_content, 'text/html')
-  msg.send()
-  logger.info(u'Approval email sent to %s at %s', membership, to_email)
+  notify_approvals([membership])
+
+def notify_approvals(memberships):
+  """ Email members that their memberships were approved, queueing all the
+    emails together. The email is rendered once per giving project """
+  rendered = {}
+  messages = []
+  for membership in memberships:
+    if membership.giving_project_id not in rendered:
+      html_content = render_to_string('fund/emails/account_approved.html', {
+        'login_url': c.APP_BASE_URL + '/fund/login',
+        'project': membership.giving_project
+      })
+      rendered[membership.giving_project_id] = (html_content, strip_tags(html_content))
+    html_content, text_content = rendered[membership.giving_project_id]
+    msg = EmailMultiAlternatives('Membership Approved', text_content, c.FUND_EMAIL,
+                                 [membership.member.email],
+                                 ['sjfnwads@gmail.com']) # bcc for testing
+    msg.attach_alternative(html_content, 'text/html')
+    messages.append(msg)
+    logger.info(u'Sending approval email for %s to %s', membership, membership.member.email)
+  get_connection().send_messages(messages)
@@ -84,10 +84,11 @@ def home(request):
   if notif and not settings.DEBUG:
     logger.info('Displaying notification to %s: %s', unicode(membership), notif)
     membership.notifications = ''
-    membership.save(skip=True)
+    membership.save(skip=True, update_fields=['notifications'])
 
   # compile steps and progress metrics
-  progress, incomplete_steps = _compile_membership_progress(donors)
+  rollup = models.MembershipProgress.for_membership(membership)
+  progress, incomplete_steps = _compile_membership_progress(donors, rollup=rollup)
   donors = sorted(donors, key=_get_converted_date)
 
   # suggested steps for step forms
@@ -123,69 +124,62 @@ def _get_converted_date(donor):
   return datetime.date(2100, 01, 01)
 
 
-def _compile_membership_progress(donors):
-  """ Go through membership's donors and steps, compiling progress metrics
-    and organizing steps based on completion
+def _compile_membership_progress(donors, rollup=None):
+  """ Compile progress metrics for a membership's donors and organize their
+    steps based on completion
+
+    Metrics are read from the membership's rollup if given, otherwise
+    aggregated by the database (see DonorQuerySet.progress), so the per-donor
+    pass below only builds display attributes.
 
     Adds summary attribute to donors (and others via donor.organize_steps)
 
+    Arguments:
+      donors - Donor queryset, ideally with step_set prefetched
+      rollup - MembershipProgress for the donors' membership (optional)
+
     Returns:
       progress - dict, see progress dict definition below
       incomplete_steps - list of incomplete Steps for this membership
   """
-  progress = {
-    'contacts': len(donors),
-    'contacts_remaining': len(donors),
-    'estimated': 0,
-    'talked': 0,
-    'asked': 0,
-    'promised': 0,
-    'received': 0
-  }
-
   if not donors:
     logger.error('Membership has no contacts but wasn\'t redirected to add_mult')
-    return progress, []
-
-  # compile progress metrics and donor summaries
-  for donor in donors:
-    donor.summary = ''
+    return {
+      'contacts': 0,
+      'contacts_remaining': 0,
+      'estimated': 0,
+      'talked': 0,
+      'asked': 0,
+      'promised': 0,
+      'received': 0
+    }, []
+
+  progress = rollup.as_dict() if rollup else donors.progress()
 
-    if donor.asked:
-      progress['asked'] += 1
-      donor.summary = 'Asked. '
-    elif donor.talked:
-      progress['talked'] += 1
-
-    progress['estimated'] += donor.estimated()
+  # progress chart calculations
+  amount_raised = progress['promised'] + progress['received']
+  progress['contacts_remaining'] = progress['contacts'] - progress['talked'] - progress['asked']
+  progress['togo'] = max(progress['estimated'] - amount_raised, 0)
+  if progress['togo'] > 0:
+    progress['header'] = '${} fundraising goal'.format(intcomma(progress['estimated']))
+  else:
+    progress['header'] = '${} raised'.format(intcomma(amount_raised))
 
-    if donor.received() > 0:
-      donor.summary += ' $%s received by SJF.' % intcomma(donor.received())
-      progress['received'] += donor.received()
-      if donor.received() < donor.total_promised():
-        progress['promised'] += donor.total_promised() - donor.received()
+  # donor summaries; process steps and compile incompletes
+  incomplete_steps = []
+  for donor in donors:
+    donor.summary = 'Asked. ' if donor.asked else ''
+    received = donor.received()
+    if received > 0:
+      donor.summary += ' $%s received by SJF.' % intcomma(received)
     elif donor.promised:
       donor.summary += ' Total promised $%s.' % intcomma(donor.total_promised())
-      progress['promised'] += donor.total_promised()
     elif donor.asked:
       if donor.promised == 0:
         donor.summary += ' Declined to donate.'
       else:
         donor.summary += ' Awaiting response.'
 
-  # progress chart calculations
-  if progress['contacts'] > 0:
-    amount_raised = progress['promised'] + progress['received']
-    progress['contacts_remaining'] = progress['contacts'] - progress['talked'] - progress['asked']
-    progress['togo'] = max(progress['estimated'] - amount_raised, 0)
-    if progress['togo'] > 0:
-      progress['header'] = '${} fundraising goal'.format(intcomma(progress['estimated']))
-    else:
-      progress['header'] = '${} raised'.format(intcomma(amount_raised))
-
-  # process steps; compile incompletes
-  incomplete_steps = []
-  for donor in donors:
     donor.organize_steps()
     if hasattr(donor, 'next_step'):
       incomplete_steps.append(donor.next_step)
@@ -205,24 +199,9 @@ def project_page(request):
   header = project.title
 
   # project metrics/progress
-  progress = {'contacts': 0, 'talked': 0, 'asked': 0, 'promised': 0, 'received': 0}
-  donors = list(models.Donor.objects.filter(membership__giving_project=project))
-  progress['contacts'] = len(donors)
-  for donor in donors:
-    donor.summary = []
-    if donor.asked:
-      progress['asked'] += 1
-    elif donor.talked:
-      progress['talked'] += 1
-    if donor.received() > 0:
-      progress['received'] += donor.received()
-    elif donor.promised:
-      progress['promised'] += donor.total_promised()
-
+  progress = project.get_progress()
   progress['contacts_remaining'] = progress['contacts'] - progress['talked'] - progress['asked']
-  progress['togo'] = project.fund_goal - progress['promised'] - progress['received']
-  if progress['togo'] < 0:
-    progress['togo'] = 0
+  progress['togo'] = max(project.fund_goal - progress['promised'] - progress['received'], 0)
 
   # project resources
   resources = (models.ProjectResource.objects.filter(giving_project=project)
@@ -389,7 +368,7 @@ def set_current(request, ship_id):
     return redirect(manage_account)
 
   member.current = ship.pk
-  member.save()
+  member.save(update_fields=['current'])
 
   return redirect(home)
 
@@ -457,10 +436,12 @@ def project_survey(request, gp_survey_id):
     if form.is_valid():
       form.save()
       logger.info('survey response saved')
+      # cached membership may be stale; read the current list before appending
+      request.membership.refresh_from_db(fields=['completed_surveys'])
       completed = json.loads(request.membership.completed_surveys)
       completed.append(gp_survey.pk)
       request.membership.completed_surveys = json.dumps(completed)
-      request.membership.save()
+      request.membership.save(skip=True, update_fields=['completed_surveys'])
       return HttpResponse('success')
 
   else: # GET
@@ -491,7 +472,7 @@ def copy_contacts(request):
     if 'skip' in request.POST:
       logger.info('User skipping copy contacts')
       request.membership.copied_contacts = True
-      request.membership.save()
+      request.membership.save(skip=True, update_fields=['copied_contacts'])
       return HttpResponse('success')
 
     else:
@@ -506,7 +487,7 @@ def copy_contacts(request):
             contact.save()
             logger.debug('Contact created')
         request.membership.copied_contacts = True
-        request.membership.save()
+        request.membership.save(skip=True, update_fields=['copied_contacts'])
         return HttpResponse('success')
       else: # invalid
         logger.warning('Copy formset somehow invalid?! ' + str(request.POST))
@@ -565,7 +546,7 @@ def add_mult(request):
 
   if request.method == 'POST':
     membership.last_activity = timezone.now()
-    membership.save()
+    membership.save(skip=True, update_fields=['last_activity'])
 
     formset = contact_formset(request.POST)
 
@@ -657,7 +638,7 @@ def add_estimates(request):
 
   if request.method == 'POST':
     membership.last_activity = timezone.now()
-    membership.save(skip=True)
+    membership.save(skip=True, update_fields=['last_activity'])
     formset = est_formset(request.POST)
     logger.debug('Adding estimates - posted: ' + str(request.POST))
 
@@ -710,7 +691,7 @@ def edit_contact(request, donor_id):
   if request.method == 'POST':
     logger.debug(request.POST)
     request.membership.last_activity = timezone.now()
-    request.membership.save(skip=True)
+    request.membership.save(skip=True, update_fields=['last_activity'])
     if est:
       form = modelforms.DonorEditForm(request.POST, instance=donor,
                               auto_id=str(donor.pk) + '_id_%s')
@@ -748,7 +729,7 @@ def delete_contact(request, donor_id):
 
   if request.method == 'POST':
     request.membership.last_activity = timezone.now()
-    request.membership.save(skip=True)
+    request.membership.save(skip=True, update_fields=['last_activity'])
     donor.delete()
     return redirect(home)
 
@@ -784,7 +765,7 @@ def add_step(request, donor_id):
 
   if request.method == 'POST':
     membership.last_activity = timezone.now()
-    membership.save(skip=True)
+    membership.save(skip=True, update_fields=['last_activity'])
     form = modelforms.StepForm(request.POST, auto_id=str(donor.pk) + '_id_%s')
     logger.info('Single step - POST: ' + str(request.POST))
     if form.is_valid():
@@ -824,7 +805,7 @@ def add_mult_step(request):
 
   if request.method == 'POST':
     membership.last_activity = timezone.now()
-    membership.save(skip=True)
+    membership.save(skip=True, update_fields=['last_activity'])
     formset = step_formset(request.POST)
     logger.debug('Multiple steps - posted: ' + str(request.POST))
     if formset.is_valid():
@@ -878,7 +859,7 @@ def edit_step(request, donor_id, step_id):
 
   if request.method == 'POST':
     request.membership.last_activity = timezone.now()
-    request.membership.save(skip=True)
+    request.membership.save(skip=True, update_fields=['last_activity'])
     form = modelforms.StepForm(request.POST, instance=step, auto_id=str(step.pk) +
                            '_id_%s')
     if form.is_valid():
@@ -923,7 +904,7 @@ def complete_step(request, donor_id, step_id):
   if request.method == 'POST':
     # update membership activity timestamp
     membership.last_activity = timezone.now()
-    membership.save(skip=True)
+    membership.save(skip=True, update_fields=['last_activity'])
 
     # get posted form
     form = forms.StepDoneForm(request.POST, auto_id=str(step.pk) + '_id_%s')
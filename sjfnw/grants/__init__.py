@@ -0,0 +1 @@
+default_app_config = 'sjfnw.grants.apps.GrantsConfig'
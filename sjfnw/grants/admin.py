@@ -3,13 +3,15 @@ import logging
 from django.contrib import admin, messages
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
+from django.db.models import Q
 from django.shortcuts import redirect
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 
 from sjfnw import utils
 from sjfnw.admin import BaseModelAdmin, advanced_admin, YearFilter
-from sjfnw.grants import models
+from sjfnw.autocomplete import AutocompleteWidget
+from sjfnw.grants import models, search
 from sjfnw.grants.modelforms import DraftAdminForm, LogAdminForm
 
 logger = logging.getLogger('sjfnw')
@@ -284,7 +286,7 @@ class GrantCycleA(BaseModelAdmin):
 
 class OrganizationA(BaseModelAdmin):
   list_display = ['name', 'email']
-  search_fields = ['name', 'email']
+  search_fields = ['name', 'email'] # see get_search_results
 
   fieldsets = [
     ('', {
@@ -328,6 +330,15 @@ class OrganizationA(BaseModelAdmin):
       'merge': (OrganizationA.merge, 'merge', 'Merge')
     }
 
+  def get_search_results(self, request, queryset, search_term):
+    """ Search names using the name index and emails by prefix """
+    search_term = search_term.strip()
+    if not search_term:
+      return queryset, False
+    matches = queryset.filter(Q(pk__in=search.matching_organizations(search_term)) |
+                              Q(email__istartswith=search_term))
+    return matches, False
+
   def merge(self, request, queryset):
     if len(queryset) != 2:
       messages.warning(request,
@@ -423,7 +434,7 @@ class GrantApplicationA(BaseModelAdmin):
 
 
 class DraftGrantApplicationA(BaseModelAdmin):
-  list_display = ['organization', 'grant_cycle', 'modified', 'overdue',
+  list_display = ['organization', 'grant_cycle', 'modified', 'answered', 'overdue',
                   'extended_deadline']
   list_filter = ['grant_cycle']
   fields = [('organization', 'grant_cycle', 'modified'),
@@ -438,6 +449,12 @@ class DraftGrantApplicationA(BaseModelAdmin):
       return self.readonly_fields + ['organization', 'grant_cycle']
     return self.readonly_fields
 
+  def formfield_for_foreignkey(self, db_field, request, **kwargs):
+    if db_field.name == 'organization':
+      kwargs['widget'] = AutocompleteWidget('organization')
+    return super(DraftGrantApplicationA, self).formfield_for_foreignkey(
+        db_field, request, **kwargs)
+
   def edit(self, obj):
     if not obj or not obj.organization:
       return '-'
@@ -547,6 +564,12 @@ class SponsoredProgramGrantA(BaseModelAdmin):
       return self.readonly_fields + ('organization',)
     return self.readonly_fields
 
+  def formfield_for_foreignkey(self, db_field, request, **kwargs):
+    if db_field.name == 'organization':
+      kwargs['widget'] = AutocompleteWidget('organization')
+    return super(SponsoredProgramGrantA, self).formfield_for_foreignkey(
+        db_field, request, **kwargs)
+
 class YearEndReportA(BaseModelAdmin):
   list_display = ['org', 'award', 'cycle', 'submitted', 'visible', 'view_link']
   list_filter = ['award__projectapp__application__grant_cycle']
@@ -593,7 +616,8 @@ class YearEndReportA(BaseModelAdmin):
 
 
 class YERDraftA(BaseModelAdmin):
-  list_display = ('award', 'organization', 'giving_project', 'grant_cycle', 'modified', 'due')
+  list_display = ('award', 'organization', 'giving_project', 'grant_cycle', 'modified',
+                  'answered', 'due')
 
   fields = (('organization',),
             ('modified', 'due'),
@@ -643,7 +667,7 @@ class LogA(BaseModelAdmin):
 
 class DraftAdv(BaseModelAdmin):
   """ Only used in admin-advanced """
-  list_display = ['organization', 'grant_cycle', 'modified', 'overdue',
+  list_display = ['organization', 'grant_cycle', 'modified', 'answered', 'overdue',
                   'extended_deadline']
   list_filter = ['grant_cycle']
 
@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+class GrantsConfig(AppConfig):
+  name = 'sjfnw.grants'
+  verbose_name = 'Grants'
+
+  def ready(self):
+    from sjfnw.grants import signals # pylint: disable=unused-import
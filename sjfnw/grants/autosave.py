@@ -0,0 +1,153 @@
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+
+from sjfnw.grants.modelforms import APP_ANSWER_FIELDS
+from sjfnw.grants.models import DraftGrantApplication
+from sjfnw.grants.utils import count_answers
+from sjfnw.tasks import DeferredQueue
+
+logger = logging.getLogger('sjfnw')
+
+# Autosave buffer
+# ---------------
+# Draft applications are autosaved every minute by every org that has the
+# form open. Rather than write each autosave to the database, the latest state
+# of a draft is kept in a cache entry keyed by org login and cycle:
+#
+#   {'draft_id', 'contents', 'version', 'modified', 'modified_by'}
+#
+# Only autosaves write the entry. The first autosave after a flush also adds a
+# separate dirty key (cache add is atomic, so only one autosave succeeds) and
+# queues a task that flushes the draft AUTOSAVE_FLUSH_SECONDS later, so each
+# draft gets at most one write per interval. A flush deletes the dirty key
+# before reading the entry, so an autosave that lands during a flush either
+# is read by it or schedules the next one. Database writes only apply to an
+# older version of the draft, so a slow flush can't overwrite newer contents.
+#
+# Views that read or submit a draft flush it first, and any other save of the
+# draft takes the buffered contents with it, bumps the version and discards the
+# entry (see sjfnw.grants.signals), so an older entry can't overwrite it.
+#
+# The cache must be shared by all instances, since conflict detection
+# (modified, modified_by) is read from the entry. If an entry or its dirty key
+# is evicted before it is flushed, changes since the last flush are lost, so
+# the buffer is off unless settings.AUTOSAVE_BUFFER_CACHE names a cache that
+# doesn't evict.
+
+DRAFT_FIELDS = ('contents', 'version', 'modified', 'modified_by')
+
+
+def flush_autosave(username, cycle_id):
+  """ Task that writes a buffered draft to the database """
+  draft_buffer.flush(username, cycle_id)
+
+
+class AutosaveBuffer(object):
+  """ Buffers draft autosaves in settings.AUTOSAVE_BUFFER_CACHE
+
+    If that setting is None, save() writes to the database immediately.
+  """
+  key_prefix = 'grants-autosave'
+
+  def __init__(self, queue=None):
+    self.writes = 0 # database writes, for load testing
+    self._queue = queue
+
+  @property
+  def backend(self):
+    """ Cache backend, or None if buffering is off """
+    alias = getattr(settings, 'AUTOSAVE_BUFFER_CACHE', None)
+    return caches[alias] if alias else None
+
+  @property
+  def queue(self):
+    if self._queue is None:
+      self._queue = DeferredQueue(getattr(settings, 'AUTOSAVE_QUEUE_NAME', 'default'))
+    return self._queue
+
+  def _key(self, username, cycle_id):
+    return '{}:{}:{}'.format(self.key_prefix, cycle_id, username)
+
+  def _dirty_key(self, username, cycle_id):
+    return self._key(username, cycle_id) + ':dirty'
+
+  def get(self, username, cycle_id):
+    """ Returns the buffered entry for a draft, or None """
+    if self.backend is None:
+      return None
+    return self.backend.get(self._key(username, cycle_id))
+
+  def entry(self, draft):
+    """ Create an entry from a draft loaded from the database """
+    entry = {field: getattr(draft, field) for field in DRAFT_FIELDS}
+    entry['draft_id'] = draft.pk
+    return entry
+
+  def save(self, username, cycle_id, entry):
+    """ Store an updated entry, scheduling a flush if one isn't already scheduled """
+    if self.backend is None:
+      self._write(entry)
+      return
+
+    self.backend.set(self._key(username, cycle_id), entry, None)
+    if self.backend.add(self._dirty_key(username, cycle_id), True, None):
+      self.queue.defer(flush_autosave, username, cycle_id,
+                       _countdown=getattr(settings, 'AUTOSAVE_FLUSH_SECONDS', 300))
+
+  def flush(self, username, cycle_id):
+    """ Write a dirty entry to the database. Returns True if the draft was updated """
+    if self.backend is None:
+      return False
+    dirty_key = self._dirty_key(username, cycle_id)
+    if not self.backend.get(dirty_key):
+      return False
+    # clear before reading, so later autosaves schedule another flush
+    self.backend.delete(dirty_key)
+    entry = self.get(username, cycle_id)
+    if not entry:
+      return False
+    return self._write(entry)
+
+  def pending(self, draft):
+    """ Returns the draft's entry if it is newer than the draft, otherwise None """
+    if self.backend is None:
+      return None
+    entry = self.get(draft.organization.email, draft.grant_cycle_id)
+    if entry and entry['draft_id'] == draft.pk and entry['version'] > draft.version:
+      return entry
+    return None
+
+  def take(self, draft):
+    """ Copy a draft's unflushed changes onto it, for a save that is about to
+      happen. A flush after that save won't write, since the draft has the
+      entry's version. Returns True if there were changes """
+    entry = self.pending(draft)
+    if entry is None:
+      return False
+    for field in DRAFT_FIELDS:
+      setattr(draft, field, entry[field])
+    return True
+
+  def discard(self, username, cycle_id):
+    if self.backend is not None:
+      self.backend.delete_many([self._key(username, cycle_id),
+                                self._dirty_key(username, cycle_id)])
+
+  def clear(self):
+    """ Clears the whole cache backend """
+    if self.backend is not None:
+      self.backend.clear()
+
+  def _write(self, entry):
+    """ Update only the autosaved columns of the draft (and its answer count), if
+      the draft is older than the entry. Returns True if it was updated """
+    values = {field: entry[field] for field in DRAFT_FIELDS}
+    values['answered'] = count_answers(entry['contents'], APP_ANSWER_FIELDS)
+    updated = (DraftGrantApplication.objects
+        .filter(pk=entry['draft_id'], version__lt=entry['version']).update(**values))
+    self.writes += updated
+    return bool(updated)
+
+draft_buffer = AutosaveBuffer()
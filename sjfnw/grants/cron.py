@@ -1,77 +1,126 @@
 from datetime import timedelta
 import logging
 
-from django.core.mail import EmailMultiAlternatives
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.http import HttpResponse
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.html import strip_tags
 
 from sjfnw import constants as c
-from sjfnw.grants.models import DraftGrantApplication, GivingProjectGrant
+from sjfnw.grants.models import (DraftGrantApplication, DraftWarningSent, YearEndReportDue,
+    YERReminderSent)
 
 logger = logging.getLogger('sjfnw')
 
+# (days' warning, closing window start, end) - a draft gets the 7 day warning if
+# it was created more than 8 days before its cycle closes, otherwise the 3 day one
+DRAFT_WARNINGS = ((7, timedelta(days=7), timedelta(days=8)),
+                  (3, timedelta(days=2), timedelta(days=3)))
+
+# (days' notice, first, last days before due) - a report due within the window
+# gets the reminder. windows are a few days wide so missed runs catch up
+YER_REMINDERS = ((30, 28, 30), (7, 5, 7))
+
 def draft_app_warning(request):
   """ Warn orgs of impending draft freezes
-      NOTE: must run exactly once a day
-      Gives 7 day warning if created 7+ days before close, otherwise 3 day warning """
-
-  drafts = DraftGrantApplication.objects.all()
-  eight_days = timedelta(days=8)
-
-  for draft in drafts:
-    time_left = draft.grant_cycle.close - timezone.now()
-    created_delta = draft.grant_cycle.close - draft.created
-    if ((created_delta > eight_days and eight_days > time_left > timedelta(days=7)) or
-        (created_delta < eight_days and timedelta(days=3) > time_left >= timedelta(days=2))):
-      subject, from_email = 'Grant cycle closing soon', c.GRANT_EMAIL
-      to_email = draft.organization.email
-      html_content = render_to_string('grants/email_draft_warning.html', {
-        'org': draft.organization, 'cycle': draft.grant_cycle
-      })
-      text_content = strip_tags(html_content)
-      msg = EmailMultiAlternatives(subject, text_content, from_email, [to_email],
-                                   [c.SUPPORT_EMAIL])
-      msg.attach_alternative(html_content, 'text/html')
-      msg.send()
-      logger.info('Email sent to %s regarding draft application soon to expire', to_email)
+
+    Each warning window is a day wide and sent warnings are recorded as
+    DraftWarningSent, so this can run more than once a day or be retried
+    without emailing anyone twice. """
+
+  now = timezone.now()
+  eight_days_before_close = F('grant_cycle__close') - timedelta(days=8)
+  messages, sent = [], []
+
+  for days, start, end in DRAFT_WARNINGS:
+    drafts = (DraftGrantApplication.objects
+        .filter(grant_cycle__close__gte=now + start, grant_cycle__close__lt=now + end)
+        .exclude(warnings_sent__days=days)
+        .select_related('organization', 'grant_cycle'))
+    if days == 7:
+      drafts = drafts.filter(created__lt=eight_days_before_close)
+    else:
+      drafts = drafts.filter(created__gt=eight_days_before_close)
+    for draft in drafts:
+      messages.append(_draft_warning_message(draft))
+      sent.append(DraftWarningSent(draft=draft, days=days, sent=now))
+
+  try:
+    with transaction.atomic():
+      DraftWarningSent.objects.bulk_create(sent)
+  except IntegrityError:
+    # another run recorded (and is sending) some of these warnings
+    logger.warning('Draft warnings were sent by another run; skipping')
+    return HttpResponse('')
+
+  get_connection().send_messages(messages)
+  logger.info('Sent %d draft warning emails', len(messages))
   return HttpResponse('')
 
 
+def _draft_warning_message(draft):
+  to_email = draft.organization.email
+  html_content = render_to_string('grants/email_draft_warning.html', {
+    'org': draft.organization, 'cycle': draft.grant_cycle
+  })
+  text_content = strip_tags(html_content)
+  msg = EmailMultiAlternatives('Grant cycle closing soon', text_content, c.GRANT_EMAIL,
+                               [to_email], [c.SUPPORT_EMAIL])
+  msg.attach_alternative(html_content, 'text/html')
+  logger.info('Emailing %s regarding draft application soon to expire', to_email)
+  return msg
+
+
 def yer_reminder_email(request):
   """ Remind orgs of upcoming year end reports that are due
-      NOTE: Must run exactly once a day. ONLY SUPPORTS UP TO 2-YEAR GRANTS
-      Sends reminder emails at 1 month and 1 week """
-
-  today = timezone.now().date()
-
-  # get awards due in 7 or 30 days
-  year_ago = today.replace(year=today.year - 1)
-  award_dates = [
-      today + timedelta(days=7),
-      today + timedelta(days=30),
-      year_ago + timedelta(days=7),
-      year_ago + timedelta(days=30)
-  ]
-  awards = GivingProjectGrant.objects.filter(first_yer_due__in=award_dates)
-
-  for award in awards:
-    if award.yearendreport_set.count() < award.grant_length():
-      app = award.projectapp.application
-
-      from_email = c.GRANT_EMAIL
-      to_email = app.organization.email
-      html_content = render_to_string('grants/email_yer_due.html', {
-        'award': award, 'app': app, 'gp': award.projectapp.giving_project,
-        'base_url': c.APP_BASE_URL
-      })
-      text_content = strip_tags(html_content)
-
-      msg = EmailMultiAlternatives('Year end report', text_content, from_email,
-                                   [to_email], [c.SUPPORT_EMAIL])
-      msg.attach_alternative(html_content, 'text/html')
-      msg.send()
-      logger.info('YER reminder email sent to %s for award %d', to_email, award.pk)
 
+    Sends reminder emails about 1 month and 1 week before each report's due
+    date. Sent reminders are recorded as YERReminderSent, so this can run more
+    than once a day, be retried or miss a day without emailing anyone twice
+    or skipping a reminder. """
+
+  now = timezone.now()
+  today = now.date()
+  messages, sent = [], []
+
+  for days, first, last in YER_REMINDERS:
+    dues = (YearEndReportDue.objects
+        .filter(fulfilled=False, due__gte=today + timedelta(days=first),
+                due__lte=today + timedelta(days=last))
+        .exclude(reminders_sent__days=days)
+        .select_related('award__projectapp__application__organization',
+                        'award__projectapp__application__grant_cycle',
+                        'award__projectapp__giving_project'))
+    for due in dues:
+      messages.append(_yer_reminder_message(due))
+      sent.append(YERReminderSent(due=due, days=days, sent=now))
+
+  try:
+    with transaction.atomic():
+      YERReminderSent.objects.bulk_create(sent)
+  except IntegrityError:
+    # another run recorded (and is sending) some of these reminders
+    logger.warning('YER reminders were sent by another run; skipping')
+    return HttpResponse('success')
+
+  get_connection().send_messages(messages)
   return HttpResponse('success')
+
+
+def _yer_reminder_message(due):
+  award = due.award
+  app = award.projectapp.application
+  to_email = app.organization.email
+  html_content = render_to_string('grants/email_yer_due.html', {
+    'award': award, 'app': app, 'gp': award.projectapp.giving_project,
+    'due_date': due.due, 'base_url': c.APP_BASE_URL
+  })
+  text_content = strip_tags(html_content)
+  msg = EmailMultiAlternatives('Year end report', text_content, c.GRANT_EMAIL,
+                               [to_email], [c.SUPPORT_EMAIL])
+  msg.attach_alternative(html_content, 'text/html')
+  logger.info('YER reminder email to %s for award %d', to_email, award.pk)
+  return msg
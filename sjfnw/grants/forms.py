@@ -6,6 +6,7 @@ from django.core.exceptions import ValidationError
 from django.utils import timezone
 from django.utils.safestring import mark_safe
 
+from sjfnw.autocomplete import AutocompleteWidget
 from sjfnw.fund.models import GivingProject
 from sjfnw.grants import constants as gc
 from sjfnw.grants.models import (Organization, GrantCycle, GrantApplication,
@@ -173,7 +174,7 @@ class BaseReportForm(forms.Form):
 
   # filters
   organization_name = forms.CharField(max_length=255, required=False,
-      help_text='Organization name must contain the given text')
+      help_text='Organization name must have words starting with each word of the given text')
   city = forms.CharField(max_length=255, required=False,
       help_text='City must match the given text')
   state = forms.MultipleChoiceField(choices=gc.STATE_CHOICES[:5],
@@ -204,7 +205,10 @@ class BaseReportForm(forms.Form):
       ])
   report_fiscal = forms.BooleanField(label='Fiscal sponsor', required=False)
 
-  format = forms.ChoiceField(choices=[('csv', 'CSV'), ('browse', 'Don\'t export, just browse')])
+  format = forms.ChoiceField(choices=[
+    ('csv', 'CSV'), ('browse', 'Don\'t export, just browse'),
+    ('background', 'CSV, generated in the background (for large reports)')
+  ])
 
   class Meta:
     abstract = True
@@ -327,12 +331,8 @@ class OrgReportForm(BaseReportForm):
 
 
 class LoginAsOrgForm(forms.Form):
-
-  def __init__(self, *args, **kwargs):
-    super(LoginAsOrgForm, self).__init__(*args, **kwargs)
-    orgs = Organization.objects.order_by('name')
-    self.fields['organization'] = forms.ChoiceField(
-        choices=[('', '--- Organizations ---')] + [(o.email, unicode(o)) for o in orgs])
+  organization = forms.ModelChoiceField(queryset=Organization.objects.all(),
+                                        widget=AutocompleteWidget('organization'))
 
 
 class OrgMergeForm(forms.Form):
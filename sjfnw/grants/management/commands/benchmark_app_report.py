@@ -0,0 +1,104 @@
+import time
+
+from django import forms
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.backends.utils import CursorWrapper
+from django.utils import timezone
+
+from sjfnw.grants.forms import AppReportForm
+from sjfnw.grants.models import GrantApplication, GrantCycle, Organization
+from sjfnw.grants.views import get_app_results
+
+
+class ByteCountingCursor(CursorWrapper):
+  """ Cursor that adds up the size of every value fetched through it """
+
+  fetched = 0
+
+  def _count(self, rows):
+    for row in rows:
+      ByteCountingCursor.fetched += sum(len(unicode(val)) for val in row if val is not None)
+    return rows
+
+  def fetchone(self):
+    row = self.cursor.fetchone()
+    return self._count([row])[0] if row else row
+
+  def fetchmany(self, *args, **kwargs):
+    return self._count(self.cursor.fetchmany(*args, **kwargs))
+
+  def fetchall(self):
+    return self._count(self.cursor.fetchall())
+
+
+class Command(BaseCommand):
+
+  help = ('Times application reports with the fewest and the most columns, and counts the '
+          'bytes they fetch. Test data is created in a transaction that is rolled back.')
+
+  def add_arguments(self, parser):
+    parser.add_argument('--apps', type=int, default=1000,
+                        help='Number of applications to generate')
+    parser.add_argument('--text-length', type=int, default=2000,
+                        help='Length of each generated text answer')
+
+  def handle(self, *args, **options):
+    self.stdout.write('{:>8} {:>8} {:>12} {:>10}'.format('report', 'columns', 'bytes', 'ms'))
+
+    with transaction.atomic():
+      self._create_apps(options['apps'], options['text_length'])
+      for name, select_fields in (('narrow', False), ('wide', True)):
+        field_names, elapsed, fetched = self._run(select_fields)
+        self.stdout.write('{:>8} {:>8} {:>12} {:>10.1f}'.format(
+            name, len(field_names), fetched, elapsed * 1000))
+      transaction.set_rollback(True)
+
+  def _create_apps(self, count, text_length):
+    now = timezone.now()
+    cycle = GrantCycle.objects.create(title='Benchmark cycle', open=now, close=now)
+    Organization.objects.bulk_create([
+      Organization(name='Benchmark org {}'.format(i), email='benchmark{}@example.com'.format(i))
+      for i in range(count)
+    ])
+    text = 'x' * text_length
+    answers = {field.name: text for field in GrantApplication._meta.fields
+               if field.get_internal_type() == 'TextField'}
+    GrantApplication.objects.bulk_create([
+      GrantApplication(organization=org, grant_cycle=cycle, founded='1998', budget_last=300,
+                       budget_current=600, amount_requested=99, **answers)
+      for org in Organization.objects.filter(name__startswith='Benchmark org ')
+    ])
+
+  def _run(self, select_fields):
+    """ Run the report, returning its field names, elapsed time and bytes fetched """
+    form = AppReportForm(self._form_data(select_fields))
+    if not form.is_valid():
+      raise ValueError('Invalid report options: {}'.format(form.errors))
+
+    # wrap every cursor the report opens, whether or not queries are being logged
+    make_cursor, make_debug_cursor = connection.make_cursor, connection.make_debug_cursor
+    connection.make_cursor = connection.make_debug_cursor = (
+        lambda cursor: ByteCountingCursor(cursor, connection))
+    ByteCountingCursor.fetched = 0
+    try:
+      start = time.time()
+      field_names, results = get_app_results(form.cleaned_data)
+      list(results)
+      elapsed = time.time() - start
+    finally:
+      connection.make_cursor, connection.make_debug_cursor = make_cursor, make_debug_cursor
+    return field_names, elapsed, ByteCountingCursor.fetched
+
+  def _form_data(self, select_fields):
+    year = timezone.now().year
+    data = {'year_min': year, 'year_max': year, 'format': 'csv'}
+    if select_fields:
+      for name, field in AppReportForm().fields.items():
+        if not name.startswith('report'):
+          continue
+        if isinstance(field, forms.MultipleChoiceField):
+          data[name] = [choice[0] for choice in field.choices]
+        else:
+          data[name] = True
+    return data
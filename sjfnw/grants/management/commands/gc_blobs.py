@@ -0,0 +1,135 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+import operator, time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db.models import FileField, Q
+from django.utils import timezone
+
+from sjfnw.grants.models import StoredBlob
+from sjfnw.grants.storage import get_file_backend
+
+
+def count_references(backend, keys=None):
+  """ Count the file fields referring to each stored file
+
+  Arguments:
+    keys - only count references to these keys
+
+  Returns:
+    Counter of backend key to number of references
+  """
+  references = Counter()
+  for model in apps.get_app_config('grants').get_models():
+    for field in model._meta.fields:
+      if not isinstance(field, FileField):
+        continue
+      names = (model.objects.exclude(**{field.name: ''}).exclude(**{field.name + '__isnull': True})
+                            .values_list(field.name, flat=True))
+      if keys is not None:
+        # names start with their key; backend.key below drops other prefix matches
+        names = names.filter(reduce(operator.or_, [
+          Q(**{field.name + '__startswith': key}) for key in keys
+        ]))
+      for name in names.iterator():
+        key = backend.key(name)
+        if keys is None or key in keys:
+          references[key] += 1
+  return references
+
+
+class Command(BaseCommand):
+
+  help = ('Counts references to uploaded files and deletes files that nothing refers to. '
+          'Only files recorded as StoredBlobs are considered; use --index-existing to record '
+          'files uploaded before they were tracked.')
+
+  def add_arguments(self, parser):
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='Number of files to update or delete at a time')
+    parser.add_argument('--grace-days', type=int, default=7,
+                        help='Keep unreferenced files uploaded or linked to more recently '
+                             'than this')
+    parser.add_argument('--index-existing', action='store_true',
+                        help='First record stored files that have no StoredBlob')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Count references but do not delete anything')
+
+  def handle(self, *args, **options):
+    backend = get_file_backend()
+    batch_size = options['batch_size']
+
+    if options['index_existing']:
+      start = time.time()
+      indexed = self._index_existing(backend, batch_size)
+      self.stdout.write('Indexed {} files in {:.1f}s'.format(indexed, time.time() - start))
+
+    start = time.time()
+    references = count_references(backend)
+    updated = self._update_counts(references, batch_size)
+    self.stdout.write('Counted {} references, updated {} files in {:.1f}s'.format(
+        sum(references.values()), updated, time.time() - start))
+
+    # dedupe updates last_linked when an upload reuses a file, so files that
+    # became referenced after they were counted are outside the cutoff
+    cutoff = timezone.now() - timedelta(days=options['grace_days'])
+    unreferenced = StoredBlob.objects.filter(references=0, last_linked__lt=cutoff)
+    if options['dry_run']:
+      self.stdout.write('Would delete {} files'.format(unreferenced.count()))
+      return
+
+    start = time.time()
+    deleted = 0
+    while True:
+      batch = dict(unreferenced.values_list('key', 'pk')[:batch_size])
+      if not batch:
+        break
+      # check again, since references may have been added while counting
+      referenced = count_references(backend, keys=set(batch))
+      for key, count in referenced.items():
+        StoredBlob.objects.filter(pk=batch.pop(key)).update(references=count,
+                                                           counted=timezone.now())
+      if batch:
+        backend.delete_many(batch.keys())
+        StoredBlob.objects.filter(pk__in=batch.values()).delete()
+        deleted += len(batch)
+    self.stdout.write('Deleted {} files in {:.1f}s'.format(deleted, time.time() - start))
+
+  def _index_existing(self, backend, batch_size):
+    known = set(StoredBlob.objects.values_list('key', flat=True))
+    new, indexed = [], 0
+    for key in backend.list_keys():
+      if key in known:
+        continue
+      stored = backend.stat(key)
+      if stored is None:
+        continue
+      new.append(StoredBlob(key=key, md5=backend.md5(key) or '', size=stored.size,
+                            created=stored.created))
+      if len(new) == batch_size:
+        StoredBlob.objects.bulk_create(new)
+        indexed, new = indexed + len(new), []
+    StoredBlob.objects.bulk_create(new)
+    return indexed + len(new)
+
+  def _update_counts(self, references, batch_size):
+    """ Store each StoredBlob's reference count. Returns number changed """
+    now = timezone.now()
+    updated = 0
+    blobs = StoredBlob.objects.order_by('pk').values_list('pk', 'key', 'references')
+    last_pk = 0
+    while True:
+      batch = list(blobs.filter(pk__gt=last_pk)[:batch_size])
+      if not batch:
+        break
+      last_pk = batch[-1][0]
+      # one update per distinct count
+      changed = defaultdict(list)
+      for pk, key, count in batch:
+        if references[key] != count:
+          changed[references[key]].append(pk)
+      for count, pks in changed.items():
+        StoredBlob.objects.filter(pk__in=pks).update(references=count, counted=now)
+        updated += len(pks)
+    return updated
@@ -0,0 +1,96 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from sjfnw.grants import autosave
+from sjfnw.grants.models import DraftGrantApplication, GrantCycle, Organization
+
+
+class SimulatedQueue(object):
+  """ Queue that runs tasks when a simulated clock passes their countdown """
+
+  def __init__(self):
+    self.now = 0
+    self.tasks = []
+
+  def defer(self, func, *args, **kwargs):
+    due = self.now + kwargs.pop('_countdown', 0)
+    self.tasks.append((due, func, args))
+
+  def advance(self, seconds):
+    self.now += seconds
+    due = [task for task in self.tasks if task[0] <= self.now]
+    self.tasks = [task for task in self.tasks if task[0] > self.now]
+    for _, func, args in due:
+      func(*args)
+
+
+class Command(BaseCommand):
+
+  help = ('Simulates orgs autosaving draft applications and compares database writes per '
+          'minute with and without the autosave buffer. Test data is created in a '
+          'transaction that is rolled back.')
+
+  def add_arguments(self, parser):
+    parser.add_argument('--drafts', type=int, default=100,
+                        help='Number of drafts being edited at once')
+    parser.add_argument('--minutes', type=int, default=30,
+                        help='Length of the simulated editing session')
+    parser.add_argument('--interval', type=int, default=60,
+                        help='Seconds between autosaves of each draft')
+
+  def handle(self, *args, **options):
+    self.stdout.write('{:>10} {:>10} {:>10} {:>12}'.format(
+        'buffer', 'autosaves', 'writes', 'writes/min'))
+
+    with transaction.atomic():
+      drafts = self._create_drafts(options['drafts'])
+      for name, alias in (('off', None), ('on', 'default')):
+        with override_settings(AUTOSAVE_BUFFER_CACHE=alias):
+          saves, writes = self._run(drafts, options['minutes'], options['interval'])
+        self.stdout.write('{:>10} {:>10} {:>10} {:>12.1f}'.format(
+            name, saves, writes, writes / float(options['minutes'])))
+      transaction.set_rollback(True)
+
+  def _create_drafts(self, count):
+    now = timezone.now()
+    cycle = GrantCycle.objects.create(title='Load test cycle', open=now, close=now)
+    Organization.objects.bulk_create([
+      Organization(name='Load test org {}'.format(i), email='loadtest{}@example.com'.format(i))
+      for i in range(count)
+    ])
+    DraftGrantApplication.objects.bulk_create([
+      DraftGrantApplication(organization=org, grant_cycle=cycle)
+      for org in Organization.objects.filter(name__startswith='Load test org ')
+    ])
+    return list(DraftGrantApplication.objects.filter(grant_cycle=cycle)
+                                              .select_related('organization'))
+
+  def _run(self, drafts, minutes, interval):
+    """ Autosave every draft each interval. Returns number of autosaves and writes """
+    queue = SimulatedQueue()
+    real_buffer = autosave.draft_buffer
+    autosave.draft_buffer = draft_buffer = autosave.AutosaveBuffer(queue=queue)
+    draft_buffer.clear()
+    saves = 0
+    try:
+      for tick in range(0, minutes * 60, interval):
+        for draft in drafts:
+          username, cycle_id = draft.organization.email, draft.grant_cycle_id
+          entry = draft_buffer.get(username, cycle_id) or draft_buffer.entry(draft)
+          entry['contents'] = json.dumps({'mission': 'Edited at {}'.format(tick)})
+          entry['version'] += 1
+          entry['modified'] = timezone.now()
+          draft_buffer.save(username, cycle_id, entry)
+          saves += 1
+        queue.advance(interval)
+      # org closes the form; its next load flushes anything left
+      for draft in drafts:
+        draft_buffer.flush(draft.organization.email, draft.grant_cycle_id)
+    finally:
+      draft_buffer.clear()
+      autosave.draft_buffer = real_buffer
+    return saves, draft_buffer.writes
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+from django.conf import settings
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('grants', '0009_alter_yerdraft_model_options'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportExport',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('report_type', models.CharField(max_length=50)),
+                ('options', models.TextField(default=b'{}')),
+                ('status', models.CharField(default=b'queued', max_length=10, choices=[(b'queued', b'Queued'), (b'running', b'Running'), (b'done', b'Done'), (b'failed', b'Failed')])),
+                ('rows_processed', models.PositiveIntegerField(default=0)),
+                ('completed', models.DateTimeField(null=True, blank=True)),
+                ('created_by', models.ForeignKey(blank=True, to=settings.AUTH_USER_MODEL, null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReportExportChunk',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('index', models.PositiveIntegerField()),
+                ('content', models.TextField()),
+                ('export', models.ForeignKey(to='grants.ReportExport')),
+            ],
+            options={
+                'ordering': ['index'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='reportexportchunk',
+            unique_together=set([('export', 'index')]),
+        ),
+    ]
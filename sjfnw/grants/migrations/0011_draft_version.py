@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grants', '0010_reportexport'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='draftgrantapplication',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='yerdraft',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grants', '0011_draft_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='draftgrantapplication',
+            name='answered',
+            field=models.PositiveSmallIntegerField(default=0, help_text=b'Number of questions with an answer.'),
+        ),
+        migrations.AddField(
+            model_name='yerdraft',
+            name='answered',
+            field=models.PositiveSmallIntegerField(default=0, help_text=b'Number of questions with an answer.'),
+        ),
+        # existing drafts are counted in 0017_recount_draft_answers
+    ]
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from sjfnw.grants.utils import normalize_words
+
+
+def index_names(apps, schema_editor):
+  """ Create name words for existing organizations """
+
+  Organization = apps.get_model('grants', 'Organization')
+  OrganizationNameWord = apps.get_model('grants', 'OrganizationNameWord')
+  for org in Organization.objects.only('pk', 'name').iterator():
+    OrganizationNameWord.objects.bulk_create([
+      OrganizationNameWord(organization_id=org.pk, word=word)
+      for word in set(normalize_words(org.name))
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grants', '0013_storedblob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrganizationNameWord',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('word', models.CharField(max_length=100, db_index=True)),
+                ('organization', models.ForeignKey(to='grants.Organization')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='organizationnameword',
+            unique_together=set([('organization', 'word')]),
+        ),
+        migrations.RunPython(index_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grants', '0014_organizationnameword'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DraftWarningSent',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('days', models.PositiveSmallIntegerField()),
+                ('sent', models.DateTimeField(default=django.utils.timezone.now)),
+                ('draft', models.ForeignKey(related_name='warnings_sent', to='grants.DraftGrantApplication')),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='grantcycle',
+            name='close',
+            field=models.DateTimeField(db_index=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='draftwarningsent',
+            unique_together=set([('draft', 'days')]),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import Count
+
+from sjfnw.grants.utils import yer_schedule
+
+
+def build_schedules(apps, schema_editor):
+  """ Create year-end report schedules for existing awards """
+
+  GivingProjectGrant = apps.get_model('grants', 'GivingProjectGrant')
+  YearEndReportDue = apps.get_model('grants', 'YearEndReportDue')
+  awards = GivingProjectGrant.objects.annotate(submitted=Count('yearendreport'))
+  for award in awards.iterator():
+    length = 2 if award.second_amount else 1 # GivingProjectGrant.grant_length
+    YearEndReportDue.objects.bulk_create([
+      YearEndReportDue(award_id=award.pk, number=number, due=due, fulfilled=fulfilled)
+      for number, due, fulfilled in yer_schedule(award.first_yer_due, length, award.submitted)
+    ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grants', '0015_draftwarningsent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='YearEndReportDue',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('number', models.PositiveSmallIntegerField()),
+                ('due', models.DateField()),
+                ('fulfilled', models.BooleanField(default=False)),
+                ('award', models.ForeignKey(related_name='yer_schedule', to='grants.GivingProjectGrant')),
+            ],
+            options={
+                'ordering': ['award', 'number'],
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='yearendreportdue',
+            unique_together=set([('award', 'number')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='yearendreportdue',
+            index_together=set([('fulfilled', 'due')]),
+        ),
+        migrations.RunPython(build_schedules, migrations.RunPython.noop),
+    ]
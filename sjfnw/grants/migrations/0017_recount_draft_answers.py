@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+from sjfnw.grants.modelforms import APP_ANSWER_FIELDS, YER_ANSWER_FIELDS
+from sjfnw.grants.utils import count_answers
+
+
+def count_draft_answers(apps, schema_editor):
+  """ Count answered for existing drafts, only including form fields """
+
+  for model_name, field_names in (('DraftGrantApplication', APP_ANSWER_FIELDS),
+                                  ('YERDraft', YER_ANSWER_FIELDS)):
+    Draft = apps.get_model('grants', model_name)
+    for draft in Draft.objects.only('pk', 'contents').iterator():
+      Draft.objects.filter(pk=draft.pk).update(
+          answered=count_answers(draft.contents, field_names))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grants', '0016_yearendreportdue'),
+    ]
+
+    operations = [
+        migrations.RunPython(count_draft_answers, migrations.RunPython.noop),
+    ]
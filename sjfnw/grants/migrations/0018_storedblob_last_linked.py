@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.db.models import F
+import django.utils.timezone
+
+
+def set_last_linked(apps, schema_editor):
+  """ Existing files were last linked when they were uploaded """
+  StoredBlob = apps.get_model('grants', 'StoredBlob')
+  StoredBlob.objects.update(last_linked=F('created'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grants', '0017_recount_draft_answers'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='storedblob',
+            name='last_linked',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(set_last_linked, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from datetime import timedelta
+
+from django.db import models, migrations
+from django.utils import timezone
+import django.utils.timezone
+
+
+def record_sent_reminders(apps, schema_editor):
+  """ Reminders used to go out exactly 30 and 7 days before the due date. Record
+    the ones already sent for reports that are inside the new, wider windows """
+
+  YearEndReportDue = apps.get_model('grants', 'YearEndReportDue')
+  YERReminderSent = apps.get_model('grants', 'YERReminderSent')
+  now = timezone.now()
+  today = now.date()
+  sent = []
+  for days, first in ((30, 28), (7, 5)):
+    dues = YearEndReportDue.objects.filter(
+        fulfilled=False, due__gte=today + timedelta(days=first),
+        due__lt=today + timedelta(days=days))
+    sent += [YERReminderSent(due_id=due_id, days=days, sent=now)
+             for due_id in dues.values_list('pk', flat=True)]
+  YERReminderSent.objects.bulk_create(sent)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('grants', '0018_storedblob_last_linked'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='YERReminderSent',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('days', models.PositiveSmallIntegerField()),
+                ('sent', models.DateTimeField(default=django.utils.timezone.now)),
+                ('due', models.ForeignKey(related_name='reminders_sent', to='grants.YearEndReportDue')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='yerremindersent',
+            unique_together=set([('due', 'days')]),
+        ),
+        migrations.RunPython(record_sent_reminders, migrations.RunPython.noop),
+    ]
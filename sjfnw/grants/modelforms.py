@@ -352,6 +352,12 @@ class YearEndReportForm(ModelForm):
       )
     return super(YearEndReportForm, self).clean()
 
+# form fields a draft's contents can answer, for DraftGrantApplication.answered
+# and YERDraft.answered. the rest are filled in on submit
+APP_ANSWER_FIELDS = frozenset(GrantApplicationModelForm.base_fields) - {
+    'organization', 'grant_cycle'}
+YER_ANSWER_FIELDS = frozenset(YearEndReportForm.base_fields) - {'award', 'stay_informed'}
+
 # ADMIN
 
 class DraftAdminForm(ModelForm):
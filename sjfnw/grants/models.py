@@ -105,10 +105,24 @@ class Organization(models.Model):
     logger.info('org profile updated - %s', self.name)
 
 
+class OrganizationNameWord(models.Model):
+  """ A normalized word from an organization's name, for searching by name
+    without scanning every org. Maintained by sjfnw.grants.search """
+
+  organization = models.ForeignKey(Organization)
+  word = models.CharField(max_length=100, db_index=True)
+
+  class Meta:
+    unique_together = ('organization', 'word')
+
+  def __unicode__(self):
+    return self.word
+
+
 class GrantCycle(models.Model):
   title = models.CharField(max_length=100)
   open = models.DateTimeField()
-  close = models.DateTimeField()
+  close = models.DateTimeField(db_index=True)
   extra_question = models.TextField(blank=True)
   info_page = models.URLField()
   email_signature = models.TextField(blank=True)
@@ -159,6 +173,11 @@ class DraftGrantApplication(models.Model):
   modified_by = models.CharField(blank=True, max_length=100)
 
   contents = models.TextField(default='{}') # json'd dictionary of form contents
+  version = models.PositiveIntegerField(default=0) # incremented by each save
+  # kept in sync with contents so lists can show progress without parsing it
+  # (see sjfnw.grants.signals)
+  answered = models.PositiveSmallIntegerField(default=0,
+      help_text='Number of questions with an answer.')
 
   demographics = models.FileField(upload_to='/', max_length=255)
   funding_sources = models.FileField(upload_to='/', max_length=255)
@@ -196,7 +215,27 @@ class DraftGrantApplication(models.Model):
     return self.grant_cycle.close <= timezone.now()
 
   def recently_edited(self):
-    return timezone.now() < self.modified + timedelta(seconds=35)
+    return self.is_recent(self.modified)
+
+  @classmethod
+  def is_recent(cls, modified):
+    """ Whether a draft modified at the given time counts as recently edited """
+    return timezone.now() < modified + timedelta(seconds=35)
+
+
+class DraftWarningSent(models.Model):
+  """ Record of a draft's org being warned that its cycle is about to close,
+    so the warning is sent once however often the cron job runs """
+
+  draft = models.ForeignKey(DraftGrantApplication, related_name='warnings_sent')
+  days = models.PositiveSmallIntegerField() # days' warning given
+  sent = models.DateTimeField(default=timezone.now)
+
+  class Meta:
+    unique_together = ('draft', 'days')
+
+  def __unicode__(self):
+    return u'{}-day warning for {}'.format(self.days, self.draft_id)
 
 
 class WordLimitValidator(BaseValidator):
@@ -565,11 +604,8 @@ class GivingProjectGrant(models.Model):
     """ Year-end reports are due n year(s) after agreement was mailed
       Returns datetime.date or None if all YER have been submitted for this grant
     """
-    completed = self.yearendreport_set.count()
-    if completed >= self.grant_length():
-      return None
-    else:
-      return self.first_yer_due.replace(year=self.first_yer_due.year + completed)
+    return (self.yer_schedule.filter(fulfilled=False).order_by('number')
+                             .values_list('due', flat=True).first())
 
   def total_amount(self):
     """ Total amount granted, or 0 if no amount has been entered """
@@ -710,11 +746,82 @@ class YearEndReport(models.Model):
     return ', '.join(display)
 
 
+class YearEndReportDue(models.Model):
+  """ One year-end report required by an award, with its due date
+
+    An award's schedule is rebuilt when it is saved, and reports are marked
+    fulfilled in order as they are submitted or deleted (see
+    sjfnw.grants.signals), so due and overdue reports can be found with one
+    query instead of counting each award's reports.
+  """
+  award = models.ForeignKey(GivingProjectGrant, related_name='yer_schedule')
+  number = models.PositiveSmallIntegerField() # 1 for the first report
+  due = models.DateField()
+  fulfilled = models.BooleanField(default=False)
+
+  class Meta:
+    ordering = ['award', 'number']
+    unique_together = ('award', 'number')
+    index_together = ('fulfilled', 'due')
+
+  def __unicode__(self):
+    return u'YER {} for award {}, due {}'.format(self.number, self.award_id, self.due)
+
+  @classmethod
+  def refresh(cls, award):
+    """ Create, update or remove rows to match the award's length and reports """
+    submitted = award.yearendreport_set.count()
+    # may still be a string if the award was just created from one
+    first_due = award._meta.get_field('first_yer_due').to_python(award.first_yer_due)
+    existing = {row.number: row for row in cls.objects.filter(award_id=award.pk)}
+    new = []
+    for number, due, fulfilled in utils.yer_schedule(first_due, award.grant_length(),
+                                                     submitted):
+      row = existing.pop(number, None)
+      if row is None:
+        new.append(cls(award_id=award.pk, number=number, due=due, fulfilled=fulfilled))
+      elif row.due != due or row.fulfilled != fulfilled:
+        if row.due != due: # remind again for the new date
+          row.reminders_sent.all().delete()
+        row.due, row.fulfilled = due, fulfilled
+        row.save()
+    cls.objects.bulk_create(new)
+    if existing:
+      cls.objects.filter(pk__in=[row.pk for row in existing.values()]).delete()
+
+  @classmethod
+  def mark_fulfilled(cls, award_id):
+    """ Update fulfilled flags from the number of reports submitted. Doesn't
+      create rows, since the award may be in the middle of being deleted """
+    submitted = YearEndReport.objects.filter(award_id=award_id).count()
+    rows = cls.objects.filter(award_id=award_id)
+    rows.filter(number__lte=submitted, fulfilled=False).update(fulfilled=True)
+    rows.filter(number__gt=submitted, fulfilled=True).update(fulfilled=False)
+
+
+class YERReminderSent(models.Model):
+  """ Record of an org being reminded that a year-end report is due, so the
+    reminder is sent once however often the cron job runs """
+
+  due = models.ForeignKey(YearEndReportDue, related_name='reminders_sent')
+  days = models.PositiveSmallIntegerField() # days' notice given
+  sent = models.DateTimeField(default=timezone.now)
+
+  class Meta:
+    unique_together = ('due', 'days')
+
+  def __unicode__(self):
+    return u'{}-day reminder for {}'.format(self.days, self.due_id)
+
+
 class YERDraft(models.Model):
 
   award = models.ForeignKey(GivingProjectGrant)
   modified = models.DateTimeField(default=timezone.now)
   contents = models.TextField(default='{}')
+  version = models.PositiveIntegerField(default=0) # incremented by each autosave
+  answered = models.PositiveSmallIntegerField(default=0,
+      help_text='Number of questions with an answer.')
 
   photo1 = models.FileField(upload_to='/', blank=True, max_length=255)
   photo2 = models.FileField(upload_to='/', blank=True, max_length=255)
@@ -728,3 +835,70 @@ class YERDraft(models.Model):
 
   def __unicode__(self):
     return 'DRAFT year-end report for ' + unicode(self.award)
+
+
+class ReportExport(models.Model):
+  """ A grants report generated as csv in a background task
+
+  The csv is stored in ReportExportChunks so it can be written and served
+  a piece at a time. """
+
+  QUEUED = 'queued'
+  RUNNING = 'running'
+  DONE = 'done'
+  FAILED = 'failed'
+  STATUS_CHOICES = (
+    (QUEUED, 'Queued'),
+    (RUNNING, 'Running'),
+    (DONE, 'Done'),
+    (FAILED, 'Failed')
+  )
+
+  created = models.DateTimeField(default=timezone.now)
+  created_by = models.ForeignKey(User, null=True, blank=True)
+  report_type = models.CharField(max_length=50)
+  options = models.TextField(default='{}') # json of the report form's cleaned_data
+
+  status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+  rows_processed = models.PositiveIntegerField(default=0)
+  completed = models.DateTimeField(null=True, blank=True)
+
+  def __unicode__(self):
+    return '%s report %s' % (self.report_type.capitalize(), self.created.strftime('%m/%d/%Y'))
+
+  def is_finished(self):
+    return self.status in (self.DONE, self.FAILED)
+
+
+class ReportExportChunk(models.Model):
+  export = models.ForeignKey(ReportExport)
+  index = models.PositiveIntegerField()
+  content = models.TextField()
+
+  class Meta:
+    ordering = ['index']
+    unique_together = ('export', 'index')
+
+
+class StoredBlob(models.Model):
+  """ A file uploaded to the file backend
+
+  Used to find duplicate uploads and files that nothing refers to. See
+  sjfnw.grants.storage and the gc_blobs command. """
+
+  key = models.CharField(max_length=255, unique=True) # see FILE_BACKEND's key()
+  md5 = models.CharField(max_length=32)
+  size = models.PositiveIntegerField()
+  created = models.DateTimeField(default=timezone.now)
+  # when an upload last used this file; gc_blobs keeps it for a grace period after
+  last_linked = models.DateTimeField(default=timezone.now)
+
+  references = models.PositiveIntegerField(default=0,
+      help_text='Number of file fields using this file when last counted.')
+  counted = models.DateTimeField(null=True, blank=True)
+
+  class Meta:
+    index_together = ('md5', 'size')
+
+  def __unicode__(self):
+    return self.key
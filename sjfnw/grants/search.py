@@ -0,0 +1,43 @@
+from sjfnw.grants.models import Organization, OrganizationNameWord
+from sjfnw.grants.utils import normalize_words
+
+# Organization name search
+# ------------------------
+# Each org's name is split into normalized words - lowercase ascii letters and
+# digits - stored as OrganizationNameWords whenever the org is saved (see
+# sjfnw.grants.signals). A search matches orgs that have, for every word in
+# the query, a word starting with it, so 'north fou' finds 'Northwest
+# Foundation'. Each query word is a prefix lookup on the indexed word column
+# rather than a LIKE scan of every name.
+
+MAX_WORD_LENGTH = OrganizationNameWord._meta.get_field('word').max_length
+
+
+def normalize(text):
+  """ Returns a list of the normalized words in text """
+  return normalize_words(text, MAX_WORD_LENGTH)
+
+
+def index_organization(org):
+  """ Replace an organization's name words """
+  OrganizationNameWord.objects.filter(organization_id=org.pk).delete()
+  OrganizationNameWord.objects.bulk_create([
+    OrganizationNameWord(organization_id=org.pk, word=word)
+    for word in set(normalize(org.name))
+  ])
+
+
+def matching_organizations(query):
+  """ Organizations whose names match query
+
+  Returns:
+    Organization queryset, which can be used as a subquery
+  """
+  words = normalize(query)
+  if not words:
+    return Organization.objects.none()
+  orgs = Organization.objects.all()
+  for word in set(words):
+    orgs = orgs.filter(pk__in=OrganizationNameWord.objects.filter(word__startswith=word)
+                                                          .values('organization_id'))
+  return orgs
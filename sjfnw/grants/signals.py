@@ -0,0 +1,73 @@
+""" Keeps the draft autosave buffer consistent with saves made outside of
+  autosave, and draft answer counts, the organization name search index,
+  year-end report schedule and admin year cache up to date. Connected in
+  GrantsConfig.ready """
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from sjfnw.cache import year_cache
+from sjfnw.grants import autosave, search
+from sjfnw.grants.modelforms import APP_ANSWER_FIELDS, YER_ANSWER_FIELDS
+from sjfnw.grants.models import (DraftGrantApplication, GivingProjectGrant, Organization,
+    YearEndReport, YearEndReportDue, YERDraft)
+from sjfnw.grants.utils import count_answers
+
+
+@receiver(pre_save, sender=DraftGrantApplication)
+def take_buffered_autosave(sender, instance, raw=False, **kwargs):
+  """ A draft saved elsewhere (file upload, admin) would overwrite contents
+    that are still in the buffer, so save them with it. Bumps the version so
+    that an older autosave can't be written over this save """
+  if raw or instance.pk is None:
+    return
+  autosave.draft_buffer.take(instance)
+  instance.version += 1
+
+
+@receiver(pre_save, sender=DraftGrantApplication)
+def count_draft_answers(sender, instance, raw=False, **kwargs):
+  """ Runs after take_buffered_autosave, so buffered contents are counted """
+  if not raw:
+    instance.answered = count_answers(instance.contents, APP_ANSWER_FIELDS)
+
+
+@receiver(pre_save, sender=YERDraft)
+def count_yer_draft_answers(sender, instance, raw=False, **kwargs):
+  if not raw:
+    instance.answered = count_answers(instance.contents, YER_ANSWER_FIELDS)
+
+
+@receiver([post_save, post_delete], sender=DraftGrantApplication)
+def discard_buffered_autosave(sender, instance, raw=False, **kwargs):
+  """ The entry is older than a saved draft, so the next autosave starts from
+    the database """
+  if raw or autosave.draft_buffer.backend is None:
+    return
+  try:
+    username = instance.organization.email
+  except Organization.DoesNotExist: # org is being deleted too
+    return
+  autosave.draft_buffer.discard(username, instance.grant_cycle_id)
+
+
+@receiver(post_save, sender=Organization)
+def index_organization_name(sender, instance, **kwargs):
+  # fixtures are indexed too, since nothing else would index them
+  search.index_organization(instance)
+
+
+@receiver(post_save, sender=GivingProjectGrant)
+@receiver(post_delete, sender=GivingProjectGrant)
+def invalidate_grant_years(sender, **kwargs):
+  year_cache.invalidate(GivingProjectGrant)
+
+
+@receiver(post_save, sender=GivingProjectGrant)
+def refresh_yer_schedule(sender, instance, **kwargs):
+  YearEndReportDue.refresh(instance)
+
+
+@receiver(post_save, sender=YearEndReport)
+@receiver(post_delete, sender=YearEndReport)
+def mark_yer_fulfilled(sender, instance, **kwargs):
+  YearEndReportDue.mark_fulfilled(instance.award_id)
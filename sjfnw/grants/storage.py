@@ -1,81 +1,252 @@
-import logging
+from collections import namedtuple, OrderedDict
+from datetime import datetime
+import hashlib, logging, mimetypes, os, threading
 
-from django.core.files.storage import Storage
+from django.conf import settings
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage, Storage
 from django.core.files.uploadedfile import UploadedFile
 from django.core.files.uploadhandler import FileUploadHandler, StopFutureHandlers
+from django.utils import timezone
 from django.utils.encoding import force_unicode
+from django.utils.module_loading import import_string
 
 from google.appengine.api.images import get_serving_url, NotImageError
-from google.appengine.ext.blobstore import BlobInfo, BlobKey, delete, BlobReader
+from google.appengine.ext.blobstore import (BlobInfo, BlobKey, BlobReader, create_upload_url,
+    delete)
 
+from sjfnw.grants.models import StoredBlob
 from sjfnw.grants.utils import get_blobkey_from_body
 
 logger = logging.getLogger('sjfnw')
 
 # MODIFIED VERSION OF DJANGOAPPENGINES STORAGE FILE. SEE LICENSE AT BOTTOM
 
-# Uploading files
-# ---------------
-# Assume view has set up a form that posts to a blobstore url, so we are getting
+# File backends
+# -------------
+# Uploading, reading and deleting files goes through the backend named by
+# settings.FILE_BACKEND:
+#
+#   BlobstoreBackend - the Blobstore; used in production
+#   LocalFileBackend - a directory, MEDIA_ROOT by default; for tests, local
+#     debugging and load testing
+#
+# A backend implements:
+#
+#   upload_url(path) - url the browser should post files to; they end up at path
+#   uploaded_file(request, charset) - file the backend has already received for
+#     an upload request, or None if the data should go to the next upload handler
+#   save(name, content) - store content, returning the name to keep in the FileField
+#   open(name) - read-only file-like object that supports seek
+#   stat(name) - StoredFile metadata, or None if there is no file
+#   url(name) - direct url to the file, or None
+#   delete(name)
+#   delete_many(names)
+#   key(name) - identifies the stored file; names with the same key share it
+#   name_for(key, name) - name to store for an upload that duplicates key
+#   md5(name) - hex md5 of the file's content, or None if unknown
+#   list_keys() - keys of all stored files
+#
+# FileBackendStorage (DEFAULT_FILE_STORAGE) and FileBackendUploadHandler
+# (FILE_UPLOAD_HANDLERS) connect the backend to Django's file handling.
+#
+# Uploading files to the Blobstore
+# --------------------------------
+# The view has set up a form that posts to a blobstore url, so we are getting
 # the modified form data with blobinfo in it.
 #
-# 1. BlobstoreFileUploadHandler.new_file
-#   a. Extracts blobkey using get_blobkey_from_body
-# 2. BlobstoreFileUploadHandler.file_complete
-# 3. BlobstoreUploadedFile.__init__
-# 4. BlobstoreStorage._save
+# 1. FileBackendUploadHandler.new_file
+#   a. BlobstoreBackend.uploaded_file extracts blobkey using get_blobkey_from_body
+#   b. BlobstoreUploadedFile.__init__
+# 2. FileBackendUploadHandler.file_complete returns the BlobstoreUploadedFile
+# 3. FileBackendStorage._save -> BlobstoreBackend.save
 #   a. data is blobinfo, key is stored
 #
+# With LocalFileBackend, file data is posted directly, so FILE_UPLOAD_HANDLERS
+# should also include one of Django's handlers to receive it.
+#
+# Duplicates and unused files
+# ---------------------------
+# FileBackendStorage records each upload's hash in a StoredBlob. If the same
+# content was uploaded before, the new copy is deleted and the field refers to
+# the existing file instead, and the StoredBlob's last_linked is updated. Files
+# are shared between drafts, applications and reports (copying, rolling over
+# and reverting reuse them), so they are only deleted by the gc_blobs command,
+# which counts the file fields referring to each StoredBlob and deletes the
+# unreferenced ones that haven't been linked to recently.
+#
 # Serving files (via docs viewer or direct)
-#   Using grants/utils.py
+# ------------------------------------------
+# views.serve_file streams backend.open(name) a chunk at a time.
+#
+# Blob metadata
+# -------------
+# Blobs never change once uploaded, so BlobstoreBackend keeps StoredFiles in
+# an in-process LRU cache keyed by blob key (blob_stats), saving a datastore
+# get on each view. Deleting a blob removes it from this instance's cache;
+# other instances may still serve the metadata until it is evicted, but
+# opening the deleted blob will fail.
+
+StoredFile = namedtuple('StoredFile', ['filename', 'size', 'content_type', 'created'])
+
+
+class StatCache(object):
+  """ Thread-safe LRU cache of StoredFiles """
+
+  def __init__(self, max_size):
+    self.max_size = max_size
+    self.lock = threading.Lock()
+    self.entries = OrderedDict()
+
+  def get(self, key):
+    with self.lock:
+      stored = self.entries.pop(key, None)
+      if stored is not None:
+        self.entries[key] = stored # most recently used goes last
+      return stored
+
+  def set(self, key, stored):
+    with self.lock:
+      self.entries.pop(key, None)
+      self.entries[key] = stored
+      while len(self.entries) > self.max_size:
+        self.entries.popitem(last=False)
+
+  def delete(self, key):
+    with self.lock:
+      self.entries.pop(key, None)
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+
+blob_stats = StatCache(getattr(settings, 'BLOB_STAT_CACHE_SIZE', 1000))
+
+
+def get_file_backend():
+  """ Returns an instance of settings.FILE_BACKEND """
+  return import_string(getattr(settings, 'FILE_BACKEND',
+                               'sjfnw.grants.storage.BlobstoreBackend'))()
+
+
+def dedupe(backend, name):
+  """ Record a newly stored file, or replace it with an identical one
+
+  Returns:
+    The name to store in the file field
+  """
+  stored = backend.stat(name)
+  digest = stored and backend.md5(name)
+  if not digest:
+    return name
 
-class BlobstoreFileUploadHandler(FileUploadHandler):
-  """ File upload handler for the Google App Engine Blobstore. """
+  key = backend.key(name)
+  for blob in StoredBlob.objects.filter(md5=digest, size=stored.size).exclude(key=key):
+    if backend.stat(blob.key) is not None:
+      logger.info('Upload %s duplicates %s; deleting it', name, blob.key)
+      # may be unreferenced, so restart its grace period before gc_blobs sees it
+      StoredBlob.objects.filter(pk=blob.pk).update(last_linked=timezone.now())
+      backend.delete(name)
+      return backend.name_for(blob.key, name)
+
+  StoredBlob.objects.get_or_create(key=key, defaults={'md5': digest, 'size': stored.size})
+  return name
+
+
+class FileBackendUploadHandler(FileUploadHandler):
+  """ File upload handler for backends that receive file data themselves """
 
   def new_file(self, *args, **kwargs):
     """field_name, file_name, content_type, content_length, charset=None"""
 
-    logger.debug('BlobstoreFileUploadHandler.new_file')
-    super(BlobstoreFileUploadHandler, self).new_file(*args, **kwargs)
+    logger.debug('FileBackendUploadHandler.new_file')
+    super(FileBackendUploadHandler, self).new_file(*args, **kwargs)
 
-    blobkey = get_blobkey_from_body(self.request.body)
-    self.active = blobkey is not None
+    self.uploaded = get_file_backend().uploaded_file(self.request, self.charset)
+    self.active = self.uploaded is not None
     if self.active:
-      self.blobkey = BlobKey(blobkey)
       raise StopFutureHandlers()
 
   def receive_data_chunk(self, raw_data, start):
-    """ Add the data to the StringIO file.  """
+    """ Pass the data on to the next handler unless the backend has the file """
     if not self.active:
       return raw_data
 
   def file_complete(self, file_size):
-    """ Return a file object if we're activated.  """
-    logger.info('BlobstoreFileUploadHandler.file_complete')
+    """ Return the backend's file object if we're activated.  """
+    logger.info('FileBackendUploadHandler.file_complete')
     if not self.active:
       logger.info('not active')
       return
-    return BlobstoreUploadedFile(
-      blobinfo=BlobInfo(self.blobkey),
-      charset=self.charset)
+    return self.uploaded
 
 
-class BlobstoreStorage(Storage):
-  """ Google App Engine Blobstore storage backend """
+class FileBackendStorage(Storage):
+  """ Storage that uses settings.FILE_BACKEND """
+
+  @property
+  def backend(self):
+    return get_file_backend()
 
   def _open(self, name, mode='rb'):
-    raise NotImplementedError()
+    return File(self.backend.open(name), name)
 
   def _save(self, name, content):
     logger.info('storage _save on %s', name)
-    name = name.replace('\\', '/')
+    backend = self.backend
+    return dedupe(backend, backend.save(name.replace('\\', '/'), content))
+
+  def delete(self, name):
+    self.backend.delete(name)
+
+  def exists(self, name):
+    return self.backend.stat(name) is not None
+
+  def size(self, name):
+    return self.backend.stat(name).size
+
+  def url(self, name):
+    return self.backend.url(name)
+
+  def accessed_time(self, name):
+    raise NotImplementedError()
+
+  def created_time(self, name):
+    return self.backend.stat(name).created
+
+  def modified_time(self, name):
+    return self.created_time(name)
+
+  def get_valid_name(self, name):
+    return force_unicode(name).strip().replace('\\', '/')
+
+  def get_available_name(self, name, max_length=None):
+    """ Backends make names unique when they save """
+    return name.replace('\\', '/')
+
+
+class BlobstoreBackend(object):
+  """ Stores files in the Blobstore. Names are 'blobkey/filename' """
+
+  def _get_key(self, name):
+    return BlobKey(name.split('/', 1)[0])
+
+  def upload_url(self, path):
+    return create_upload_url(path)
+
+  def uploaded_file(self, request, charset):
+    blobkey = get_blobkey_from_body(request.body)
+    if blobkey is None:
+      return None
+    return BlobstoreUploadedFile(blobinfo=BlobInfo(BlobKey(blobkey)), charset=charset)
 
+  def save(self, name, content):
     if hasattr(content, 'file') and hasattr(content.file, 'blobstore_info'):
       data = content.file.blobstore_info
     elif hasattr(content, 'blobstore_info'):
       data = content.blobstore_info
     else:
-      raise ValueError('BlobstoreStorage only supports content with blobinfo')
+      raise ValueError('BlobstoreBackend only supports content with blobinfo')
 
     if isinstance(data, (BlobInfo, BlobKey)):
       if isinstance(data, BlobInfo):
@@ -89,42 +260,112 @@ class BlobstoreStorage(Storage):
       return '%s/%s' % (data, name)
 
     else:
-      raise ValueError('BlobstoreStorage only supports BlobInfo values. Data '
+      raise ValueError('BlobstoreBackend only supports BlobInfo values. Data '
                        'cannot be uploaded directly; you have to use the file'
                        'upload handler.')
 
-  def delete(self, name):
-    delete(self._get_key(name))
+  def open(self, name):
+    return BlobReader(self._get_key(name))
 
-  def exists(self, name):
-    return self._get_blobinfo(name) is not None
+  def _stored_file(self, blobinfo):
+    stored = StoredFile(blobinfo.filename, blobinfo.size, blobinfo.content_type,
+                        timezone.make_aware(blobinfo.creation, timezone.utc))
+    blob_stats.set(str(blobinfo.key()), stored)
+    return stored
 
-  def size(self, name):
-    return self._get_blobinfo(name).size
+  def stat(self, name):
+    key = self._get_key(name)
+    stored = blob_stats.get(str(key))
+    if stored is None:
+      blobinfo = BlobInfo.get(key)
+      if blobinfo is not None:
+        stored = self._stored_file(blobinfo)
+    return stored
 
   def url(self, name):
     try:
-      return get_serving_url(self._get_blobinfo(name))
+      return get_serving_url(self._get_key(name))
     except NotImageError:
       return None
 
-  def accessed_time(self, name):
-    raise NotImplementedError()
+  def delete(self, name):
+    self.delete_many([name])
 
-  def created_time(self, name):
-    return self._get_blobinfo(name).creation
+  def delete_many(self, names):
+    keys = [self._get_key(name) for name in names]
+    for key in keys:
+      blob_stats.delete(str(key))
+    delete(keys)
 
-  def get_valid_name(self, name):
-    return force_unicode(name).strip().replace('\\', '/')
+  def key(self, name):
+    return str(self._get_key(name))
 
-  def get_available_name(self, name, max_length=None):
-    return name.replace('\\', '/')
+  def name_for(self, key, name):
+    return '%s/%s' % (key, name.split('/', 1)[-1])
 
-  def _get_key(self, name):
-    return BlobKey(name.split('/', 1)[0])
+  def md5(self, name):
+    blobinfo = BlobInfo.get(self._get_key(name))
+    return blobinfo.md5_hash if blobinfo else None
+
+  def list_keys(self):
+    for blobinfo in BlobInfo.all():
+      yield str(blobinfo.key())
+
+
+class LocalFileBackend(object):
+  """ Stores files in a directory, MEDIA_ROOT by default """
+
+  def __init__(self, location=None):
+    self.storage = FileSystemStorage(location=location or settings.MEDIA_ROOT)
+
+  def upload_url(self, path):
+    return path
+
+  def uploaded_file(self, request, charset):
+    return None
+
+  def save(self, name, content):
+    return self.storage.save(name.lstrip('/'), content)
+
+  def open(self, name):
+    return open(self.storage.path(name.lstrip('/')), 'rb')
+
+  def stat(self, name):
+    path = self.storage.path(name.lstrip('/'))
+    if not os.path.isfile(path):
+      return None
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    modified = datetime.utcfromtimestamp(int(os.path.getmtime(path)))
+    return StoredFile(os.path.basename(path), os.path.getsize(path), content_type,
+                      timezone.make_aware(modified, timezone.utc))
+
+  def url(self, name):
+    return None
+
+  def delete(self, name):
+    self.storage.delete(name.lstrip('/'))
+
+  def delete_many(self, names):
+    for name in names:
+      self.delete(name)
+
+  def key(self, name):
+    return name.lstrip('/')
+
+  def name_for(self, key, name):
+    return key
+
+  def md5(self, name):
+    digest = hashlib.md5()
+    with self.open(name) as stored:
+      for chunk in iter(lambda: stored.read(64 * 1024), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
 
-  def _get_blobinfo(self, name):
-    return BlobInfo.get(self._get_key(name))
+  def list_keys(self):
+    for directory, _, files in os.walk(self.storage.location):
+      for filename in files:
+        yield os.path.relpath(os.path.join(directory, filename), self.storage.location)
 
 
 class BlobstoreUploadedFile(UploadedFile):
@@ -1,4 +1,4 @@
-from datetime import timedelta
+from datetime import datetime, timedelta
 import json
 import logging
 
@@ -10,7 +10,7 @@ from django.utils import timezone
 from google.appengine.ext import testbed
 from google.appengine.api import blobstore, datastore
 
-from sjfnw.grants import constants as gc
+from sjfnw.grants import constants as gc, storage
 from sjfnw.grants.tests.base import BaseGrantTestCase
 from sjfnw.grants.models import (Organization, DraftGrantApplication,
   GrantApplication, GrantCycle)
@@ -27,6 +27,7 @@ class BaseGrantFilesTestCase(BaseGrantTestCase):
     self.testbed.activate()
     self.testbed.init_datastore_v3_stub()
     self.testbed.init_blobstore_stub()
+    storage.blob_stats.clear()
 
   def tearDown(self):
     self.testbed.deactivate()
@@ -37,6 +38,7 @@ class BaseGrantFilesTestCase(BaseGrantTestCase):
     entity['size'] = len(kwargs['content'])
     entity['filename'] = kwargs['filename']
     entity['content_type'] = kwargs['content_type']
+    entity['creation'] = datetime.utcnow()
     datastore.Put(entity)
     blobstore_stub.storage.CreateBlob('fakeblobkey123', kwargs['content'])
 
@@ -3,10 +3,13 @@ import json, logging
 
 from django.core import mail
 from django.core.urlresolvers import reverse
+from django.test import RequestFactory
+from django.test.utils import override_settings
 from django.utils import timezone
 
 from sjfnw.grants.tests.base import BaseGrantTestCase
-from sjfnw.grants import models
+from sjfnw.grants import autosave, cron, models
+from sjfnw.tasks import LocalQueue
 
 logger = logging.getLogger('sjfnw')
 
@@ -32,6 +35,35 @@ class DraftExtension(BaseGrantTestCase):
     self.assertIn('/admin/grants/draftgrantapplication/', response.__getitem__('location'))
 
 
+class DraftAnswered(BaseGrantTestCase):
+
+  def test_count(self):
+    draft = models.DraftGrantApplication(organization_id=1, grant_cycle_id=3, contents=json.dumps({
+      'mission': 'Something', 'grant_request': '  ', 'ein': '', 'budget_last': 300,
+      'timeline_0': 'Jan', 'timeline_1': 'Plan', 'timeline_2': '',
+      'id': 1, 'user_id': 'abc', 'csrfmiddlewaretoken': 'token'
+    }))
+    draft.save()
+    # mission, budget_last and timeline
+    self.assertEqual(draft.answered, 3)
+
+  def test_count_yer(self):
+    draft = models.YERDraft(award_id=1, contents=json.dumps({
+      'goal_progress': 'Some', 'contact_person_0': 'Name', 'contact_person_1': 'Title',
+      'listserve': '', 'user_id': 'abc'
+    }))
+    draft.save()
+    self.assertEqual(draft.answered, 2)
+
+  def test_admin_list(self):
+    self.login_as_admin()
+    models.DraftGrantApplication.objects.filter(pk=2).update(answered=17)
+
+    response = self.client.get('/admin/grants/draftgrantapplication/')
+
+    self.assertContains(response, '<td class="field-answered">17</td>', html=True)
+
+
 class DraftAutosave(BaseGrantTestCase):
 
   def setUp(self):
@@ -59,6 +91,62 @@ class DraftAutosave(BaseGrantTestCase):
     new_c = json.loads(new_draft.contents)
     self.assertEqual(json.loads(complete_draft.contents), new_c)
 
+  def test_full_save_version(self):
+    response = self.client.post(self.url, {'mission': 'Something'})
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response['X-Draft-Version'], '1')
+    draft = models.DraftGrantApplication.objects.get(pk=self.draft_id)
+    self.assertEqual(draft.version, 1)
+
+  def test_delta(self):
+    draft = models.DraftGrantApplication.objects.get(pk=self.draft_id)
+    draft.contents = json.dumps({'mission': 'Old', 'grant_request': 'Money', 'ein': '1'})
+    draft.version = 2 # bumped by save
+    draft.save()
+
+    response = self.client.post(self.url + '?version=3', {
+      'mission': 'New', 'user_id': 'abc', 'removed_fields': 'grant_request'
+    })
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response['X-Draft-Version'], '4')
+    draft = models.DraftGrantApplication.objects.get(pk=self.draft_id)
+    self.assertEqual(json.loads(draft.contents), {'mission': 'New', 'ein': '1'})
+    self.assertEqual(draft.modified_by, 'abc')
+    self.assertEqual(draft.answered, 2)
+
+  def test_delta_unchanged(self):
+    draft = models.DraftGrantApplication.objects.get(pk=self.draft_id)
+    draft.contents = json.dumps({'mission': 'Same'})
+    draft.version = 2 # bumped by save
+    draft.modified = timezone.now() - timedelta(days=1)
+    draft.save()
+
+    response = self.client.post(self.url + '?version=3',
+                                {'mission': 'Same', 'user_id': 'abc', 'removed_fields': ''})
+
+    self.assertEqual(response.status_code, 304)
+    self.assertEqual(response['X-Draft-Version'], '3')
+    updated = models.DraftGrantApplication.objects.get(pk=self.draft_id)
+    self.assertEqual(updated.version, 3)
+    self.assertEqual(updated.modified, draft.modified)
+
+  def test_delta_stale(self):
+    draft = models.DraftGrantApplication.objects.get(pk=self.draft_id)
+    draft.contents = json.dumps({'mission': 'Old', 'ein': '1'})
+    draft.version = 2 # bumped by save
+    draft.save()
+
+    response = self.client.post(self.url + '?version=2',
+                                {'mission': 'New', 'user_id': 'abc', 'removed_fields': 'ein'})
+
+    self.assertEqual(response.status_code, 412)
+    self.assertEqual(response['X-Draft-Version'], '3')
+    draft = models.DraftGrantApplication.objects.get(pk=self.draft_id)
+    self.assertEqual(json.loads(draft.contents), {'mission': 'Old', 'ein': '1'})
+    self.assertEqual(draft.version, 3)
+
   def test_not_logged_in(self):
     response = self.client.post(self.url, {'mission': 'Something'})
     self.assertEqual(200, response.status_code)
@@ -69,6 +157,129 @@ class DraftAutosave(BaseGrantTestCase):
     self.assertEqual(401, response.status_code)
 
 
+@override_settings(AUTOSAVE_BUFFER_CACHE='default')
+class BufferedAutosave(BaseGrantTestCase):
+  """ Autosaves with the buffer turned on, using a local queue for flushes """
+
+  def setUp(self):
+    super(BufferedAutosave, self).setUp()
+    self.login_as_org('test')
+    self.cycle_id = 2
+    self.url = reverse('sjfnw.grants.views.autosave_app',
+                       kwargs={'cycle_id': self.cycle_id})
+    self.draft = models.DraftGrantApplication.objects.get(
+        organization_id=self.org_id, grant_cycle_id=self.cycle_id)
+    models.DraftGrantApplication.objects.filter(pk=self.draft.pk).update(
+        contents='{}', modified=timezone.now() - timedelta(days=1))
+
+    self.queue = LocalQueue()
+    self.real_buffer = autosave.draft_buffer
+    autosave.draft_buffer = autosave.AutosaveBuffer(queue=self.queue)
+    autosave.draft_buffer.clear()
+
+  def tearDown(self):
+    autosave.draft_buffer.clear()
+    autosave.draft_buffer = self.real_buffer
+
+  def assert_draft_contents(self, expected):
+    draft = models.DraftGrantApplication.objects.get(pk=self.draft.pk)
+    self.assertEqual(json.loads(draft.contents), expected)
+    return draft
+
+  def test_flush(self):
+    self.client.post(self.url, {'mission': 'First', 'user_id': 'abc'})
+    response = self.client.post(self.url + '?version=1', {'mission': 'Second', 'user_id': 'abc'})
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response['X-Draft-Version'], '2')
+    self.assertEqual(autosave.draft_buffer.writes, 0)
+    self.assertEqual(len(self.queue.tasks), 1)
+    self.assert_draft_contents({})
+
+    self.queue.run()
+    self.assertEqual(autosave.draft_buffer.writes, 1)
+    draft = self.assert_draft_contents({'mission': 'Second', 'user_id': 'abc'})
+    self.assertEqual(draft.version, 2)
+    self.assertEqual(draft.modified_by, 'abc')
+    self.assertEqual(draft.answered, 1)
+
+  def test_autosave_during_flush(self):
+    self.client.post(self.url, {'mission': 'First', 'user_id': 'abc'})
+    # entry as read by a flush that is slow to write it
+    slow = autosave.draft_buffer.get('testorg@gmail.com', self.cycle_id)
+    self.queue.run()
+
+    response = self.client.post(self.url + '?version=1',
+                                {'mission': 'Second', 'user_id': 'abc'})
+    self.assertEqual(response.status_code, 200)
+    # the flush above is done, so another one is scheduled
+    self.assertEqual(len(self.queue.tasks), 1)
+
+    self.queue.run()
+    self.assert_draft_contents({'mission': 'Second', 'user_id': 'abc'})
+    # writing the older entry late doesn't overwrite the newer contents
+    self.assertFalse(autosave.draft_buffer._write(slow)) # pylint: disable=protected-access
+    self.assert_draft_contents({'mission': 'Second', 'user_id': 'abc'})
+    self.assertEqual(autosave.draft_buffer.writes, 2)
+
+  def test_conflict(self):
+    self.client.post(self.url, {'mission': 'First', 'user_id': 'abc'})
+    response = self.client.post(self.url, {'mission': 'Other', 'user_id': 'xyz'})
+
+    self.assertEqual(response.status_code, 409)
+    self.queue.run()
+    self.assert_draft_contents({'mission': 'First', 'user_id': 'abc'})
+
+  def test_load_flushes(self):
+    self.client.post(self.url, {'mission': 'Buffered'})
+
+    response = self.client.get(reverse('sjfnw.grants.views.grant_application',
+                                       kwargs={'cycle_id': self.cycle_id}))
+
+    self.assertEqual(response.status_code, 200)
+    self.assert_draft_contents({'mission': 'Buffered'})
+
+  def test_other_save_takes_buffer(self):
+    self.client.post(self.url, {'mission': 'Buffered'})
+
+    draft = models.DraftGrantApplication.objects.get(pk=self.draft.pk)
+    draft.budget1 = 'budget.pdf'
+    draft.save()
+
+    draft = self.assert_draft_contents({'mission': 'Buffered'})
+    self.assertEqual(draft.budget1, 'budget.pdf')
+    self.queue.run()
+    self.assertEqual(autosave.draft_buffer.writes, 0)
+
+  def test_other_save_not_overwritten(self):
+    self.client.post(self.url, {'mission': 'Flushed'})
+    self.queue.run()
+    # the flushed entry stays in the buffer, at the draft's version
+    stale = autosave.draft_buffer.get('testorg@gmail.com', self.cycle_id)
+
+    draft = models.DraftGrantApplication.objects.get(pk=self.draft.pk)
+    draft.contents = json.dumps({'mission': 'Edited'})
+    draft.save()
+
+    self.assertEqual(draft.version, 2)
+    self.assertIsNone(autosave.draft_buffer.get('testorg@gmail.com', self.cycle_id))
+    self.assertFalse(autosave.draft_buffer._write(stale)) # pylint: disable=protected-access
+    # the form's version is older than the save, so it has to send everything again
+    response = self.client.post(self.url + '?version=1', {'mission': 'Late'})
+    self.assertEqual(response.status_code, 412)
+    self.assertEqual(response['X-Draft-Version'], '2')
+    self.assert_draft_contents({'mission': 'Edited'})
+
+  def test_delete_discards(self):
+    self.client.post(self.url, {'mission': 'Buffered'})
+
+    self.draft.delete()
+
+    self.assertIsNone(autosave.draft_buffer.get('testorg@gmail.com', self.cycle_id))
+    self.queue.run()
+    self.assertEqual(autosave.draft_buffer.writes, 0)
+
+
 class DraftWarning(BaseGrantTestCase):
 
   def setUp(self):
@@ -140,6 +351,43 @@ class DraftWarning(BaseGrantTestCase):
     self.client.get('/mail/drafts/')
     self.assert_length(mail.outbox, 0)
 
+  def test_sent_once(self):
+    """ Running again the same day doesn't repeat the warning """
+    now = timezone.now()
+    models.DraftGrantApplication.objects.filter(pk=2).update(created=now)
+    models.GrantCycle.objects.filter(pk=2).update(close=now + timedelta(days=2, hours=12))
+
+    self.client.get('/mail/drafts/')
+    self.client.get('/mail/drafts/')
+
+    self.assert_length(mail.outbox, 1)
+    warning = models.DraftWarningSent.objects.get(draft_id=2)
+    self.assertEqual(warning.days, 3)
+
+  def test_long_then_short(self):
+    """ A warning already sent doesn't prevent the other one """
+    now = timezone.now()
+    models.DraftGrantApplication.objects.filter(pk=2).update(created=now)
+    models.GrantCycle.objects.filter(pk=2).update(close=now + timedelta(days=2, hours=12))
+    models.DraftWarningSent.objects.create(draft_id=2, days=7)
+
+    self.client.get('/mail/drafts/')
+
+    self.assert_length(mail.outbox, 1)
+    self.assert_count(models.DraftWarningSent.objects.filter(draft_id=2), 2)
+
+  def test_query_count(self):
+    """ Drafts outside the warning windows aren't loaded """
+    now = timezone.now()
+    models.DraftGrantApplication.objects.update(created=now - timedelta(days=12))
+    models.GrantCycle.objects.filter(pk=2).update(close=now + timedelta(days=7, hours=12))
+    request = RequestFactory().get('/mail/drafts/')
+
+    # one query per warning, bulk insert in a savepoint
+    with self.assertNumQueries(5):
+      cron.draft_app_warning(request)
+    self.assert_length(mail.outbox, 1)
+
 
 class DiscardDraft(BaseGrantTestCase):
 
@@ -0,0 +1,293 @@
+from collections import Counter
+from datetime import timedelta
+from StringIO import StringIO
+import logging, os, shutil, tempfile
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from google.appengine.api import blobstore, datastore
+
+from sjfnw.grants import storage, utils
+from sjfnw.grants.management.commands import gc_blobs
+from sjfnw.grants.models import DraftGrantApplication, StoredBlob
+from sjfnw.grants.tests.base import BaseGrantTestCase
+from sjfnw.grants.tests.test_apply import BaseGrantFilesTestCase
+
+logger = logging.getLogger('sjfnw')
+
+FILE_CONTENT = open('sjfnw/grants/tests/media/cats.jpg', 'rb').read()
+
+
+def streamed(response):
+  return b''.join(response.streaming_content)
+
+
+@override_settings(MEDIA_ROOT='sjfnw/grants/tests/media/',
+                   FILE_BACKEND='sjfnw.grants.storage.LocalFileBackend')
+class ServeFile(BaseGrantTestCase):
+
+  def setUp(self):
+    super(ServeFile, self).setUp()
+    self.login_as_org('test')
+    DraftGrantApplication.objects.filter(pk=2).update(budget1='cats.jpg')
+    self.url = reverse('sjfnw.grants.views.view_file',
+                       kwargs={'obj_type': 'adraft', 'obj_id': 2, 'field_name': 'budget1'})
+
+  def test_whole_file(self):
+    response = self.client.get(self.url)
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response['Content-Type'], 'image/jpeg')
+    self.assertEqual(response['Content-Length'], str(len(FILE_CONTENT)))
+    self.assertEqual(response['Accept-Ranges'], 'bytes')
+    self.assertEqual(streamed(response), FILE_CONTENT)
+
+  def test_range(self):
+    response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+
+    self.assertEqual(response.status_code, 206)
+    self.assertEqual(response['Content-Range'], 'bytes 100-199/{}'.format(len(FILE_CONTENT)))
+    self.assertEqual(response['Content-Length'], '100')
+    self.assertEqual(streamed(response), FILE_CONTENT[100:200])
+
+  def test_range_open_ended(self):
+    response = self.client.get(self.url, HTTP_RANGE='bytes=54000-')
+
+    self.assertEqual(response.status_code, 206)
+    self.assertEqual(streamed(response), FILE_CONTENT[54000:])
+
+  def test_range_suffix(self):
+    response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+
+    self.assertEqual(response.status_code, 206)
+    self.assertEqual(streamed(response), FILE_CONTENT[-10:])
+
+  def test_range_unsatisfiable(self):
+    response = self.client.get(self.url, HTTP_RANGE='bytes=100000-')
+
+    self.assertEqual(response.status_code, 416)
+    self.assertEqual(response['Content-Range'], 'bytes */{}'.format(len(FILE_CONTENT)))
+
+  def test_multiple_ranges_sends_whole_file(self):
+    response = self.client.get(self.url, HTTP_RANGE='bytes=0-10,20-30')
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(streamed(response), FILE_CONTENT)
+
+  def test_if_range_mismatch(self):
+    response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"other"')
+
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(streamed(response), FILE_CONTENT)
+
+  def test_etag(self):
+    etag = self.client.get(self.url)['ETag']
+
+    response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+    self.assertEqual(response.status_code, 304)
+    self.assertEqual(response['ETag'], etag)
+
+  def test_last_modified(self):
+    last_modified = self.client.get(self.url)['Last-Modified']
+
+    response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+
+    self.assertEqual(response.status_code, 304)
+
+  def test_file_missing(self):
+    DraftGrantApplication.objects.filter(pk=2).update(budget1='not-a-file.jpg')
+
+    response = self.client.get(self.url)
+
+    self.assertEqual(response.status_code, 404)
+
+
+class ServeBlob(BaseGrantFilesTestCase):
+
+  def test_range(self):
+    self.create_blob('fakeblobkey123', filename='file.txt',
+                     content_type='text/plain', content='0123456789')
+    DraftGrantApplication.objects.filter(pk=2).update(budget1='fakeblobkey123/file.txt')
+    url = reverse('sjfnw.grants.views.view_file',
+                  kwargs={'obj_type': 'adraft', 'obj_id': 2, 'field_name': 'budget1'})
+
+    response = self.client.get(url, HTTP_RANGE='bytes=2-5')
+
+    self.assertEqual(response.status_code, 206)
+    self.assertEqual(response['Content-Type'], 'text/plain')
+    self.assertEqual(streamed(response), '2345')
+
+
+class LocalFileBackend(BaseGrantTestCase):
+  """ Upload, serve and delete a file with files stored in a temp directory """
+
+  def setUp(self):
+    super(LocalFileBackend, self).setUp()
+    self.login_as_org('test')
+    self.media_root = tempfile.mkdtemp()
+    self.settings_override = override_settings(
+        MEDIA_ROOT=self.media_root,
+        FILE_BACKEND='sjfnw.grants.storage.LocalFileBackend',
+        FILE_UPLOAD_HANDLERS=('sjfnw.grants.storage.FileBackendUploadHandler',
+                              'django.core.files.uploadhandler.MemoryFileUploadHandler'))
+    self.settings_override.enable()
+
+  def tearDown(self):
+    self.settings_override.disable()
+    shutil.rmtree(self.media_root)
+
+  def test_upload_url(self):
+    response = self.client.get('/get-upload-url/?type=apply&id=2')
+
+    self.assertEqual(response.content, '/apply/2/add-file')
+
+  def test_upload_serve_delete(self):
+    url = reverse('sjfnw.grants.views.add_file', kwargs={'draft_type': 'apply', 'draft_id': 2})
+    response = self.client.post(url, {'budget3': SimpleUploadedFile('budget.txt', 'some numbers')})
+
+    self.assertEqual(response.status_code, 200)
+    draft = DraftGrantApplication.objects.get(pk=2)
+    self.assertEqual(draft.budget3.name, 'budget.txt')
+    self.assertTrue(os.path.isfile(os.path.join(self.media_root, 'budget.txt')))
+
+    response = self.client.get(reverse('sjfnw.grants.views.view_file', kwargs={
+      'obj_type': 'adraft', 'obj_id': 2, 'field_name': 'budget3'
+    }))
+    self.assertEqual(response['Content-Type'], 'text/plain')
+    self.assertEqual(streamed(response), 'some numbers')
+
+    self.assertEqual(utils.delete_blob(draft.budget3).content, 'deleted')
+    self.assertFalse(os.path.exists(os.path.join(self.media_root, 'budget.txt')))
+
+  def upload(self, field_name, filename, content):
+    url = reverse('sjfnw.grants.views.add_file', kwargs={'draft_type': 'apply', 'draft_id': 2})
+    self.client.post(url, {field_name: SimpleUploadedFile(filename, content)})
+    return getattr(DraftGrantApplication.objects.get(pk=2), field_name).name
+
+  def test_duplicate_upload(self):
+    first = self.upload('budget1', 'budget.txt', 'some numbers')
+    second = self.upload('budget2', 'copy.txt', 'some numbers')
+
+    self.assertEqual(second, first)
+    self.assertFalse(os.path.exists(os.path.join(self.media_root, 'copy.txt')))
+    self.assertEqual(StoredBlob.objects.count(), 1)
+
+  def test_different_upload(self):
+    first = self.upload('budget1', 'budget.txt', 'some numbers')
+    second = self.upload('budget2', 'other.txt', 'other numbers')
+
+    self.assertNotEqual(second, first)
+    self.assertEqual(StoredBlob.objects.count(), 2)
+
+  def test_gc(self):
+    kept = self.upload('budget1', 'kept.txt', 'still used')
+    removed = self.upload('budget2', 'removed.txt', 'replaced')
+    self.upload('budget2', 'new.txt', 'replacement')
+    ten_days_ago = timezone.now() - timedelta(days=10)
+    StoredBlob.objects.update(created=ten_days_ago, last_linked=ten_days_ago)
+
+    call_command('gc_blobs', stdout=StringIO())
+
+    self.assertTrue(os.path.exists(os.path.join(self.media_root, kept)))
+    self.assertFalse(os.path.exists(os.path.join(self.media_root, removed)))
+    self.assertEqual(StoredBlob.objects.get(key=kept).references, 1)
+    self.assertFalse(StoredBlob.objects.filter(key=removed).exists())
+
+  def test_gc_grace_period(self):
+    self.upload('budget2', 'removed.txt', 'replaced')
+    self.upload('budget2', 'new.txt', 'replacement')
+
+    call_command('gc_blobs', stdout=StringIO())
+
+    self.assertTrue(os.path.exists(os.path.join(self.media_root, 'removed.txt')))
+
+  def test_gc_relinked(self):
+    """ A file that is uploaded again after it was removed gets a new grace period """
+    removed = self.upload('budget2', 'removed.txt', 'uploaded again')
+    self.upload('budget2', 'new.txt', 'replacement')
+    ten_days_ago = timezone.now() - timedelta(days=10)
+    StoredBlob.objects.update(created=ten_days_ago, last_linked=ten_days_ago,
+                              references=0)
+
+    self.assertEqual(self.upload('budget3', 'again.txt', 'uploaded again'), removed)
+    # as if references were counted before the upload was saved
+    DraftGrantApplication.objects.filter(pk=2).update(budget3='')
+    call_command('gc_blobs', stdout=StringIO())
+
+    self.assertTrue(os.path.exists(os.path.join(self.media_root, removed)))
+
+  def test_gc_recheck(self):
+    """ Files referenced after they were counted are not deleted """
+    kept = self.upload('budget1', 'kept.txt', 'still used')
+    ten_days_ago = timezone.now() - timedelta(days=10)
+    StoredBlob.objects.update(created=ten_days_ago, last_linked=ten_days_ago)
+    real_count = gc_blobs.count_references
+
+    def count_before_upload(backend, keys=None):
+      if keys is None: # the first, full count misses the reference
+        return Counter()
+      return real_count(backend, keys)
+
+    gc_blobs.count_references = count_before_upload
+    try:
+      call_command('gc_blobs', stdout=StringIO())
+    finally:
+      gc_blobs.count_references = real_count
+
+    self.assertTrue(os.path.exists(os.path.join(self.media_root, kept)))
+    self.assertEqual(StoredBlob.objects.get(key=kept).references, 1)
+
+  def test_gc_index_existing(self):
+    with open(os.path.join(self.media_root, 'old.txt'), 'w') as old:
+      old.write('uploaded before tracking')
+    StoredBlob.objects.all().delete()
+
+    call_command('gc_blobs', index_existing=True, grace_days=-1, stdout=StringIO())
+
+    self.assertFalse(os.path.exists(os.path.join(self.media_root, 'old.txt')))
+
+
+class BlobStats(BaseGrantFilesTestCase):
+
+  def setUp(self):
+    super(BlobStats, self).setUp()
+    self.backend = storage.BlobstoreBackend()
+    self.create_blob('fakeblobkey123', filename='file.txt',
+                     content_type='text/plain', content='0123456789')
+
+  def test_cached(self):
+    stored = self.backend.stat('fakeblobkey123/file.txt')
+    self.assertEqual(stored.size, 10)
+
+    datastore.Delete(datastore.Key.from_path(blobstore.BLOB_INFO_KIND, 'fakeblobkey123',
+                                             namespace=''))
+
+    self.assertEqual(self.backend.stat('fakeblobkey123/file.txt'), stored)
+
+  def test_delete(self):
+    self.backend.stat('fakeblobkey123/file.txt')
+
+    self.backend.delete('fakeblobkey123/file.txt')
+
+    self.assertIsNone(storage.blob_stats.get('fakeblobkey123'))
+    self.assertIsNone(self.backend.stat('fakeblobkey123/file.txt'))
+
+
+class StatCacheEviction(BaseGrantTestCase):
+
+  def test_least_recently_used(self):
+    cache = storage.StatCache(2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+
+    cache.set('c', 3)
+
+    self.assertEqual(cache.get('a'), 1)
+    self.assertIsNone(cache.get('b'))
+    self.assertEqual(cache.get('c'), 3)
@@ -1,14 +1,21 @@
+import io
 import logging
 from unittest import skip
 
 from django import forms
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.http import HttpResponse
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
+from sjfnw.fund.models import GivingProject
 from sjfnw.grants.forms import (AppReportForm, SponsoredAwardReportForm,
     GPGrantReportForm, OrgReportForm)
+from sjfnw.grants.utils import local_date_str
 from sjfnw.grants.tests.base import BaseGrantTestCase, LIVE_FIXTURES
-from sjfnw.grants import models
+from sjfnw.grants import models, views
+from sjfnw.tasks import ThreadPoolQueue
 
 import unicodecsv
 
@@ -90,6 +97,19 @@ def fill_report_form(form, select_filters=False, select_fields=False, fmt='brows
   post_dict['format'] = fmt
   return post_dict
 
+def streamed_lines(response):
+  """ Split a streamed csv response into lines for unicodecsv.reader """
+  return io.BytesIO(b''.join(response.streaming_content))
+
+def buffered_csv(field_names, results):
+  """ Write report results the way csv reports were built before streaming """
+  response = HttpResponse(content_type='text/csv')
+  writer = unicodecsv.writer(response)
+  writer.writerow(field_names)
+  for row in results:
+    writer.writerow(row)
+  return response.content
+
 
 class AppReports(BaseGrantTestCase):
 
@@ -125,10 +145,44 @@ class AppReports(BaseGrantTestCase):
 
     response = self.client.post(self.url, post_dict)
 
-    reader = unicodecsv.reader(response, encoding='utf8')
+    reader = unicodecsv.reader(streamed_lines(response), encoding='utf8')
     row_count = sum(1 for row in reader)
-    # 1st row is blank, 2nd is headers
-    self.assertEqual(row_count - 2, models.GrantApplication.objects.count())
+    # 1st row is headers
+    self.assertEqual(row_count - 1, models.GrantApplication.objects.count())
+
+  def test_csv_matches_buffered(self):
+    """ Streamed csv is byte for byte what the buffered writer produced """
+
+    form = AppReportForm()
+    post_dict = fill_report_form(form, select_fields=True, fmt='csv')
+    post_dict['run-application'] = ''
+
+    response = self.client.post(self.url, post_dict)
+    streamed = b''.join(response.streaming_content)
+
+    form = AppReportForm(post_dict)
+    self.assertTrue(form.is_valid())
+    buffered = buffered_csv(*views.get_app_results(form.cleaned_data))
+
+    self.assertEqual(streamed, buffered)
+
+  def test_csv_chunks(self):
+    """ Rows are yielded in chunks after the header row """
+    rows = [[i, u'caf\xe9'] for i in range(5)]
+
+    chunks = list(views.stream_csv(['Id', 'Name'], iter(rows), chunk_size=2))
+
+    self.assertEqual(len(chunks), 4) # header, 2, 2, 1
+    self.assertEqual(b''.join(chunks), buffered_csv(['Id', 'Name'], rows))
+
+  def test_iterate_report_ties(self):
+    """ Prefetched chunks are ordered by pk within ties """
+    orgs = (models.Organization.objects.order_by('fiscal_org')
+                                       .prefetch_related('grantapplication_set'))
+
+    pks = [org.pk for org in views.iterate_report(orgs, chunk_size=1)]
+
+    self.assertEqual(pks, list(orgs.order_by('fiscal_org', 'pk').values_list('pk', flat=True)))
 
   @skip("Needs additional fixtures")
   def test_app_filters_all(self):
@@ -147,6 +201,94 @@ class AppReports(BaseGrantTestCase):
     self.assertEqual(results, [])
 
 
+class AppReportQueries(BaseGrantTestCase):
+  """ Giving project columns don't add queries per application """
+
+  def setUp(self):
+    super(AppReportQueries, self).setUp()
+    now = timezone.now()
+    self.gp = GivingProject.objects.create(title='Report GP', fund_goal=100,
+        fundraising_training=now, fundraising_deadline=now.date())
+    self.created = 0
+
+  def create_apps(self, total):
+    """ Add apps (each with a project app, every other one awarded) up to total """
+    start, self.created = self.created, total
+    models.Organization.objects.bulk_create([
+      models.Organization(name='Report org {}'.format(i), email='report{}@example.com'.format(i))
+      for i in range(start, total)
+    ])
+    orgs = models.Organization.objects.filter(name__startswith='Report org ')
+    models.GrantApplication.objects.bulk_create([
+      models.GrantApplication(organization=org, grant_cycle_id=1, founded='1998',
+          budget_last=300, budget_current=600, amount_requested=99)
+      for org in orgs.exclude(grantapplication__isnull=False)
+    ])
+    apps = models.GrantApplication.objects.filter(
+        organization__name__startswith='Report org ', projectapp__isnull=True)
+    models.ProjectApp.objects.bulk_create([
+      models.ProjectApp(application=app, giving_project=self.gp,
+          screening_status=70 if i % 2 else None)
+      for i, app in enumerate(apps)
+    ])
+    papps = models.ProjectApp.objects.filter(giving_project=self.gp,
+                                             givingprojectgrant__isnull=True)
+    models.GivingProjectGrant.objects.bulk_create([
+      models.GivingProjectGrant(projectapp=papp, amount=1000, first_yer_due='2017-01-01')
+      for papp in papps if papp.application_id % 2
+    ])
+
+  def test_constant_queries(self):
+    form = AppReportForm()
+    post_dict = fill_report_form(form, select_fields=True, fmt='csv')
+    form = AppReportForm(post_dict)
+    self.assertTrue(form.is_valid())
+
+    counts = {}
+    for size in (10, 100, 1000):
+      self.create_apps(size)
+      with CaptureQueriesContext(connection) as context:
+        field_names, results = views.get_app_results(form.cleaned_data)
+        rows = list(results)
+      self.assertGreaterEqual(len(rows), size)
+      awarded = [row for row in rows if 'Report GP' in row[field_names.index('Awarded')]]
+      self.assertEqual(len(awarded), size / 2)
+      counts[size] = len(context.captured_queries)
+
+    self.assertEqual(counts[10], counts[100])
+    self.assertEqual(counts[10], counts[1000])
+
+  def test_matches_model_values(self):
+    """ Selected columns match the values read from full model instances """
+    form = AppReportForm(fill_report_form(AppReportForm(), select_fields=True, fmt='csv'))
+    self.assertTrue(form.is_valid())
+
+    field_names, results = views.get_app_results(form.cleaned_data)
+    rows = list(results)
+
+    apps = models.GrantApplication.objects.order_by('-submission_time')
+    self.assertEqual(len(rows), apps.count())
+    fields = [name.lower().replace(' ', '_') for name in field_names[:-3]]
+    for row, app in zip(rows, apps):
+      for i, field in enumerate(fields):
+        if field == 'submission_time':
+          self.assertEqual(row[i], local_date_str(app.submission_time))
+        elif field == 'pre_screening_status':
+          self.assertEqual(row[i], app.get_pre_screening_status_display())
+        elif field in ('organization', 'grant_cycle'):
+          self.assertEqual(row[i], unicode(getattr(app, field)))
+        else:
+          self.assertEqual(row[i], getattr(app, field), field)
+
+      papps = app.projectapp_set.order_by('pk')
+      self.assertEqual(row[-3], ', '.join(papp.giving_project.title for papp in papps))
+      awards = [papp.givingprojectgrant for papp in papps
+                if models.GivingProjectGrant.objects.filter(projectapp=papp).exists()]
+      self.assertEqual(row[-1], ', '.join(
+          '%s %s ' % (award.total_amount(), award.projectapp.giving_project.title)
+          for award in awards))
+
+
 class OrgReports(BaseGrantTestCase):
 
   fixtures = LIVE_FIXTURES
@@ -202,9 +344,10 @@ class OrgReports(BaseGrantTestCase):
 
     response = self.client.post(self.url, post_dict)
 
-    reader = unicodecsv.reader(response, encoding='utf8')
+    reader = unicodecsv.reader(streamed_lines(response), encoding='utf8')
     row_count = sum(1 for row in reader)
-    self.assertEqual(row_count - 2, models.Organization.objects.count())
+    # 1st row is headers
+    self.assertEqual(row_count - 1, models.Organization.objects.count())
 
   def test_org_filters_all(self):
     """ Verify that all filters can be selected in org report without error
@@ -286,9 +429,10 @@ class GPGReports(BaseGrantTestCase):
 
     response = self.client.post(self.url, post_dict)
 
-    reader = unicodecsv.reader(response, encoding='utf8')
+    reader = unicodecsv.reader(streamed_lines(response), encoding='utf8')
     row_count = sum(1 for row in reader)
-    self.assertEqual(row_count - 2, models.GivingProjectGrant.objects.count())
+    # 1st row is headers
+    self.assertEqual(row_count - 1, models.GivingProjectGrant.objects.count())
 
   @skip("Needs additional fixtures")
   def test_gp_grant_filters_all(self):
@@ -371,9 +515,10 @@ class SponsoredAwardReports(BaseGrantTestCase):
 
     response = self.client.post(self.url, post_dict)
 
-    reader = unicodecsv.reader(response, encoding='utf8')
+    reader = unicodecsv.reader(streamed_lines(response), encoding='utf8')
     row_count = sum(1 for row in reader)
-    self.assertEqual(row_count - 2, models.SponsoredProgramGrant.objects.count())
+    # 1st row is headers
+    self.assertEqual(row_count - 1, models.SponsoredProgramGrant.objects.count())
 
   def test_sponsored_all_filters(self):
     """ Verify that all filters can be selected without error """
@@ -389,3 +534,86 @@ class SponsoredAwardReports(BaseGrantTestCase):
 
     results = response.context['results']
     logger.info(results)
+
+
+class BackgroundReports(BaseGrantTestCase):
+
+  url = reverse('sjfnw.grants.views.grants_report')
+
+  def setUp(self):
+    super(BackgroundReports, self).setUp()
+    self.login_as_admin()
+    self.queue = ThreadPoolQueue(workers=1, share_connections=True)
+    self.report_queue = views.report_queue
+    views.report_queue = self.queue
+
+  def tearDown(self):
+    views.report_queue = self.report_queue
+    self.queue.close()
+
+  def run_report(self, form_class, report_type):
+    """ Run report in the background and return (export, csv it would have streamed) """
+    post_dict = fill_report_form(form_class(), select_fields=True, fmt='background')
+    post_dict['run-' + report_type] = ''
+
+    response = self.client.post(self.url, post_dict)
+
+    export = models.ReportExport.objects.get()
+    self.assertRedirects(response, reverse('sjfnw.grants.views.report_export_status',
+                                           kwargs={'export_id': export.pk}))
+    self.assertEqual(self.queue.join(), 1)
+
+    post_dict['format'] = 'csv'
+    streamed = b''.join(self.client.post(self.url, post_dict).streaming_content)
+    return models.ReportExport.objects.get(pk=export.pk), streamed
+
+  def test_app_report(self):
+    export, streamed = self.run_report(AppReportForm, 'application')
+
+    self.assertEqual(export.status, models.ReportExport.DONE)
+    rows = models.GrantApplication.objects.count()
+    self.assertGreater(rows, 0)
+    self.assertEqual(export.rows_processed, rows)
+    # header, then chunks of rows
+    chunks = 1 + (rows + views.EXPORT_CHUNK_ROWS - 1) // views.EXPORT_CHUNK_ROWS
+    self.assertEqual(export.reportexportchunk_set.count(), chunks)
+
+    response = self.client.get(reverse('sjfnw.grants.views.report_export_status',
+                                       kwargs={'export_id': export.pk}))
+    self.assertContains(response, 'Download csv')
+    self.assertNotContains(response, 'http-equiv="refresh"')
+
+    response = self.client.get(reverse('sjfnw.grants.views.report_export_download',
+                                       kwargs={'export_id': export.pk}))
+    self.assertEqual(b''.join(response.streaming_content), streamed)
+
+  def test_org_report(self):
+    export, streamed = self.run_report(OrgReportForm, 'organization')
+
+    self.assertEqual(export.status, models.ReportExport.DONE)
+    content = ''.join(export.reportexportchunk_set.values_list('content', flat=True))
+    self.assertEqual(content.encode('utf-8'), streamed)
+
+  def test_in_progress(self):
+    export = models.ReportExport.objects.create(report_type='application',
+                                                status=models.ReportExport.RUNNING,
+                                                rows_processed=400)
+
+    response = self.client.get(reverse('sjfnw.grants.views.report_export_status',
+                                       kwargs={'export_id': export.pk}))
+
+    self.assertContains(response, 'http-equiv="refresh"')
+    self.assertContains(response, '<span class="export-rows">400</span>', html=False)
+    self.assertNotContains(response, 'Download csv')
+    response = self.client.get(reverse('sjfnw.grants.views.report_export_download',
+                                       kwargs={'export_id': export.pk}))
+    self.assertEqual(response.status_code, 404)
+
+  def test_failed(self):
+    export = models.ReportExport.objects.create(report_type='application', options='{}')
+
+    views.generate_report_export(export.pk)
+
+    export = models.ReportExport.objects.get(pk=export.pk)
+    self.assertEqual(export.status, models.ReportExport.FAILED)
+    self.assertIsNotNone(export.completed)
@@ -0,0 +1,66 @@
+# encoding: utf-8
+import logging
+
+from django.utils import timezone
+
+from sjfnw.grants import search
+from sjfnw.grants.forms import AppReportForm
+from sjfnw.grants.models import GrantApplication, Organization, OrganizationNameWord
+from sjfnw.grants.tests.base import BaseGrantTestCase
+from sjfnw.grants.views import get_app_results
+
+logger = logging.getLogger('sjfnw')
+
+
+class NameSearch(BaseGrantTestCase):
+
+  def matches(self, query):
+    return set(search.matching_organizations(query).values_list('name', flat=True))
+
+  def test_normalize(self):
+    self.assertEqual(search.normalize(u'  Café-Workers’ Union #2!'),
+                     ['cafe', 'workers', 'union', '2'])
+
+  def test_fixtures_indexed(self):
+    words = OrganizationNameWord.objects.filter(organization_id=2).values_list('word', flat=True)
+    self.assertEqual(set(words), {'officemax', 'foundation'})
+
+  def test_prefix(self):
+    self.assertEqual(self.matches('found'), {'OfficeMax Foundation'})
+    self.assertEqual(self.matches('FOUNDATION'), {'OfficeMax Foundation'})
+    self.assertEqual(self.matches('oundation'), set())
+
+  def test_all_words(self):
+    self.assertEqual(self.matches('office found'), {'OfficeMax Foundation'})
+    self.assertEqual(self.matches('fresh found'), set())
+
+  def test_punctuation_only(self):
+    self.assertEqual(self.matches(' -- '), set())
+
+  def test_rename(self):
+    org = Organization.objects.get(pk=1)
+    org.name = u'Renamed Collective'
+    org.save()
+
+    self.assertEqual(self.matches('fresh'), set())
+    self.assertEqual(self.matches('collect'), {'Renamed Collective'})
+
+  def test_admin_search(self):
+    self.login_as_admin()
+
+    response = self.client.get('/admin/grants/organization/', {'q': 'office'})
+    self.assertEqual(list(response.context['cl'].result_list.values_list('pk', flat=True)), [2])
+
+    response = self.client.get('/admin/grants/organization/', {'q': 'neworg@'})
+    self.assertEqual(list(response.context['cl'].result_list.values_list('pk', flat=True)), [1])
+
+  def test_report_filter(self):
+    form = AppReportForm({'year_min': 1995, 'year_max': timezone.now().year, 'format': 'csv',
+                          'organization_name': 'officemax'})
+    self.assertTrue(form.is_valid())
+
+    _, results = get_app_results(form.cleaned_data)
+
+    expected = GrantApplication.objects.filter(organization_id=2).count()
+    self.assertGreater(expected, 0)
+    self.assertEqual(len(list(results)), expected)
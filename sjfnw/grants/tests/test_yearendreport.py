@@ -1,13 +1,15 @@
-from datetime import timedelta
+from datetime import date, timedelta
 import json
 import logging
 
 from django.core import mail
 from django.core.urlresolvers import reverse
+from django.test import RequestFactory
 from django.test.utils import override_settings
 from django.utils import timezone
+from django.utils.formats import date_format
 
-from sjfnw.grants import models
+from sjfnw.grants import cron, models, utils
 from sjfnw.grants.tests.base import BaseGrantTestCase
 from sjfnw.grants.tests.test_apply import BaseGrantFilesTestCase
 
@@ -146,6 +148,8 @@ class YearEndReportForm(BaseGrantFilesTestCase):
 
     # assert website autofilled from app
     self.assertEqual(form['website'].value(), application.website)
+    # autosave compares with the stored contents, so autofilled fields get saved
+    self.assertContains(response, "JSON.parse('{}')")
     expected_title = 'Year-end Report for {:%b %d, %Y} - {:%b %d, %Y}'.format(
         award.first_yer_due.replace(year=award.first_yer_due.year - 1), award.first_yer_due)
     self.assertContains(response, expected_title)
@@ -189,6 +193,27 @@ class YearEndReportForm(BaseGrantFilesTestCase):
     draft = models.YERDraft.objects.get(award_id=self.award_id)
     self.assertEqual(json.loads(draft.contents), post_data)
 
+  def test_autosave_delta(self):
+    self._create_draft()
+    url = _get_autosave_url(self.award_id) + '?version=0'
+
+    response = self.client.post(url, {'goal_progress': 'Some', 'removed_fields': ''})
+    self.assertEqual(response.status_code, 200)
+    self.assertEqual(response['X-Draft-Version'], '1')
+
+    response = self.client.post(_get_autosave_url(self.award_id) + '?version=1',
+                                {'goal_progress': 'Some', 'removed_fields': ''})
+    self.assertEqual(response.status_code, 304)
+
+    # changes relative to an older version are refused
+    response = self.client.post(url, {'goal_progress': 'Other', 'removed_fields': ''})
+    self.assertEqual(response.status_code, 412)
+    self.assertEqual(response['X-Draft-Version'], '1')
+
+    draft = models.YERDraft.objects.get(award_id=self.award_id)
+    self.assertEqual(json.loads(draft.contents)['goal_progress'], 'Some')
+    self.assertEqual(draft.version, 1)
+
   def test_autosave_logged_out(self):
     self._create_draft()
 
@@ -457,6 +482,138 @@ class YearEndReportReminders(BaseGrantTestCase):
     self.assertEqual(len(mail.outbox), 0)
 
 
+  def test_query_count(self):
+    """ Awards due for reminders are found with one query per reminder """
+    today = timezone.now().date()
+    models.GivingProjectGrant(projectapp_id=1, amount=5000,
+                              first_yer_due=today + timedelta(days=7)).save()
+    request = RequestFactory().get(self.url)
+
+    # bulk insert of sent reminders in a savepoint
+    with self.assertNumQueries(5):
+      cron.yer_reminder_email(request)
+    self.assertEqual(len(mail.outbox), 1)
+    self.assertIn(date_format(today + timedelta(days=7)), mail.outbox[0].body)
+
+  def test_sent_once(self):
+    """ Running again the same day doesn't send the reminder twice """
+    today = timezone.now().date()
+    models.GivingProjectGrant(projectapp_id=1, amount=5000,
+                              first_yer_due=today + timedelta(days=30)).save()
+
+    self.client.get(self.url)
+    self.client.get(self.url)
+
+    self.assertEqual(len(mail.outbox), 1)
+    self.assertEqual(models.YERReminderSent.objects.get().days, 30)
+
+  def test_missed_day(self):
+    """ A reminder is still sent if the job didn't run on the exact day """
+    today = timezone.now().date()
+    models.GivingProjectGrant(projectapp_id=1, amount=5000,
+                              first_yer_due=today + timedelta(days=6)).save()
+
+    self.client.get(self.url)
+
+    self.assertEqual(len(mail.outbox), 1)
+
+  def test_due_date_changed(self):
+    """ Moving the due date clears reminders sent for the old date """
+    today = timezone.now().date()
+    award = models.GivingProjectGrant(projectapp_id=1, amount=5000,
+                                      first_yer_due=today + timedelta(days=7))
+    award.save()
+    self.client.get(self.url)
+
+    award.first_yer_due = today + timedelta(days=30)
+    award.save()
+    self.client.get(self.url)
+
+    self.assertEqual(len(mail.outbox), 2)
+
+
+class YERSchedule(BaseGrantTestCase):
+
+  def setUp(self):
+    super(YERSchedule, self).setUp()
+    self.today = timezone.now().date()
+    self.award = models.GivingProjectGrant(projectapp_id=1, amount=5000,
+                                           first_yer_due=self.today - timedelta(days=30))
+    self.award.save()
+
+  def get_schedule(self):
+    return list(models.YearEndReportDue.objects.filter(award=self.award)
+                                               .values_list('number', 'due', 'fulfilled'))
+
+  def create_yer(self):
+    yer = models.YearEndReport(award=self.award, total_size=10, donations_count=50)
+    yer.save()
+    return yer
+
+  def test_created(self):
+    self.assertEqual(self.get_schedule(), [(1, self.award.first_yer_due, False)])
+
+  def test_grant_length_changed(self):
+    first_due = self.award.first_yer_due
+    self.award.second_amount = 5000
+    self.award.save()
+    self.assertEqual(self.get_schedule(), [
+      (1, first_due, False),
+      (2, first_due.replace(year=first_due.year + 1), False)
+    ])
+
+    self.award.second_amount = None
+    self.award.save()
+    self.assertEqual(self.get_schedule(), [(1, first_due, False)])
+
+  def test_due_date_changed(self):
+    self.award.first_yer_due = self.today
+    self.award.save()
+    self.assertEqual(self.get_schedule(), [(1, self.today, False)])
+
+  def test_reports(self):
+    self.award.second_amount = 5000
+    self.award.save()
+
+    yer = self.create_yer()
+    self.assertEqual([row[2] for row in self.get_schedule()], [True, False])
+    self.create_yer()
+    self.assertEqual([row[2] for row in self.get_schedule()], [True, True])
+
+    yer.delete()
+    self.assertEqual([row[2] for row in self.get_schedule()], [True, False])
+
+  def test_award_deleted(self):
+    self.create_yer()
+    self.award.delete()
+    self.assert_count(models.YearEndReportDue.objects.all(), 0)
+
+  def test_leap_day(self):
+    self.assertEqual(utils.add_years(date(2016, 2, 29), 1), date(2017, 2, 28))
+    self.assertEqual(utils.add_years(date(2016, 2, 29), 4), date(2020, 2, 29))
+
+  def test_statuses(self):
+    self.award.agreement_mailed = self.today - timedelta(days=400)
+    self.award.save()
+    self.login_as_admin()
+
+    response = self.client.get(reverse('sjfnw.grants.views.show_yer_statuses'))
+
+    award = response.context['awards'][0]
+    self.assertEqual(award.yer_count, 0)
+    self.assertEqual(award.next_due, self.award.first_yer_due)
+    self.assertTrue(award.past_due)
+    self.assertFalse(award.complete)
+
+    self.create_yer()
+    response = self.client.get(reverse('sjfnw.grants.views.show_yer_statuses'))
+
+    award = response.context['awards'][0]
+    self.assertEqual(award.yer_count, 1)
+    self.assertTrue(award.complete)
+    self.assertFalse(award.past_due)
+
+
 class RolloverYER(BaseGrantTestCase):
   """ Test display and function of the rollover feature for YER """
 
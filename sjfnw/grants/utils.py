@@ -1,13 +1,12 @@
 # encoding: utf-8
 
-import logging, re, string
+import json, logging, re, string, unicodedata
 
 from django.conf import settings
-from django.http import HttpResponse, Http404
+from django.core.files.storage import default_storage
+from django.http import HttpResponse
 from django.utils import timezone
 
-from google.appengine.ext import blobstore
-
 logger = logging.getLogger('sjfnw')
 
 # removing all non-ascii characters, which could be problem for words of only non-ascii characters, but javascript will be consistent, so okay for matching word counts.
@@ -16,11 +15,54 @@ def strip_punctuation_and_non_ascii(input_str):
   input_str = unicode(input_str) # input may or may not be unicode already
   return ''.join([c for c in input_str if c not in string.punctuation and ord(c)<128])
 
+def normalize_words(text, max_length=100):
+  """ Split text into lowercase ascii words for searching, dropping accents and punctuation """
+  text = unicodedata.normalize('NFKD', unicode(text)).encode('ascii', 'ignore').lower()
+  return [word[:max_length] for word in re.findall(r'[a-z0-9]+', text)]
+
 def local_date_str(timestamp):
   """ Convert UTC timestamp to local date string in mm/dd/yyyy format """
   timestamp = timezone.localtime(timestamp)
   return timestamp.strftime('%m/%d/%Y')
 
+def count_answers(contents, field_names):
+  """ Number of form fields with a non-blank answer in a draft's json contents
+
+    Keys that aren't in field_names (user_id, csrfmiddlewaretoken, profile
+    fields) are ignored. Multi-widget parts (timeline_0, timeline_1...) count
+    once for their field.
+  """
+  answers = json.loads(contents) if contents else {}
+  answered = set()
+  for key, val in answers.items():
+    if not unicode(val).strip():
+      continue
+    name = key if key in field_names else re.sub(r'_\d+$', '', key)
+    if name in field_names:
+      answered.add(name)
+  return len(answered)
+
+def add_years(date, years):
+  """ Same month and day, years later. Feb 29 becomes Feb 28 in non-leap years """
+  try:
+    return date.replace(year=date.year + years)
+  except ValueError:
+    return date.replace(year=date.year + years, day=28)
+
+def yer_schedule(first_due, length, submitted):
+  """ Year-end reports required by a grant: one due each year from first_due
+
+  Args:
+    first_due: due date of the first report
+    length: number of years the grant is for
+    submitted: number of reports submitted so far
+
+  Returns:
+    list of (number, due date, fulfilled), number starting at 1
+  """
+  return [(number, add_years(first_due, number - 1), number <= submitted)
+          for number in range(1, length + 1)]
+
 def get_blobkey_from_body(body):
   """ Extract blobkey from request.body """
 
@@ -33,30 +75,14 @@ def get_blobkey_from_body(body):
   logger.info('Extracted blobkey from request.body: %s', key)
   return key
 
-def find_blobinfo(file_field, hide_errors=False):
-  """Given contents of a file field, return BlobInfo. """
-
-  key = file_field.name.split('/', 1)[0]
-  if key:
-    blobinfo = blobstore.BlobInfo.get(key)
-    if blobinfo:
-      logger.info('Found blobinfo. Filename: %s, size: %s, content-type: %s',
-                  blobinfo.filename, blobinfo.size, blobinfo.content_type)
-      return blobinfo
-
-  if hide_errors:
-    return
-  else:
-    raise Http404('Blobinfo not found')
-
 def delete_blob(file_field):
+  """ Delete a file field's file from the file backend """
   if not file_field:
     logger.warn('Missing file_field argument')
     return
 
-  blobinfo = find_blobinfo(file_field, hide_errors=True)
-  if blobinfo is not None:
-    blobinfo.delete()
+  if default_storage.exists(file_field.name):
+    default_storage.delete(file_field.name)
     logger.info('Blob deleted')
     return HttpResponse('deleted')
   else:
@@ -1,35 +1,42 @@
 from datetime import datetime, timedelta
-import json, logging, urllib2
+import calendar, hashlib, json, logging, urllib2
 
 from django.conf import settings
 from django.contrib import messages
+from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.core.mail import EmailMultiAlternatives
 from django.core.urlresolvers import reverse
+from django.db.models import Case, Count, DateField, F, IntegerField, Min, When
 from django.forms.models import model_to_dict
-from django.http import HttpResponse, Http404, HttpResponseBadRequest
+from django.http import (HttpResponse, Http404, HttpResponseBadRequest,
+    HttpResponseNotModified, StreamingHttpResponse)
 from django.shortcuts import render, render_to_response, get_object_or_404, redirect
 from django.template.loader import render_to_string
 from django.utils import timezone
 from django.utils.html import strip_tags
+from django.utils.http import http_date
 from django.views.decorators.http import require_http_methods
-
-from google.appengine.ext import blobstore
+from django.views.static import was_modified_since
 
 import unicodecsv
 
 from sjfnw import constants as c
 from sjfnw.fund.models import Member
+from sjfnw.grants import autosave
 from sjfnw.grants import constants as gc
 from sjfnw.grants import models
+from sjfnw.grants import search
+from sjfnw.grants import storage
 from sjfnw.grants.decorators import registered_org
 from sjfnw.grants.forms import (AdminRolloverForm, LoginAsOrgForm, LoginForm,
    AppReportForm, SponsoredAwardReportForm, GPGrantReportForm, OrgReportForm,
    RegisterForm, RolloverForm, RolloverYERForm, OrgMergeForm)
 from sjfnw.grants.modelforms import GrantApplicationModelForm, YearEndReportForm
-from sjfnw.grants.utils import local_date_str, find_blobinfo
+from sjfnw.grants.utils import local_date_str
+from sjfnw.tasks import DeferredQueue
 
 logger = logging.getLogger('sjfnw')
 
@@ -233,8 +240,64 @@ def org_home(request, org):
 #  Grant application & Year-end report
 # -----------------------------------------------------------------------------
 
+# fields in autosave requests that are not part of the form
+AUTOSAVE_PROTOCOL_FIELDS = ('user_id', 'removed_fields')
+
+class StaleDraftVersion(Exception):
+  pass
+
+def _autosave_contents(request, current, version):
+  """ Get a draft's new contents from an autosave request
+
+    If the querystring has a version, the post only has fields that changed
+    since then, plus removed_fields: a comma separated list of fields that are
+    no longer in the form. Those changes are merged into the current contents.
+    Otherwise the post is the whole form and replaces the contents.
+
+  Arguments:
+    current - json string of the draft's current contents
+    version - the draft's current version
+
+  Returns:
+    Json string of the new contents, or None if the draft would not change
+
+  Raises:
+    StaleDraftVersion if the changes are relative to an older version, which
+    the client handles by sending a full save
+  """
+  if request.GET.get('version') is None:
+    return json.dumps(request.POST)
+  if request.GET['version'] != str(version):
+    raise StaleDraftVersion()
+
+  contents = json.loads(current)
+  merged = dict(contents)
+  merged.update((key, val) for key, val in request.POST.items()
+                if key not in AUTOSAVE_PROTOCOL_FIELDS)
+  for field in request.POST.get('removed_fields', '').split(','):
+    merged.pop(field, None)
+
+  if merged == contents:
+    return None
+  return json.dumps(merged)
+
+def _autosave_response(version, changed=True, stale=False):
+  """ Response to an autosave, with the draft's current version in a header
+
+    Not modified (304) if the request didn't change the draft, precondition
+    failed (412) if it was relative to an older version """
+  if stale:
+    response = HttpResponse('stale version', status=412)
+  else:
+    response = HttpResponse('success') if changed else HttpResponseNotModified()
+  response['X-Draft-Version'] = version
+  return response
+
 def autosave_app(request, cycle_id):
-  """ Save non-file fields to a draft """
+  """ Save non-file fields to a draft
+
+    Saves go through the autosave buffer (see sjfnw.grants.autosave). When the
+    draft is already buffered, the org, cycle and draft aren't queried. """
 
   # don't return actual redirect since this is an ajax request
   if not request.user.is_authenticated():
@@ -247,23 +310,34 @@ def autosave_app(request, cycle_id):
     username = request.GET.get('user')
     logger.info('Staff override - %s logging in as %s', request.user.username, username)
 
-  try:
-    organization = models.Organization.objects.get(email=username)
-    logger.info(organization)
-  except models.Organization.DoesNotExist:
-    return HttpResponse('/apply/nr', status=401)
+  cycle_id = int(cycle_id)
+  entry = autosave.draft_buffer.get(username, cycle_id)
+  if entry is None:
+    try:
+      organization = models.Organization.objects.get(email=username)
+      logger.info(organization)
+    except models.Organization.DoesNotExist:
+      return HttpResponse('/apply/nr', status=401)
 
-  cycle = get_object_or_404(models.GrantCycle, pk=cycle_id)
-  draft = get_object_or_404(models.DraftGrantApplication,
-      organization=organization, grant_cycle=cycle)
+    cycle = get_object_or_404(models.GrantCycle, pk=cycle_id)
+    draft = get_object_or_404(models.DraftGrantApplication,
+        organization=organization, grant_cycle=cycle)
+    entry = autosave.draft_buffer.entry(draft)
 
   if request.method == 'POST':
     curr_user = request.POST.get('user_id')
 
+    try:
+      contents = _autosave_contents(request, entry['contents'], entry['version'])
+    except StaleDraftVersion:
+      return _autosave_response(entry['version'], stale=True)
+    if contents is None:
+      return _autosave_response(entry['version'], changed=False)
+
     # check for simultaneous editing
     if request.GET.get('force') != 'true':
-      if draft.recently_edited():
-        if draft.modified_by and draft.modified_by != curr_user:
+      if models.DraftGrantApplication.is_recent(entry['modified']):
+        if entry['modified_by'] and entry['modified_by'] != curr_user:
           # last save wasn't this userid
           logger.info('Requiring confirmation')
           return HttpResponse('confirm force', status=409)
@@ -271,11 +345,12 @@ def autosave_app(request, cycle_id):
       logger.info('Force - skipped check')
 
     logger.debug('Autosaving')
-    draft.contents = json.dumps(request.POST)
-    draft.modified = timezone.now()
-    draft.modified_by = curr_user or 'none'
-    draft.save()
-    return HttpResponse('success')
+    entry['contents'] = contents
+    entry['version'] += 1
+    entry['modified'] = timezone.now()
+    entry['modified_by'] = curr_user or 'none'
+    autosave.draft_buffer.save(username, cycle_id, entry)
+    return _autosave_response(entry['version'])
 
 @login_required(login_url=LOGIN_URL)
 @registered_org()
@@ -297,6 +372,8 @@ def grant_application(request, organization, cycle_id):
       'organization': organization, 'cycle': cycle
     })
 
+  # make sure the draft has the latest autosave
+  autosave.draft_buffer.flush(organization.email, cycle.pk)
   draft, created = models.DraftGrantApplication.objects.get_or_create(
       organization=organization, grant_cycle=cycle)
   profiled = False
@@ -412,11 +489,19 @@ def autosave_yer(request, award_id):
   draft = get_object_or_404(models.YERDraft, award_id=award_id)
 
   if request.method == 'POST':
-    draft.contents = json.dumps(request.POST)
+    try:
+      contents = _autosave_contents(request, draft.contents, draft.version)
+    except StaleDraftVersion:
+      return _autosave_response(draft.version, stale=True)
+    if contents is None:
+      return _autosave_response(draft.version, changed=False)
+
+    draft.contents = contents
     logger.info(draft.contents)
+    draft.version += 1
     draft.modified = timezone.now()
     draft.save()
-    return HttpResponse('success')
+    return _autosave_response(draft.version)
 
 @login_required(login_url=LOGIN_URL)
 @registered_org()
@@ -576,7 +661,7 @@ def remove_file(request, draft_type, draft_id, file_field):
   return HttpResponse('success')
 
 def get_upload_url(request):
-  """ Get a blobstore url for uploading a file """
+  """ Get a url for uploading a file to the file backend """
 
   # staff override
   user_override = request.GET.get('user')
@@ -588,7 +673,8 @@ def get_upload_url(request):
   draft_id = int(request.GET.get('id'))
   prefix = request.GET.get('type')
 
-  upload_url = blobstore.create_upload_url('/%s/%d/add-file' % (prefix, draft_id) + user_override)
+  upload_url = storage.get_file_backend().upload_url(
+      '/%s/%d/add-file' % (prefix, draft_id) + user_override)
   return HttpResponse(upload_url)
 
 # -----------------------------------------------------------------------------
@@ -646,7 +732,8 @@ def copy_app(request, organization):
       elif draft:
         try:
           application = models.DraftGrantApplication.objects.get(pk=int(draft))
-          content = json.loads(application.contents)
+          buffered = autosave.draft_buffer.pending(application)
+          content = json.loads(buffered['contents'] if buffered else application.contents)
           content['cycle_question'] = ''
           logger.info(content)
           content = json.dumps(content)
@@ -842,19 +929,112 @@ def view_application(request, app_id):
                  'awards': awards, 'perm': perm})
 
 def view_blob(request, blobkey):
-  blobinfo = blobstore.BlobInfo.get(blobkey)
-  if blobinfo:
-    return HttpResponse(blobstore.BlobReader(blobinfo).read(),
-                       content_type=blobinfo.content_type)
-  else:
+  return serve_file(request, blobkey)
+
+
+# size of each piece of a file read from storage and sent in the response
+FILE_CHUNK_SIZE = 512 * 1024
+
+def _file_chunks(fileobj, start, length):
+  """ Yield length bytes of fileobj from start, one chunk at a time """
+  try:
+    fileobj.seek(start)
+    while length > 0:
+      data = fileobj.read(min(FILE_CHUNK_SIZE, length))
+      if not data:
+        break
+      length -= len(data)
+      yield data
+  finally:
+    fileobj.close()
+
+def _parse_range(header, size):
+  """ Parse a Range header for a file of the given size
+
+  Only single byte ranges are supported.
+
+  Returns:
+    (start, end) with end inclusive, or None if the whole file should be sent
+  Raises:
+    ValueError if the range can't be satisfied
+  """
+  if not header or not header.startswith('bytes=') or ',' in header:
+    return None
+  start, _, end = header[6:].strip().partition('-')
+  try:
+    if start: # bytes=start- or bytes=start-end
+      start = int(start)
+      end = min(int(end), size - 1) if end else size - 1
+    else: # bytes=-suffix_length
+      start, end = max(size - int(end), 0), size - 1
+  except ValueError:
+    return None
+  if start > end or start >= size:
+    raise ValueError('Unsatisfiable range {}'.format(header))
+  return start, end
+
+def serve_file(request, name, backend=None):
+  """ Stream a stored file, supporting conditional and range requests
+
+    Files are never changed once stored, so the ETag only needs to identify
+    the file, not its contents.
+
+    Arguments:
+      name: name of the file in storage, as stored in a FileField
+      backend: file backend; defaults to storage.get_file_backend()
+  """
+  backend = backend or storage.get_file_backend()
+  stored = backend.stat(name)
+  if stored is None:
+    logger.warning('File not found in storage: %s', name)
     raise Http404
 
+  etag = '"{}"'.format(hashlib.md5(u'{}:{}'.format(name, stored.size).encode('utf-8')).hexdigest())
+  modified = calendar.timegm(stored.created.utctimetuple())
+  last_modified = http_date(modified)
+
+  if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+  if if_none_match:
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    not_modified = etag in tags or '*' in tags
+  else:
+    not_modified = not was_modified_since(request.META.get('HTTP_IF_MODIFIED_SINCE'), modified)
+  if not_modified:
+    response = HttpResponseNotModified()
+    response['ETag'] = etag
+    response['Last-Modified'] = last_modified
+    return response
+
+  byte_range = None
+  if_range = request.META.get('HTTP_IF_RANGE')
+  if not if_range or if_range in (etag, last_modified):
+    try:
+      byte_range = _parse_range(request.META.get('HTTP_RANGE'), stored.size)
+    except ValueError:
+      response = HttpResponse(status=416)
+      response['Content-Range'] = 'bytes */{}'.format(stored.size)
+      return response
+
+  if byte_range:
+    start, end = byte_range
+    response = StreamingHttpResponse(_file_chunks(backend.open(name), start, end - start + 1),
+                                     status=206, content_type=stored.content_type)
+    response['Content-Range'] = 'bytes {}-{}/{}'.format(start, end, stored.size)
+    response['Content-Length'] = end - start + 1
+  else:
+    response = StreamingHttpResponse(_file_chunks(backend.open(name), 0, stored.size),
+                                     content_type=stored.content_type)
+    response['Content-Length'] = stored.size
+  response['Accept-Ranges'] = 'bytes'
+  response['ETag'] = etag
+  response['Last-Modified'] = last_modified
+  return response
 
-def serve_app_file(application, field_name):
-  """ Returns response containing file from the Blobstore
+def serve_app_file(request, application, field_name):
+  """ Returns response streaming a file from an application or report
 
     Arguments:
-      application: GrantApplication or DraftGrantApplication
+      application: GrantApplication, DraftGrantApplication, YearEndReport or YERDraft
       field_name: name of the file field
   """
 
@@ -863,10 +1043,7 @@ def serve_app_file(application, field_name):
     logger.warning('Draft/app does not have a %s', field_name)
     raise Http404
 
-  blobinfo = find_blobinfo(file_field)
-
-  return HttpResponse(blobstore.BlobReader(blobinfo).read(),
-                       content_type=blobinfo.content_type)
+  return serve_file(request, file_field.name)
 
 def view_file(request, obj_type, obj_id, field_name):
   model_types = {
@@ -880,7 +1057,7 @@ def view_file(request, obj_type, obj_id, field_name):
     raise Http404
 
   obj = get_object_or_404(model_types[obj_type], pk=obj_id)
-  return serve_app_file(obj, field_name)
+  return serve_app_file(request, obj, field_name)
 
 def view_yer(request, report_id):
 
@@ -987,25 +1164,16 @@ def show_yer_statuses(request):
   awards = (models.GivingProjectGrant.objects
     .filter(agreement_mailed__isnull=False)
     .select_related('projectapp__application__organization', 'projectapp__giving_project')
+    .annotate(
+      yer_count=Count(Case(When(yer_schedule__fulfilled=True, then=1),
+                           output_field=IntegerField())),
+      next_due=Min(Case(When(yer_schedule__fulfilled=False, then=F('yer_schedule__due')),
+                        output_field=DateField())))
     .order_by('agreement_mailed'))
-  yers = models.YearEndReport.objects.values_list('award_id', flat=True)
-  # count submitted yers by award id
-  yers_by_award = {}
-  for award_id in yers:
-    award_id = str(award_id)
-    if award_id in yers_by_award:
-      yers_by_award[award_id] = yers_by_award[award_id] + 1
-    else:
-      yers_by_award[award_id] = 1
-  # set count on award object and add computed properties
+  today = timezone.now().date()
   for award in awards:
-    if str(award.pk) in yers_by_award:
-      award.yer_count = yers_by_award[str(award.pk)]
-    else:
-      award.yer_count = 0
-    award.complete = award.yer_count >= award.grant_length()
-    next_due = award.next_yer_due()
-    award.past_due = next_due and next_due < timezone.now().date()
+    award.complete = award.next_due is None
+    award.past_due = award.next_due and award.next_due < today
 
   return render(request, 'admin/grants/yer_status.html', {'awards': awards})
 
@@ -1015,7 +1183,7 @@ def login_as_org(request):
     form = LoginAsOrgForm(request.POST)
     if form.is_valid():
       org = form.cleaned_data['organization']
-      return redirect('/apply/?user=' + org)
+      return redirect('/apply/?user=' + org.email)
   form = LoginAsOrgForm()
   return render(request, 'admin/grants/impersonate.html', {'form': form})
 
@@ -1128,28 +1296,28 @@ def grants_report(request):
       form = AppReportForm(request.POST)
       context['app_form'] = form
       context['active_form'] = '#application-form'
-      results_func = get_app_results
+      report_type = 'application'
 
     elif 'run-organization' in request.POST:
       logger.info('Org report')
       form = OrgReportForm(request.POST)
       context['org_form'] = form
       context['active_form'] = '#organization-form'
-      results_func = get_org_results
+      report_type = 'organization'
 
     elif 'run-giving-project-grant' in request.POST:
       logger.info('Giving project grant report')
       form = GPGrantReportForm(request.POST)
       context['award_form'] = form
       context['active_form'] = '#giving-project-grant-form'
-      results_func = get_gpg_results
+      report_type = 'giving-project-grant'
 
     elif 'run-sponsored-award' in request.POST:
       logger.info('Sponsored award report')
       form = SponsoredAwardReportForm(request.POST)
       context['award_form'] = form
       context['active_form'] = '#sponsored-award-form'
-      results_func = get_sponsored_award_results
+      report_type = 'sponsored-award'
 
     else:
       logger.error('Unknown report type')
@@ -1159,20 +1327,26 @@ def grants_report(request):
       options = form.cleaned_data
       logger.info('A valid form: ' + str(options))
 
-      # get results
-      field_names, results = results_func(options)
+      if options['format'] == 'background':
+        # csv is generated by a task; status page links to it when ready
+        options['format'] = 'csv'
+        export = models.ReportExport.objects.create(
+            created_by=request.user if request.user.is_authenticated() else None,
+            report_type=report_type, options=json.dumps(options))
+        report_queue.defer(generate_report_export, export.pk)
+        return redirect(report_export_status, export_id=export.pk)
+
+      # get results (generator of rows)
+      field_names, results = REPORT_FUNCTIONS[report_type](options)
 
       # format results
       if options['format'] == 'browse':
         return render_to_response('grants/report_results.html',
-                                  {'results': results, 'field_names': field_names})
+                                  {'results': list(results), 'field_names': field_names})
       elif options['format'] == 'csv':
-        response = HttpResponse(content_type='text/csv')
+        response = StreamingHttpResponse(stream_csv(field_names, results),
+                                         content_type='text/csv')
         response['Content-Disposition'] = 'attachment; filename=%s.csv' % 'grantapplications'
-        writer = unicodecsv.writer(response)
-        writer.writerow(field_names)
-        for row in results:
-          writer.writerow(row)
         return response
     else:
       logger.warning('Invalid form!')
@@ -1193,6 +1367,60 @@ def get_min_max_year(options):
   max_year = timezone.make_aware(max_year, current_tz)
   return min_year, max_year
 
+# number of objects to fetch at a time for reports that prefetch related objects
+REPORT_CHUNK_SIZE = 500
+
+# rows per stored chunk of a background report
+EXPORT_CHUNK_ROWS = 200
+
+# queue for background reports
+report_queue = DeferredQueue(getattr(settings, 'REPORT_QUEUE_NAME', 'default'))
+
+class _Echo(object):
+  """ File-like object that returns what is written to it """
+
+  def write(self, value):
+    return value
+
+def stream_csv(field_names, results, chunk_size=100):
+  """ Generate csv for the header and rows, chunk_size rows at a time """
+  writer = unicodecsv.writer(_Echo())
+  yield writer.writerow(field_names)
+  chunk = []
+  for row in results:
+    chunk.append(writer.writerow(row))
+    if len(chunk) == chunk_size:
+      yield ''.join(chunk)
+      chunk = []
+  if chunk:
+    yield ''.join(chunk)
+
+def iterate_report(queryset, chunk_size=None):
+  """ Iterate through a report queryset without caching all of its objects
+
+    Uses .iterator() unless the queryset has prefetches, which .iterator()
+    skips; then fetches chunk_size objects at a time, with pk added to the
+    ordering so ties can't skip or repeat rows between chunks.
+  """
+  if not queryset._prefetch_related_lookups: # pylint: disable=protected-access
+    for obj in queryset.iterator():
+      yield obj
+    return
+
+  ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+  if not set(ordering) & {'pk', '-pk'}:
+    queryset = queryset.order_by(*(ordering + ['pk']))
+
+  chunk_size = chunk_size or REPORT_CHUNK_SIZE
+  start = 0
+  while True:
+    chunk = list(queryset[start:start + chunk_size])
+    for obj in chunk:
+      yield obj
+    if len(chunk) < chunk_size:
+      return
+    start += chunk_size
+
 def get_app_results(options):
   """ Fetches application report results
 
@@ -1203,7 +1431,7 @@ def get_app_results(options):
     A list of display-formatted field names. Example:
       ['Submitted', 'Organization', 'Grant cycle']
 
-    A list of applications & related info. Example:
+    A generator of applications & related info, one list per row. Example:
       [
         ['2011-04-20 06:18:36+0:00', 'Justice League', 'LGBTQ Grant Cycle'],
         ['2013-10-23 09:08:56+0:00', 'ACLU of Idaho', 'General Grant Cycle'],
@@ -1211,15 +1439,15 @@ def get_app_results(options):
   """
   logger.info('Get app results')
 
-  apps = models.GrantApplication.objects.order_by('-submission_time').select_related(
-      'organization', 'grant_cycle')
+  apps = models.GrantApplication.objects.order_by('-submission_time')
 
   # filters
   min_year, max_year = get_min_max_year(options)
   apps = apps.filter(submission_time__gte=min_year, submission_time__lte=max_year)
 
   if options.get('organization_name'):
-    apps = apps.filter(organization__name__contains=options['organization_name'])
+    apps = apps.filter(
+        organization__in=search.matching_organizations(options['organization_name']))
   if options.get('city'):
     apps = apps.filter(city=options['city'])
   if options.get('state'):
@@ -1238,7 +1466,6 @@ def get_app_results(options):
   if options.get('grant_cycle'):
     apps = apps.filter(grant_cycle__title__in=options.get('grant_cycle'))
   if options.get('giving_projects'):
-    apps = apps.prefetch_related('giving_projects')
     apps = apps.filter(giving_projects__title__in=options.get('giving_projects'))
 
   # fields
@@ -1274,63 +1501,77 @@ def get_app_results(options):
     field_names.append('Awarded')
     get_awards = True
 
-  # execute queryset, populate results
-  results = []
-  for app in apps:
-    row = []
-
-    # application fields
-    for field in fields:
-      if field == 'pre_screening_status':
-        # convert screening status to human-readable version
-        val = getattr(app, field)
-        if val:
-          convert = dict(gc.PRE_SCREENING)
-          val = convert[val]
-        row.append(val)
-      elif field == 'submission_time':
-        row.append(local_date_str(getattr(app, field)))
-      else:
-        row.append(getattr(app, field))
+  # only the requested columns are selected; related names replace foreign keys
+  related_columns = {'organization': 'organization__name', 'grant_cycle': 'grant_cycle__title'}
+  columns = ['pk'] + [related_columns.get(field, field) for field in fields]
+
+  # display conversions, looked up once per column rather than per value
+  pre_screening_display = dict(gc.PRE_SCREENING)
+  converters = {
+    'pre_screening_status': lambda val: pre_screening_display[val] if val else val,
+    'submission_time': local_date_str
+  }
+  column_converters = [(i, converters[field]) for i, field in enumerate(fields)
+                       if field in converters]
 
-    # gp GPs, screening status, awards
+  def rows():
+    # gp GPs, screening status, awards for all apps, fetched in one query
+    project_columns = {}
     if get_gps or get_awards or get_gp_ss:
-      award_col = ''
-      ss_col = ''
-      gp_col = ''
-      papps = app.projectapp_set.all()
-      if papps:
-        for papp in papps:
-          if get_gps:
-            if gp_col != '':
-              gp_col += ', '
-            gp_col += '%s' % papp.giving_project.title
-          if get_awards:
-            try:
-              award = papp.givingprojectgrant
-              if award_col != '':
-                award_col += ', '
-              award_col += '%s %s ' % (award.total_amount(), papp.giving_project.title)
-            except models.GivingProjectGrant.DoesNotExist:
-              pass
-          if get_gp_ss:
-            if ss_col != '':
-              ss_col += ', '
-            if papp.screening_status:
-              ss_col += '%s (%s) ' % (dict(gc.SCREENING)[papp.screening_status],
-                papp.giving_project.title)
-            else:
-              ss_col += '%s (none) ' % papp.giving_project.title
-      if get_gps:
-        row.append(gp_col)
-      if get_gp_ss:
-        row.append(ss_col)
-      if get_awards:
-        row.append(award_col)
+      project_columns = get_project_app_columns(apps)
 
-    results.append(row)
+    for values in iterate_report(apps.values_list(*columns)):
+      app_id, row = values[0], list(values[1:])
 
-  return field_names, results
+      # application fields
+      for i, convert in column_converters:
+        row[i] = convert(row[i])
+
+      if get_gps or get_awards or get_gp_ss:
+        gp_col, ss_col, award_col = project_columns.get(app_id, ('', '', ''))
+        if get_gps:
+          row.append(gp_col)
+        if get_gp_ss:
+          row.append(ss_col)
+        if get_awards:
+          row.append(award_col)
+
+      yield row
+
+  return field_names, rows()
+
+def get_project_app_columns(apps):
+  """ Build application report columns from the apps' giving projects
+
+  Arguments:
+    apps - queryset of GrantApplications in the report
+
+  Returns:
+    A dict of app id to (assigned GPs, GP screening status, awarded) strings
+  """
+  screening_display = dict(gc.SCREENING)
+  papps = (models.ProjectApp.objects
+      .filter(application__in=apps.values('pk'))
+      .order_by('pk')
+      .values_list('application_id', 'giving_project__title', 'screening_status',
+                   'givingprojectgrant__pk', 'givingprojectgrant__amount',
+                   'givingprojectgrant__second_amount'))
+
+  columns = {}
+  for app_id, title, status, award_id, amount, second_amount in papps:
+    gps, statuses, awards = columns.get(app_id, ([], [], []))
+    gps.append(title)
+    if status:
+      statuses.append('%s (%s) ' % (screening_display[status], title))
+    else:
+      statuses.append('%s (none) ' % title)
+    if award_id:
+      # matches GivingProjectGrant.total_amount
+      total = (amount or 0) + second_amount if second_amount else amount or 0
+      awards.append('%s %s ' % (total, title))
+    columns[app_id] = (gps, statuses, awards)
+
+  return {app_id: tuple(', '.join(col) for col in cols) for app_id, cols in columns.items()}
 
 def get_org_results(options):
   """ Fetch organization report results
@@ -1342,7 +1583,7 @@ def get_org_results(options):
     A list of display-formatted field names. Example:
       ['Name', 'Login', 'State']
 
-    A list of organization & related info. Each item is a list of requested values
+    A generator of organization & related info. Each item is a list of requested values
     Example: [
         ['Fancy pants org', 'fancy@pants.org', 'ID'],
         ['Justice League', 'trouble@gender.org', 'WA']
@@ -1359,7 +1600,7 @@ def get_org_results(options):
   elif reg is False:
     org = orgs.filter(email='')
   if options.get('organization_name'):
-    orgs = orgs.filter(name__contains=options['organization_name'])
+    orgs = orgs.filter(pk__in=search.matching_organizations(options['organization_name']))
   if options.get('city'):
     orgs = orgs.filter(city=options['city'])
   if options.get('state'):
@@ -1391,54 +1632,54 @@ def get_org_results(options):
     field_names.append('Grants awarded')
     get_awards = True
 
-  # execute queryset, build results
-  results = []
   linebreak = '\n' if options['format'] == 'csv' else '<br>'
-  for org in orgs:
-    row = []
 
-    # org fields
-    for field in fields:
-      row.append(getattr(org, field))
+  def rows():
+    for org in iterate_report(orgs):
+      row = []
+
+      # org fields
+      for field in fields:
+        row.append(getattr(org, field))
 
-    awards_str = ''
-    if get_apps or get_awards:
-      apps_str = ''
+      awards_str = ''
+      if get_apps or get_awards:
+        apps_str = ''
+
+        for app in org.grantapplication_set.all():
+          if get_apps:
+            apps_str += (app.grant_cycle.title + ' ' +
+              app.submission_time.strftime('%m/%d/%Y') + linebreak)
+
+          # giving project grants
+          if get_awards:
+            for papp in app.projectapp_set.all():
+              try:
+                award = papp.givingprojectgrant
+                timestamp = award.check_mailed or award.created
+                if timestamp:
+                  timestamp = timestamp.strftime('%m/%d/%Y')
+                else:
+                  timestamp = 'No timestamp'
+                awards_str += u'${} {} {}{}'.format(award.total_amount(),
+                  award.projectapp.giving_project.title, timestamp, linebreak)
+              except models.GivingProjectGrant.DoesNotExist:
+                pass
 
-      for app in org.grantapplication_set.all():
         if get_apps:
-          apps_str += (app.grant_cycle.title + ' ' +
-            app.submission_time.strftime('%m/%d/%Y') + linebreak)
+          row.append(apps_str)
 
-        # giving project grants
-        if get_awards:
-          for papp in app.projectapp_set.all():
-            try:
-              award = papp.givingprojectgrant
-              timestamp = award.check_mailed or award.created
-              if timestamp:
-                timestamp = timestamp.strftime('%m/%d/%Y')
-              else:
-                timestamp = 'No timestamp'
-              awards_str += u'${} {} {}{}'.format(award.total_amount(),
-                award.projectapp.giving_project.title, timestamp, linebreak)
-            except models.GivingProjectGrant.DoesNotExist:
-              pass
-
-      if get_apps:
-        row.append(apps_str)
-
-    # sponsored program grants
-    if get_awards:
-      for award in org.sponsoredprogramgrant_set.all():
-        awards_str += '$%s %s %s' % (award.amount, ' sponsored program grant ',
-            (award.check_mailed or award.entered).strftime('%m/%d/%Y'))
-        awards_str += linebreak
-      row.append(awards_str)
-
-    results.append(row)
-
-  return field_names, results
+      # sponsored program grants
+      if get_awards:
+        for award in org.sponsoredprogramgrant_set.all():
+          awards_str += '$%s %s %s' % (award.amount, ' sponsored program grant ',
+              (award.check_mailed or award.entered).strftime('%m/%d/%Y'))
+          awards_str += linebreak
+        row.append(awards_str)
+
+      yield row
+
+  return field_names, rows()
 
 def get_gpg_results(options):
   """ Fetch giving project grant report results
@@ -1450,7 +1691,7 @@ def get_gpg_results(options):
     field_names: A list of display-formatted field names.
       Example: ['Amount', 'Check mailed', 'Organization']
 
-    results: A list of requested values for each award.
+    results: A generator of requested values for each award.
       Example (matching field_names example): [
           ['10000', '2013-10-23 09:08:56+0:00', 'Fancy pants org'],
           ['5987', '2011-08-04 09:08:56+0:00', 'Justice League']
@@ -1466,8 +1707,8 @@ def get_gpg_results(options):
   gp_awards = gp_awards.filter(created__gte=min_year, created__lte=max_year)
 
   if options.get('organization_name'):
-    gp_awards = gp_awards.filter(
-        projectapp__application__organization__name__contains=options['organization_name'])
+    gp_awards = gp_awards.filter(projectapp__application__organization__in=
+        search.matching_organizations(options['organization_name']))
 
   if options.get('city'):
     gp_awards = gp_awards.filter(projectapp__application__city=options['city'])
@@ -1510,37 +1751,36 @@ def get_gpg_results(options):
     org_fields += models.GrantApplication.fields_starting_with('fiscal')
     org_fields.remove('fiscal_letter')
 
-  # get values
-  results = []
-  for award in gp_awards:
-    row = []
-    for field in fields:
-      if field == 'organization':
-        row.append(award.projectapp.application.organization.name)
-      elif field == 'grant_cycle':
-        row.append(award.projectapp.application.grant_cycle.title)
-      elif field == 'support_type':
-        row.append(award.projectapp.application.support_type)
-      elif field == 'giving_project':
-        row.append(award.projectapp.giving_project.title)
-      elif field == 'year_end_report_due':
-        row.append(award.next_yer_due())
-      elif field == 'first_year_amount':
-        row.append(award.amount)
-      elif field == 'second_year_amount':
-        row.append(award.second_amount or '')
-      elif field == 'total_amount':
-        row.append(award.total_amount())
-      else:
-        row.append(getattr(award, field, ''))
-    for field in org_fields:
-      row.append(getattr(award.projectapp.application.organization, field))
-    results.append(row)
-
   field_names = [f.capitalize().replace('_', ' ') for f in fields]
   field_names += ['Org. ' + f.capitalize().replace('_', ' ') for f in org_fields]
 
-  return field_names, results
+  def rows():
+    for award in iterate_report(gp_awards):
+      row = []
+      for field in fields:
+        if field == 'organization':
+          row.append(award.projectapp.application.organization.name)
+        elif field == 'grant_cycle':
+          row.append(award.projectapp.application.grant_cycle.title)
+        elif field == 'support_type':
+          row.append(award.projectapp.application.support_type)
+        elif field == 'giving_project':
+          row.append(award.projectapp.giving_project.title)
+        elif field == 'year_end_report_due':
+          row.append(award.next_yer_due())
+        elif field == 'first_year_amount':
+          row.append(award.amount)
+        elif field == 'second_year_amount':
+          row.append(award.second_amount or '')
+        elif field == 'total_amount':
+          row.append(award.total_amount())
+        else:
+          row.append(getattr(award, field, ''))
+      for field in org_fields:
+        row.append(getattr(award.projectapp.application.organization, field))
+      yield row
+
+  return field_names, rows()
 
 def get_sponsored_award_results(options):
   sponsored = models.SponsoredProgramGrant.objects.select_related('organization')
@@ -1549,7 +1789,8 @@ def get_sponsored_award_results(options):
   sponsored = sponsored.filter(entered__gte=min_year, entered__lte=max_year)
 
   if options.get('organization_name'):
-    sponsored = sponsored.filter(organization__name__contains=options['organization_name'])
+    sponsored = sponsored.filter(
+        organization__in=search.matching_organizations(options['organization_name']))
   if options.get('city'):
     sponsored = sponsored.filter(organization__city=options['city'])
   if options.get('state'):
@@ -1571,23 +1812,82 @@ def get_sponsored_award_results(options):
     org_fields += models.GrantApplication.fields_starting_with('fiscal')
     org_fields.remove('fiscal_letter')
 
-  # get values
-  results = []
-  for award in sponsored:
-    row = []
-    for field in fields:
-      if hasattr(award, field):
-        row.append(getattr(award, field))
-      else:
-        row.append('')
-    for field in org_fields:
-      row.append(getattr(award.organization, field))
-    results.append(row)
-
   field_names = [f.capitalize().replace('_', ' ') for f in fields]
   field_names += ['Org. ' + f.capitalize().replace('_', ' ') for f in org_fields]
 
-  return field_names, results
+  def rows():
+    for award in iterate_report(sponsored):
+      row = []
+      for field in fields:
+        if hasattr(award, field):
+          row.append(getattr(award, field))
+        else:
+          row.append('')
+      for field in org_fields:
+        row.append(getattr(award.organization, field))
+      yield row
+
+  return field_names, rows()
+
+REPORT_FUNCTIONS = {
+  'application': get_app_results,
+  'organization': get_org_results,
+  'giving-project-grant': get_gpg_results,
+  'sponsored-award': get_sponsored_award_results
+}
+
+def generate_report_export(export_id):
+  """ Task that runs a ReportExport's report, storing csv a chunk at a time
+
+    Any chunks from an earlier attempt are replaced. Errors are logged and mark
+    the export failed rather than being raised, since retrying would not help.
+  """
+  try:
+    export = models.ReportExport.objects.get(pk=export_id)
+  except models.ReportExport.DoesNotExist:
+    logger.error('Report export %s not found', export_id)
+    return
+
+  exports = models.ReportExport.objects.filter(pk=export_id)
+  models.ReportExportChunk.objects.filter(export_id=export_id).delete()
+  exports.update(status=models.ReportExport.RUNNING, rows_processed=0)
+
+  processed = [0] # rows, updated by counted()
+  def counted(results):
+    for row in results:
+      processed[0] += 1
+      yield row
+
+  try:
+    field_names, results = REPORT_FUNCTIONS[export.report_type](json.loads(export.options))
+    chunks = stream_csv(field_names, counted(results), chunk_size=EXPORT_CHUNK_ROWS)
+    for index, chunk in enumerate(chunks):
+      models.ReportExportChunk.objects.create(export_id=export_id, index=index,
+                                              content=chunk.decode('utf-8'))
+      exports.update(rows_processed=processed[0])
+  except Exception: # pylint: disable=broad-except
+    logger.exception('Report export %s failed', export_id)
+    exports.update(status=models.ReportExport.FAILED, completed=timezone.now())
+    return
+
+  exports.update(status=models.ReportExport.DONE, rows_processed=processed[0],
+                 completed=timezone.now())
+  logger.info('Report export %s done: %d rows', export_id, processed[0])
+
+@staff_member_required
+def report_export_status(request, export_id):
+  export = get_object_or_404(models.ReportExport, pk=export_id)
+  return render(request, 'grants/report_export.html', {'export': export})
+
+@staff_member_required
+def report_export_download(request, export_id):
+  export = get_object_or_404(models.ReportExport, pk=export_id,
+                             status=models.ReportExport.DONE)
+  chunks = export.reportexportchunk_set.values_list('content', flat=True).iterator()
+  response = StreamingHttpResponse((chunk.encode('utf-8') for chunk in chunks),
+                                   content_type='text/csv')
+  response['Content-Disposition'] = 'attachment; filename=%s.csv' % export.report_type
+  return response
 
 # -----------------------------------------------------------------------------
 #  Helpers
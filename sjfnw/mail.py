@@ -6,13 +6,18 @@ from django.core.mail.backends.base import BaseEmailBackend
 from django.core.mail import EmailMultiAlternatives
 
 from google.appengine.api import mail as gaemail
-from google.appengine.ext import deferred
 from google.appengine.runtime import apiproxy_errors
 
+from sjfnw.tasks import DeferredQueue
+
 # MODIFIED VERSION OF DJANGOAPPENGINE'S MAIL.PY FILE. SEE LICENSE AT BOTTOM
 
 logger = logging.getLogger('sjfnw')
 
+# attempts per message when sending in batches, and delay between them
+MAX_ATTEMPTS = 3
+RETRY_COUNTDOWN = 60
+
 def _send_deferred(message, fail_silently=False):
   try:
     message.send()
@@ -21,11 +26,49 @@ def _send_deferred(message, fail_silently=False):
       raise
 
 
+def _send_deferred_batch(messages, queue, attempt=1):
+  """ Send each message, re-queueing only the ones that failed
+
+    Errors are not raised since that would make the task queue retry messages
+    that were already sent. Returns number of messages sent.
+  """
+  failed = []
+  for message in messages:
+    try:
+      message.send()
+    except (gaemail.Error, apiproxy_errors.Error), err:
+      logger.warning('Sending email to %s failed (attempt %d): %s', message.to, attempt, err)
+      failed.append(message)
+
+  if failed:
+    if attempt < MAX_ATTEMPTS:
+      queue.defer(_send_deferred_batch, failed, queue, attempt=attempt + 1,
+                  _countdown=RETRY_COUNTDOWN)
+    else:
+      logger.error('Giving up on %d emails after %d attempts: %s', len(failed), attempt,
+                   ', '.join(unicode(message.to) for message in failed))
+  return len(messages) - len(failed)
+
+
 class EmailBackend(BaseEmailBackend):
-  """ Asynchronous email backend """
+  """ Asynchronous email backend
+
+    Each message is sent in its own deferred task, or if batch_size (default:
+    settings.EMAIL_BATCH_SIZE) is more than 1, messages are sent in chunks of
+    that size, with failed messages retried individually.
+  """
+
+  def __init__(self, fail_silently=False, batch_size=None, queue=None, **kwargs):
+    super(EmailBackend, self).__init__(fail_silently=fail_silently, **kwargs)
+    if batch_size is None:
+      batch_size = getattr(settings, 'EMAIL_BATCH_SIZE', 1)
+    self.batch_size = batch_size
+    self.queue = queue or DeferredQueue(getattr(settings, 'EMAIL_QUEUE_NAME', 'default'))
 
   def send_messages(self, email_messages):
-    """ Call _send for each message & return count of messages """
+    """ Queue messages for sending & return count of messages queued """
+    if self.batch_size > 1:
+      return self._send_batched(email_messages)
 
     num_sent = 0
     for message in email_messages:
@@ -64,25 +107,37 @@ class EmailBackend(BaseEmailBackend):
           break
     return gmsg
 
-  def _send(self, message):
-    """
-    Use _copy_message to convert to gae email obj
-    Call _defer_message to add to send queue
-    """
+  def _convert(self, message):
+    """ Use _copy_message to convert to gae email obj; None if that fails """
     try:
-      message = self._copy_message(message)
+      return self._copy_message(message)
     except (ValueError, gaemail.InvalidEmailError), err:
       logger.error(err)
       if not self.fail_silently:
         raise
+      return None
+
+  def _send(self, message):
+    """
+    Use _convert to get gae email obj
+    Call _defer_message to add to send queue
+    """
+    message = self._convert(message)
+    if message is None:
       return False
     self._defer_message(message)
     return True
 
+  def _send_batched(self, email_messages):
+    """ Convert all messages, then defer them in chunks of batch_size """
+    messages = [self._convert(message) for message in email_messages]
+    messages = [message for message in messages if message is not None]
+    for i in range(0, len(messages), self.batch_size):
+      self.queue.defer(_send_deferred_batch, messages[i:i + self.batch_size], self.queue)
+    return len(messages)
+
   def _defer_message(self, message):
-    queue_name = getattr(settings, 'EMAIL_QUEUE_NAME', 'default')
-    deferred.defer(_send_deferred, message, fail_silently=self.fail_silently,
-                   _queue=queue_name)
+    self.queue.defer(_send_deferred, message, fail_silently=self.fail_silently)
 
 # Djangoappengine license:
 
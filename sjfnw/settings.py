@@ -88,16 +88,55 @@ LOGGING = {'version': 1}
 
 EMAIL_BACKEND = 'sjfnw.mail.EmailBackend'
 EMAIL_QUEUE_NAME = 'default'
+# Messages per deferred task when sending several at once. 1 = one task each
+EMAIL_BATCH_SIZE = 50
+
+# Task queue for grants reports generated in the background
+REPORT_QUEUE_NAME = 'default'
 
 USE_TZ = True
 TIME_ZONE = 'America/Los_Angeles'
 
-DEFAULT_FILE_STORAGE = 'sjfnw.grants.storage.BlobstoreStorage'
+DEFAULT_FILE_STORAGE = 'sjfnw.grants.storage.FileBackendStorage'
 FILE_UPLOAD_MAX_MEMORY_SIZE = 1024 * 1024
-FILE_UPLOAD_HANDLERS = ('sjfnw.grants.storage.BlobstoreFileUploadHandler',)
+FILE_UPLOAD_HANDLERS = ('sjfnw.grants.storage.FileBackendUploadHandler',)
+# where uploaded files are stored; see sjfnw.grants.storage
+FILE_BACKEND = 'sjfnw.grants.storage.BlobstoreBackend'
+# number of blobs whose metadata each instance keeps in memory
+BLOB_STAT_CACHE_SIZE = 1000
 
 TEST_RUNNER = 'sjfnw.tests.base.ColorTestSuiteRunner'
 
+CACHES = {
+  'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+  },
+  'memcache': {
+    'BACKEND': 'sjfnw.cache.AppEngineMemcache'
+  }
+}
+
+# Alias from CACHES used to cache MembershipMiddleware lookups.
+# None uses a short-lived local memory cache in each instance.
+MEMBERSHIP_CACHE = None
+
+# Alias from CACHES for the years listed by admin year filters. None uses a
+# local memory cache in each instance.
+YEAR_FILTER_CACHE = 'memcache'
+
+# Alias from CACHES that buffers draft application autosaves. None writes each
+# autosave straight to the database. Only set this to a cache that is shared by
+# all instances and never evicts entries; unflushed autosaves in an evicted
+# entry are lost, so memcache is not suitable.
+AUTOSAVE_BUFFER_CACHE = None
+# Buffered autosaves are written to the database this long after the first
+# unsaved change, and when the application is loaded or submitted
+AUTOSAVE_FLUSH_SECONDS = 300
+AUTOSAVE_QUEUE_NAME = 'default'
+if 'test' in sys.argv:
+  # local, so it can be cleared between tests
+  YEAR_FILTER_CACHE = None
+
 # Determines whether site is in maintenance mode. See urls.py
 MAINTENANCE = False
 # Date and/or time when site is expected to be out of maintenance mode.
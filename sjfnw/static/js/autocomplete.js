@@ -0,0 +1,82 @@
+'use strict';
+/** Admin autocomplete - see sjfnw/autocomplete.py **/
+
+(function ($) {
+  var DELAY = 250; // ms to wait after typing before searching
+  var timers = {};
+  var nextId = 0;
+
+  function widgetId($widget) {
+    if (!$widget.data('autocompleteId')) {
+      nextId += 1;
+      $widget.data('autocompleteId', nextId);
+    }
+    return $widget.data('autocompleteId');
+  }
+
+  /**
+   * @param {jQuery} $widget - span.autocomplete
+   * @param {number} page - page of results to load, starting at 1
+   */
+  function search($widget, page) {
+    var query = $widget.find('.autocomplete-text').val();
+    var $results = $widget.find('.autocomplete-results');
+    if (page === 1) {
+      $results.empty();
+    }
+    if (!$.trim(query)) {
+      $results.hide();
+      return;
+    }
+    $.getJSON($widget.data('url'), { q: query, page: page }, function (data) {
+      if ($widget.find('.autocomplete-text').val() !== query) {
+        return; // typed more while this was loading
+      }
+      $results.find('.autocomplete-more').remove();
+      $.each(data.results, function (i, result) {
+        $('<li class="autocomplete-result">')
+          .text(result.text)
+          .data('id', result.id)
+          .appendTo($results);
+      });
+      if (data.more) {
+        $('<li class="autocomplete-more">Show more</li>')
+          .data('page', page + 1)
+          .appendTo($results);
+      }
+      if (!data.results.length && page === 1) {
+        $('<li class="autocomplete-none">No matches</li>').appendTo($results);
+      }
+      $results.show();
+    });
+  }
+
+  $(document).on('input', '.autocomplete-text', function () {
+    var $widget = $(this).closest('.autocomplete');
+    var id = widgetId($widget);
+    // the previous choice no longer matches what's typed
+    $widget.find('input[type="hidden"]').val('');
+    clearTimeout(timers[id]);
+    timers[id] = setTimeout(function () {
+      search($widget, 1);
+    }, DELAY);
+  });
+
+  $(document).on('click', '.autocomplete-result', function () {
+    var $result = $(this);
+    var $widget = $result.closest('.autocomplete');
+    $widget.find('input[type="hidden"]').val($result.data('id'));
+    $widget.find('.autocomplete-text').val($result.text());
+    $widget.find('.autocomplete-results').empty().hide();
+  });
+
+  $(document).on('click', '.autocomplete-more', function () {
+    search($(this).closest('.autocomplete'), $(this).data('page'));
+  });
+
+  $(document).on('click', function (event) {
+    if (!$(event.target).closest('.autocomplete').length) {
+      $('.autocomplete-results').hide();
+    }
+  });
+})(django.jQuery);
@@ -33,14 +33,17 @@ formUtils.statusTexts = { // for ajax error messages
  * @param {number} submitId - pk of object used in post (cycle or award)
  * @param {string.alphanum} userId - randomly generated user id for mult edit warning
  * @param {string} staffUser - querystring for user override (empty string if n/a)
+ * @param {number} draftVersion - version of the draft when the page was loaded
+ * @param {object} draftContents - stored contents of the draft when the page was loaded
  */
-formUtils.init = function(urlPrefix, draftId, submitId, userId, staffUser) {
+formUtils.init = function(urlPrefix, draftId, submitId, userId, staffUser, draftVersion,
+                          draftContents) {
   if (staffUser && staffUser !== 'None') {
     formUtils.staffUser = staffUser;
   } else {
     formUtils.staffUser = '';
   }
-  autoSave.init(urlPrefix, submitId, userId);
+  autoSave.init(urlPrefix, submitId, userId, draftVersion, draftContents);
   fileUploads.init(urlPrefix, draftId);
 };
 
@@ -106,7 +109,7 @@ autoSave.saveTimer = false;
 autoSave.pauseTimer = false;
 
 
-autoSave.init = function(urlPrefix, submitId, userId) {
+autoSave.init = function(urlPrefix, submitId, userId, draftVersion, draftContents) {
   autoSave.submitUrl = '/' + urlPrefix + '/' + submitId;
   autoSave.saveUrl = autoSave.submitUrl + '/autosave' + formUtils.staffUser;
   autoSave.submitUrl += formUtils.staffUser;
@@ -115,11 +118,53 @@ autoSave.init = function(urlPrefix, submitId, userId) {
   } else {
     autoSave.userId = '';
   }
+  // only fields that differ from the stored draft are sent. compare with what is
+  // stored rather than the page, so values the form pre-fills are saved too
+  autoSave.version = draftVersion || 0;
+  autoSave.lastSaved = draftContents || {};
   formUtils.log('Autosave variables loaded');
   autoSave.resume();
 };
 
 
+/**
+ * Return current form values as an object of field name to value.
+ * If a name appears more than once, the last value is used (as the server does).
+ */
+autoSave.formFields = function() {
+  var fields = {};
+  $.each($('form').serializeArray(), function(i, field) {
+    fields[field.name] = field.value;
+  });
+  return fields;
+};
+
+
+/**
+ * Return post data for fields that changed since autoSave.lastSaved.
+ * Fields that are no longer in the form are listed in removed_fields.
+ *
+ * @param {object} fields - current fields from autoSave.formFields
+ */
+autoSave.changedData = function(fields) {
+  var changed = {};
+  var removed = [];
+  $.each(fields, function(name, value) {
+    if (autoSave.lastSaved[name] !== value) {
+      changed[name] = value;
+    }
+  });
+  $.each(autoSave.lastSaved, function(name) {
+    if (!fields.hasOwnProperty(name)) {
+      removed.push(name);
+    }
+  });
+  changed.user_id = autoSave.userId;
+  changed.removed_fields = removed.join(',');
+  return $.param(changed);
+};
+
+
 autoSave.pause = function() {
   if ( !window.onfocus ) {
     formUtils.log('autoSave.pause called; setting timer to pause');
@@ -172,20 +217,35 @@ autoSave.resume = function (firstTime) {
 };
 
 autoSave.save = function (submit, force) {
+  var forceParam;
   if (formUtils.staffUser) { // TODO use querystring function
-    force = '&force=' + force || 'false';
+    forceParam = '&force=' + force || 'false';
   } else {
-    force = '?force=' + force || 'false';
+    forceParam = '?force=' + force || 'false';
   }
 
   formUtils.log('Autosaving');
 
+  var fields = autoSave.formFields();
+  var url = autoSave.saveUrl + forceParam;
+  var data;
+  if (autoSave.version === null) {
+    // full save - the draft changed elsewhere since our last save
+    data = $.param($.extend({}, fields, {user_id: autoSave.userId}));
+  } else {
+    url += '&version=' + autoSave.version;
+    data = autoSave.changedData(fields);
+  }
+
   $.ajax({
-    url: autoSave.saveUrl + force,
+    url: url,
     type: 'POST',
-    data: $('form').serialize() + '&user_id=' + autoSave.userId,
+    data: data,
     success: function(data, textStatus, jqXHR) {
-      if (jqXHR.status === 200) {
+      // 304 means nothing had changed since the last save
+      if (jqXHR.status === 200 || jqXHR.status === 304) {
+        autoSave.lastSaved = fields;
+        autoSave.version = jqXHR.getResponseHeader('X-Draft-Version') || autoSave.version;
         if (submit) {
           // button click - trigger the hidden submit button
           var submitAll = document.getElementById('hidden_submit_app');
@@ -200,7 +260,12 @@ autoSave.save = function (submit, force) {
     },
     error: function(jqXHR, textStatus) {
       var errortext = '';
-      if (jqXHR.status === 409)  {
+      if (jqXHR.status === 412) {
+        // our version is stale, so changes can't be merged. resend the whole form
+        formUtils.log('Draft version is stale; sending full save');
+        autoSave.version = null;
+        autoSave.save(submit, force);
+      } else if (jqXHR.status === 409)  {
         // conflict - pause autosave and confirm force
         window.clearInterval(autoSave.saveTimer);
         showConflictWarning('autosave'); // method defined in org_app.html
@@ -0,0 +1,101 @@
+import logging
+from multiprocessing.pool import ThreadPool
+import threading
+
+from django.db import connections
+
+from google.appengine.ext import deferred
+
+logger = logging.getLogger('sjfnw')
+
+# Task queues
+# -----------
+# Background work is handed to a queue's defer(func, *args, **kwargs). Task
+# options understood by App Engine (_countdown, _queue, etc.) may be passed as
+# keyword args; the local queues ignore them.
+#
+# DeferredQueue - App Engine's deferred library; used in production
+# LocalQueue - stores tasks until run() is called
+# ThreadPoolQueue - runs tasks on worker threads; join() waits for them
+
+def _task_kwargs(kwargs):
+  """ Drop App Engine task options like _countdown """
+  return {key: val for key, val in kwargs.iteritems() if not key.startswith('_')}
+
+
+class DeferredQueue(object):
+  """ Runs tasks using App Engine's deferred library """
+
+  def __init__(self, queue_name):
+    self.queue_name = queue_name
+
+  def defer(self, func, *args, **kwargs):
+    deferred.defer(func, *args, _queue=self.queue_name, **kwargs)
+
+
+class LocalQueue(object):
+  """ In-process stand-in for DeferredQueue, for tests and local debugging.
+    Tasks are stored until run() is called """
+
+  def __init__(self):
+    self.tasks = []
+
+  def defer(self, func, *args, **kwargs):
+    self.tasks.append((func, args, _task_kwargs(kwargs)))
+
+  def run(self):
+    """ Run tasks, including any they add, until the queue is empty.
+      Returns number of tasks run """
+    count = 0
+    while self.tasks:
+      func, args, kwargs = self.tasks.pop(0)
+      func(*args, **kwargs)
+      count += 1
+    return count
+
+
+class ThreadPoolQueue(object):
+  """ Stand-in for DeferredQueue that runs tasks on a pool of threads
+
+    With share_connections, tasks use the database connections of the thread
+    that created the queue and run one at a time. Tests need this to see data
+    from their own transaction.
+  """
+
+  def __init__(self, workers=2, share_connections=False):
+    self.pool = ThreadPool(workers)
+    self.results = []
+    self.lock = threading.Lock() if share_connections else None
+    self.connections = {}
+    if share_connections:
+      for conn in connections.all():
+        conn.allow_thread_sharing = True
+        self.connections[conn.alias] = conn
+
+  def defer(self, func, *args, **kwargs):
+    self.results.append(self.pool.apply_async(self._run, (func, args, _task_kwargs(kwargs))))
+
+  def _run(self, func, args, kwargs):
+    if self.lock:
+      with self.lock:
+        for alias, conn in self.connections.items():
+          connections[alias] = conn
+        return func(*args, **kwargs)
+    try:
+      return func(*args, **kwargs)
+    finally:
+      for conn in connections.all():
+        conn.close()
+
+  def join(self, timeout=30):
+    """ Wait for tasks, including any they add, to finish. Re-raises the first
+      error from a task. Returns number of tasks run """
+    count = 0
+    while count < len(self.results):
+      self.results[count].get(timeout)
+      count += 1
+    return count
+
+  def close(self):
+    self.pool.close()
+    self.pool.join()
@@ -6,6 +6,8 @@ from django.contrib.auth.models import User
 from django.test import TestCase
 from django.test.runner import DiscoverRunner
 
+from sjfnw.cache import year_cache
+from sjfnw.fund.middleware import membership_cache
 from sjfnw.fund.models import Member
 
 logger = logging.getLogger('sjfnw')
@@ -25,6 +27,12 @@ class BaseTestCase(TestCase):
 
   BASE_URL = 'http://testserver'
 
+  def _pre_setup(self):
+    super(BaseTestCase, self)._pre_setup()
+    # cached memberships and years would outlive the test's database changes
+    membership_cache.clear()
+    year_cache.clear()
+
   def login_as_member(self, name):
     if name == "first":
       User.objects.create_user('firstacct@gmail.com', 'firstacct@gmail.com', 'one')
@@ -0,0 +1,157 @@
+import datetime, json
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from sjfnw.autocomplete import PAGE_SIZE
+from sjfnw.fund.models import GivingProject, Member, Membership
+from sjfnw.grants.tests.base import BaseGrantTestCase
+
+
+class Autocomplete(BaseGrantTestCase):
+
+  def setUp(self):
+    super(Autocomplete, self).setUp()
+    self.login_as_admin()
+
+  def search(self, source, query, page=1, **params):
+    params.update({'q': query, 'page': page})
+    response = self.client.get('/admin/autocomplete/{}/'.format(source), params)
+    self.assertEqual(response.status_code, 200)
+    return json.loads(response.content)
+
+  def test_member(self):
+    Member.objects.create(first_name='Ada', last_name='Lovelace', email='ada@example.com')
+    Member.objects.create(first_name='Grace', last_name='Hopper', email='grace@example.com')
+
+    data = self.search('member', 'love')
+    self.assertEqual([result['text'] for result in data['results']], ['Ada Lovelace'])
+    self.assertFalse(data['more'])
+
+    data = self.search('member', 'grace@ex')
+    self.assertEqual([result['text'] for result in data['results']], ['Grace Hopper'])
+
+    # every word must match
+    self.assertEqual(self.search('member', 'ada hopper')['results'], [])
+
+  def test_membership(self):
+    member = Member.objects.create(first_name='Ada', last_name='Lovelace',
+                                   email='ada@example.com')
+    ship = Membership.objects.create(member=member, giving_project=GivingProject.objects.first())
+
+    data = self.search('membership', 'ada')
+    self.assertEqual(data['results'], [{'id': ship.pk, 'text': unicode(ship)}])
+
+  def test_organization(self):
+    data = self.search('organization', 'office')
+    self.assertEqual(data['results'], [{'id': 2, 'text': 'OfficeMax Foundation'}])
+
+    data = self.search('organization', 'neworg@')
+    self.assertEqual([result['id'] for result in data['results']], [1])
+
+  def test_grantapplication(self):
+    data = self.search('grantapplication', 'officemax')
+    self.assertEqual(sorted(result['id'] for result in data['results']), [1, 2])
+
+  def test_grantapplication_submitted_after(self):
+    data = self.search('grantapplication', 'officemax', submitted_after='2013-03-01')
+    self.assertEqual([result['id'] for result in data['results']], [2])
+
+    response = self.client.get('/admin/autocomplete/grantapplication/',
+                               {'q': 'officemax', 'submitted_after': 'March'})
+    self.assertEqual(response.status_code, 400)
+
+  def test_pages(self):
+    Member.objects.bulk_create([
+      Member(first_name='Pat', last_name='Number{:02d}'.format(i),
+             email='pat{}@example.com'.format(i))
+      for i in range(PAGE_SIZE + 5)
+    ])
+
+    first = self.search('member', 'pat')
+    self.assert_length(first['results'], PAGE_SIZE)
+    self.assertTrue(first['more'])
+
+    second = self.search('member', 'pat', page=2)
+    self.assert_length(second['results'], 5)
+    self.assertFalse(second['more'])
+    first_ids = set(r['id'] for r in first['results'])
+    self.assertEqual(first_ids & set(r['id'] for r in second['results']), set())
+
+  def test_empty_query(self):
+    self.assertEqual(self.search('member', '  '), {'results': [], 'more': False})
+
+  def test_unknown_source(self):
+    response = self.client.get('/admin/autocomplete/user/', {'q': 'a'})
+    self.assertEqual(response.status_code, 404)
+
+  def test_invalid_page(self):
+    response = self.client.get('/admin/autocomplete/member/', {'q': 'a', 'page': 'two'})
+    self.assertEqual(response.status_code, 400)
+
+  def test_staff_only(self):
+    User.objects.create_user('notstaff@gmail.com', 'notstaff@gmail.com', 'pass')
+    self.client.login(username='notstaff@gmail.com', password='pass')
+    response = self.client.get('/admin/autocomplete/member/', {'q': 'a'})
+    self.assertEqual(response.status_code, 302)
+
+
+class AutocompleteAdmin(BaseGrantTestCase):
+
+  def setUp(self):
+    super(AutocompleteAdmin, self).setUp()
+    self.login_as_admin()
+
+  def test_membership_inline(self):
+    member = Member.objects.create(first_name='Ada', last_name='Lovelace',
+                                   email='ada@example.com')
+    gp = GivingProject.objects.first()
+    Membership.objects.create(member=member, giving_project=gp)
+
+    response = self.client.get('/admin/fund/givingproject/{}/'.format(gp.pk))
+    self.assertEqual(response.status_code, 200)
+    self.assertContains(response, 'data-url="/admin/autocomplete/member/"')
+    self.assertContains(response, 'value="Ada Lovelace"')
+    self.assertNotContains(response, '<option value="{}">'.format(member.pk))
+
+  def test_project_app_inline(self):
+    """ Only applications submitted within a year of the deadline are searched """
+    gp = GivingProject.objects.first()
+
+    response = self.client.get('/admin/fund/givingproject/{}/'.format(gp.pk))
+
+    submitted_after = gp.fundraising_deadline - datetime.timedelta(weeks=52)
+    self.assertContains(response, 'data-url="/admin/autocomplete/grantapplication/'
+                                  '?submitted_after={}"'.format(submitted_after))
+
+  def test_inline_labels_batched(self):
+    """ Labels for all membership rows are looked up together """
+    gp = GivingProject.objects.first()
+    url = '/admin/fund/givingproject/{}/'.format(gp.pk)
+
+    def count_queries():
+      with CaptureQueriesContext(connection) as queries:
+        self.assertEqual(self.client.get(url).status_code, 200)
+      return len(queries)
+
+    Member.objects.create(first_name='Ada', last_name='Lovelace', email='ada@example.com')
+    for member in Member.objects.all():
+      Membership.objects.get_or_create(member=member, giving_project=gp)
+    count_queries() # first request loads things that are cached after
+    before = count_queries()
+
+    for i in range(3):
+      member = Member.objects.create(first_name='Pat', last_name=str(i),
+                                     email='pat{}@example.com'.format(i))
+      Membership.objects.create(member=member, giving_project=gp)
+
+    self.assertEqual(count_queries(), before)
+
+  def test_login_as_org(self):
+    response = self.client.get('/admin/grants/organization/login')
+    self.assertContains(response, 'data-url="/admin/autocomplete/organization/"')
+
+    response = self.client.post('/admin/grants/organization/login', {'organization': 2})
+    self.assertEqual(response.status_code, 302)
+    self.assertTrue(response.url.endswith('/apply/?user=testorg@gmail.com'))
@@ -0,0 +1,99 @@
+from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.test import TestCase
+
+from google.appengine.api import mail as gaemail
+from google.appengine.ext import testbed
+
+from sjfnw import mail
+from sjfnw.mail import EmailBackend
+from sjfnw.tasks import LocalQueue
+
+
+class FailingMessage(object):
+  """ Wraps an App Engine message so it fails to send the given number of times """
+
+  def __init__(self, failures, to):
+    self.failures = failures
+    self.to = to
+    self.message = gaemail.EmailMessage(sender='sender@gmail.com', to=to,
+                                        subject='Subject', body='Body')
+
+  def send(self):
+    if self.failures:
+      self.failures -= 1
+      raise gaemail.Error('Failed to send')
+    self.message.send()
+
+
+class BatchedEmail(TestCase):
+
+  def setUp(self):
+    self.testbed = testbed.Testbed()
+    self.testbed.activate()
+    self.testbed.init_mail_stub()
+    self.mail_stub = self.testbed.get_stub(testbed.MAIL_SERVICE_NAME)
+    self.queue = LocalQueue()
+
+  def tearDown(self):
+    self.testbed.deactivate()
+
+  def create_messages(self, count):
+    return [EmailMessage('Subject {}'.format(i), 'Body', 'sender@gmail.com',
+                         ['to{}@gmail.com'.format(i)])
+            for i in range(count)]
+
+  def test_chunks(self):
+    backend = EmailBackend(batch_size=2, queue=self.queue)
+
+    sent = backend.send_messages(self.create_messages(5))
+
+    self.assertEqual(sent, 5)
+    self.assertEqual(len(self.queue.tasks), 3)
+    self.assertEqual(len(self.mail_stub.get_sent_messages()), 0)
+    self.assertEqual(self.queue.run(), 3)
+    self.assertEqual(len(self.mail_stub.get_sent_messages()), 5)
+
+  def test_html_alternative(self):
+    backend = EmailBackend(batch_size=10, queue=self.queue)
+    message = EmailMultiAlternatives('Subject', 'Body', 'sender@gmail.com', ['to@gmail.com'])
+    message.attach_alternative('<p>Body</p>', 'text/html')
+
+    backend.send_messages([message])
+    self.queue.run()
+
+    sent = self.mail_stub.get_sent_messages(to='to@gmail.com')
+    self.assertEqual(len(sent), 1)
+    self.assertEqual(sent[0].html.decode(), '<p>Body</p>')
+
+  def test_unbatched(self):
+    backend = EmailBackend(batch_size=1, queue=self.queue)
+
+    backend.send_messages(self.create_messages(3))
+
+    self.assertEqual(self.queue.run(), 3)
+    self.assertEqual(len(self.mail_stub.get_sent_messages()), 3)
+
+  def test_failure_isolated_and_retried(self):
+    messages = [FailingMessage(0, 'ok@gmail.com'), FailingMessage(1, 'retry@gmail.com')]
+    self.queue.defer(mail._send_deferred_batch, messages, self.queue)
+
+    self.assertEqual(self.queue.run(), 2) # original + retry of failed message
+
+    self.assertEqual(len(self.mail_stub.get_sent_messages(to='ok@gmail.com')), 1)
+    self.assertEqual(len(self.mail_stub.get_sent_messages(to='retry@gmail.com')), 1)
+
+  def test_gives_up(self):
+    message = FailingMessage(mail.MAX_ATTEMPTS, 'fail@gmail.com')
+    self.queue.defer(mail._send_deferred_batch, [message], self.queue)
+
+    self.assertEqual(self.queue.run(), mail.MAX_ATTEMPTS)
+    self.assertEqual(len(self.mail_stub.get_sent_messages()), 0)
+
+  def test_invalid_message(self):
+    backend = EmailBackend(fail_silently=True, batch_size=10, queue=self.queue)
+    messages = self.create_messages(2)
+    messages[0].from_email = None
+
+    self.assertEqual(backend.send_messages(messages), 1)
+    self.queue.run()
+    self.assertEqual(len(self.mail_stub.get_sent_messages()), 1)
@@ -1,3 +1,4 @@
+from django.contrib.auth.models import User
 from django.test import TestCase
 
 from sjfnw import utils
@@ -14,3 +15,24 @@ class CreateLink(TestCase):
   def test_new_window(self):
     link = utils.create_link(self.url, self.text, new_tab=True)
     self.assertEqual(link, '<a href="{}" target="_blank">{}</a>'.format(self.url, self.text))
+
+
+class StageTimer(TestCase):
+
+  def test_summary(self):
+    timer = utils.StageTimer()
+    with timer.stage('first'):
+      pass
+    with timer.stage('second'):
+      pass
+    self.assertRegexpMatches(timer.summary(), r'^first: \d+ms, second: \d+ms$')
+
+  def test_count_queries(self):
+    timer = utils.StageTimer(count_queries=True)
+    with timer.stage('query'):
+      list(User.objects.all())
+      User.objects.count()
+    with timer.stage('none'):
+      pass
+    self.assertRegexpMatches(timer.summary(),
+                             r'^query: \d+ms \(2 queries\), none: \d+ms \(0 queries\)$')
@@ -44,6 +44,7 @@ else:
     (r'^admin/grants/grantapplication/(?P<app_id>\d+)/rollover',
       'sjfnw.grants.views.admin_rollover'),
     (r'^admin/grants/organization/login', 'sjfnw.grants.views.login_as_org'),
+    (r'^admin/autocomplete/(?P<source>\w+)/$', 'sjfnw.views.autocomplete'),
     (r'^admin/grants/givingprojectgrant/yer-status', 'sjfnw.grants.views.show_yer_statuses'),
 
     (r'^admin-advanced/', include(advanced_admin.urls)),
@@ -56,6 +57,10 @@ else:
       'sjfnw.grants.views.merge_orgs'),
 
     # reporting
+    (r'^admin/grants/search/export/(?P<export_id>\d+)/?$',
+      'sjfnw.grants.views.report_export_status'),
+    (r'^admin/grants/search/export/(?P<export_id>\d+)/download/?$',
+      'sjfnw.grants.views.report_export_download'),
     (r'^admin/grants/search/?', 'sjfnw.grants.views.grants_report'),
 
     # cron emails
@@ -65,6 +70,9 @@ else:
     (r'^mail/drafts/?', 'sjfnw.grants.cron.draft_app_warning'),
     (r'^mail/yer/?', 'sjfnw.grants.cron.yer_reminder_email'),
 
+    # cron maintenance
+    (r'^cron/progress/?', 'sjfnw.fund.cron.refresh_progress'),
+
     # dev
     (r'^dev/jslog/?', 'sjfnw.views.log_javascript')
   )
@@ -1,3 +1,49 @@
+from contextlib import contextmanager
+import time
+
+from django.db import connection
+
 def create_link(url, text, new_tab=False):
   new_tab = ' target="_blank"' if new_tab else ''
   return '<a href="{}"{}>{}</a>'.format(url, new_tab, text)
+
+
+class StageTimer(object):
+  """ Records how long each stage of a job takes, and optionally how many
+    database queries it makes
+
+    timer = StageTimer(count_queries=True)
+    with timer.stage('query'):
+      ...
+    timer.summary() # 'query: 12ms (2 queries)'
+  """
+
+  def __init__(self, count_queries=False):
+    self.stages = [] # list of (name, seconds, queries or None)
+    self.count_queries = count_queries
+
+  @contextmanager
+  def stage(self, name):
+    if self.count_queries:
+      # log queries even when DEBUG is off, and count the ones this stage adds
+      debug_cursor = connection.force_debug_cursor
+      connection.force_debug_cursor = True
+      logged = len(connection.queries_log)
+    start = time.time()
+    try:
+      yield
+    finally:
+      queries = None
+      if self.count_queries:
+        queries = len(connection.queries_log) - logged
+        connection.force_debug_cursor = debug_cursor
+      self.stages.append((name, time.time() - start, queries))
+
+  def summary(self):
+    parts = []
+    for name, seconds, queries in self.stages:
+      part = '{}: {:.0f}ms'.format(name, seconds * 1000)
+      if queries is not None:
+        part += ' ({} queries)'.format(queries)
+      parts.append(part)
+    return ', '.join(parts)
@@ -2,9 +2,11 @@ import logging
 
 from django import http
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.shortcuts import render
 
 from sjfnw import constants as c
+from sjfnw.autocomplete import PAGE_SIZE, SOURCES
 
 logger = logging.getLogger('sjfnw')
 
@@ -57,3 +59,29 @@ def log_javascript(request):
       log = log + '\n' + key + ': ' + str(request.POST[key])
     logger.warning(log)
   return http.HttpResponse('success')
+
+@staff_member_required
+def autocomplete(request, source):
+  """ A page of search results for AutocompleteWidget, as json """
+  if source not in SOURCES:
+    raise http.Http404
+  query = request.GET.get('q', '').strip()
+  try:
+    page = max(int(request.GET.get('page', 1)), 1)
+  except ValueError:
+    return http.HttpResponseBadRequest('Invalid page')
+
+  results = []
+  if query:
+    try:
+      matches = SOURCES[source].filter(SOURCES[source].search(query), request.GET)
+    except ValueError:
+      return http.HttpResponseBadRequest('Invalid filter')
+    start = (page - 1) * PAGE_SIZE
+    # fetch one extra to find out if there's another page
+    results = list(matches[start:start + PAGE_SIZE + 1])
+  return http.JsonResponse({
+    'results': [{'id': obj.pk, 'text': SOURCES[source].label(obj)}
+                for obj in results[:PAGE_SIZE]],
+    'more': len(results) > PAGE_SIZE
+  })